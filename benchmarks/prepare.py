@@ -0,0 +1,144 @@
+# encoding: utf-8
+"""
+Microbenchmark for ``SearchIndex.full_prepare``.
+
+Compares the compiled preparation plan against the previous implementation
+(re-created below) on an index with 40+ fields. Run from the repository
+root::
+
+    python benchmarks/prepare.py [--objects=2000] [--repeat=5]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_searchstack.settings')
+
+import django  # NOQA
+django.setup()
+
+from django.utils.encoding import force_text  # NOQA
+
+from searchstack import indexes  # NOQA
+from searchstack.constants import DJANGO_CT, DJANGO_ID, ID  # NOQA
+from searchstack.exceptions import SearchFieldError  # NOQA
+from searchstack.utils import get_identifier, get_model_ct  # NOQA
+from searchstack.utils.loading import UnifiedIndex  # NOQA
+from test_searchstack.core.models import MockModel, MockTag  # NOQA
+
+
+def build_index_class():
+    attrs = {
+        'text': indexes.CharField(document=True, model_attr='author'),
+        'get_model': lambda self: MockModel,
+        'prepare_custom_0': lambda self, obj: obj.author.upper(),
+        'prepare_custom_1': lambda self, obj: len(obj.author),
+    }
+
+    for i in range(10):
+        attrs['author_%d' % i] = indexes.CharField(model_attr='author', faceted=True)
+        attrs['tag_%d' % i] = indexes.CharField(model_attr='tag__name')
+        attrs['pub_date_%d' % i] = indexes.DateTimeField(model_attr='pub_date')
+        attrs['foo_%d' % i] = indexes.CharField(model_attr='foo', null=True)
+
+    for i in range(2):
+        attrs['custom_%d' % i] = indexes.CharField(null=True)
+
+    return type(str('BenchmarkIndex'), (indexes.SearchIndex, indexes.Indexable), attrs)
+
+
+def legacy_field_prepare(field, obj):
+    # ``SearchField.prepare`` before the lookup path was cached.
+    if field.model_attr is None:
+        return field.convert(field.default if field.has_default() else None)
+
+    current_object = obj
+
+    for attr in field.model_attr.split('__'):
+        if not hasattr(current_object, attr):
+            raise SearchFieldError("The model '%s' does not have a model_attr '%s'." % (repr(current_object), attr))
+
+        current_object = getattr(current_object, attr, None)
+
+        if current_object is None:
+            break
+
+    if callable(current_object):
+        current_object = current_object()
+
+    return field.convert(current_object)
+
+
+def legacy_full_prepare(index, obj):
+    # ``SearchIndex.prepare`` & ``full_prepare`` before the preparation plan.
+    index.prepared_data = {
+        ID: get_identifier(obj),
+        DJANGO_CT: get_model_ct(obj),
+        DJANGO_ID: force_text(obj.pk),
+    }
+
+    for field_name, field in index.fields.items():
+        index.prepared_data[field.index_fieldname] = legacy_field_prepare(field, obj)
+
+        if hasattr(index, "prepare_%s" % field_name):
+            value = getattr(index, "prepare_%s" % field_name)(obj)
+            index.prepared_data[field.index_fieldname] = value
+
+    for field_name, field in index.fields.items():
+        if getattr(field, 'facet_for', None):
+            source_field_name = index.fields[field.facet_for].index_fieldname
+
+            if index.prepared_data[field_name] is None and source_field_name in index.prepared_data:
+                index.prepared_data[field.index_fieldname] = index.prepared_data[source_field_name]
+
+        if field.null is True:
+            if index.prepared_data[field.index_fieldname] is None:
+                del index.prepared_data[field.index_fieldname]
+
+    return index.prepared_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--objects', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    index = build_index_class()()
+    UnifiedIndex().build(indexes=[index])
+
+    tag = MockTag(name='primary')
+    objects = []
+
+    for pk in range(1, args.objects + 1):
+        obj = MockModel(pk=pk, author='author %d' % pk, foo='' if pk % 2 else None,
+                        pub_date=datetime.datetime(2016, 1, 1))
+        obj.tag = tag
+        objects.append(obj)
+
+    # Both implementations must agree before their timings mean anything.
+    for obj in objects[:10]:
+        assert legacy_full_prepare(index, obj) == index.full_prepare(obj)
+
+    timings = [
+        ('legacy', min(timeit.repeat(lambda: [legacy_full_prepare(index, obj) for obj in objects],
+                                     number=1, repeat=args.repeat))),
+        ('compiled plan', min(timeit.repeat(lambda: [index.full_prepare(obj) for obj in objects],
+                                            number=1, repeat=args.repeat))),
+    ]
+
+    print("full_prepare of %d objects, %d fields (best of %d):" % (args.objects, len(index.fields), args.repeat))
+
+    for name, seconds in timings:
+        print("  %-14s %8.1f ms  %8.1f us/object" % (name, seconds * 1000, seconds * 1000000 / args.objects))
+
+    print("  speedup        %8.2fx" % (timings[0][1] / timings[1][1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# encoding: utf-8
+"""
+Microbenchmark for rendering ``use_template`` fields.
+
+Compares resolving the template for every object (the previous behaviour),
+the cached template lookup & batched rendering with a single context. Run
+from the repository root::
+
+    python benchmarks/templates.py [--objects=5000] [--repeat=5]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_searchstack.settings')
+
+import django  # NOQA
+django.setup()
+
+from django.template import loader  # NOQA
+
+from searchstack.fields import CharField  # NOQA
+from test_searchstack.core.models import MockModel  # NOQA
+
+
+def legacy_prepare_template(field, obj):
+    # ``SearchField.prepare_template`` before templates were cached.
+    return loader.select_template(field.get_template_names(obj)).render({'object': obj})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--objects', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    field = CharField(document=True, use_template=True)
+    field.set_instance_name('text')
+    objects = [MockModel(pk=pk, author='author %d' % pk) for pk in range(1, args.objects + 1)]
+
+    # All three must agree before their timings mean anything.
+    expected = [legacy_prepare_template(field, obj) for obj in objects[:10]]
+    assert [field.prepare_template(obj) for obj in objects[:10]] == expected
+    assert field.prepare_template_batch(objects[:10]) == expected
+
+    def best(func):
+        return min(timeit.repeat(func, number=1, repeat=args.repeat))
+
+    timings = [
+        ('legacy', best(lambda: [legacy_prepare_template(field, obj) for obj in objects])),
+        ('cached', best(lambda: [field.prepare_template(obj) for obj in objects])),
+        ('batch', best(lambda: field.prepare_template_batch(objects))),
+    ]
+
+    print("Rendering %d objects (best of %d):" % (args.objects, args.repeat))
+
+    for name, seconds in timings:
+        print("  %-8s %8.1f ms  %6.1f us/object  %5.2fx" % (
+            name, seconds * 1000, seconds * 1000000 / args.objects, timings[0][1] / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,13 @@ from django import template
 from django.contrib.admin.options import ModelAdmin, csrf_protect_m
 from django.contrib.admin.views.main import SEARCH_VAR, ChangeList
 from django.core.exceptions import PermissionDenied
-from django.core.paginator import InvalidPage, Paginator
+from django.core.paginator import InvalidPage
 from django.shortcuts import render_to_response
 from django.utils.encoding import force_text
 from django.utils.translation import ungettext
 
 from . import connections
+from .paginator import SearchPaginator
 from .query import SearchQuerySet
 from .utils import get_model_ct_tuple
 
@@ -41,15 +42,10 @@ class SearchChangeList(ChangeList):
         # Note that pagination is 0-based, not 1-based.
         sqs = SearchQuerySet(self.searchstack_connection).models(self.model).auto_query(request.GET[SEARCH_VAR]).load_all()
 
-        paginator = Paginator(sqs, self.list_per_page)
-        # Get the number of objects, with admin filters applied.
-        result_count = paginator.count
-        full_result_count = SearchQuerySet(self.searchstack_connection).models(self.model).all().count()
-
-        can_show_all = result_count <= list_max_show_all(self)
-        multi_page = result_count > self.list_per_page
+        paginator = SearchPaginator(sqs, self.list_per_page)
 
-        # Get the list of objects to display on this page.
+        # Get the list of objects to display on this page, which also gets
+        # the number of objects, with admin filters applied.
         try:
             result_list = paginator.page(self.page_num + 1).object_list
             # Grab just the Django models, since that's what everything else is
@@ -58,7 +54,24 @@ class SearchChangeList(ChangeList):
         except InvalidPage:
             result_list = ()
 
+        result_count = paginator.count
+
+        # Counting every object of the model takes a search of its own.
+        show_full_result_count = getattr(self.model_admin, 'show_full_result_count', True)
+
+        if show_full_result_count:
+            full_result_count = SearchQuerySet(self.searchstack_connection).models(self.model).all().count()
+        else:
+            full_result_count = None
+
+        can_show_all = result_count <= list_max_show_all(self)
+        multi_page = result_count > self.list_per_page
+
         self.result_count = result_count
+        self.show_full_result_count = show_full_result_count
+        # As in Django's ChangeList, actions are also shown when objects
+        # aren't counted.
+        self.show_admin_actions = not show_full_result_count or bool(full_result_count)
         self.full_result_count = full_result_count
         self.result_list = result_list
         self.can_show_all = can_show_all
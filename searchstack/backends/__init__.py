@@ -2,23 +2,51 @@
 from __future__ import unicode_literals
 
 import copy
+import hashlib
+import json
+import operator
+import sys
+import threading
+from contextlib import contextmanager
 from copy import deepcopy
-from time import time
+from itertools import islice
+from time import sleep, time
 
 from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
 from django.db.models import Q
 from django.db.models.base import ModelBase
 from django.utils import six, tree
 from django.utils.encoding import force_text
 
-from ..constants import DEFAULT_ALIAS, FILTER_SEPARATOR, VALID_FILTERS
-from ..exceptions import FacetingError, MoreLikeThisError
+from ..constants import DEFAULT_ALIAS, DJANGO_CT, DJANGO_ID, FILTER_SEPARATOR, ID, VALID_FILTERS
+from ..exceptions import (CursorError, FacetingError, IndexingError, MoreLikeThisError, SearchFieldError,
+                          SkipDocument)
 from ..models import SearchResult
-from ..utils import get_model_ct
+from ..utils import log as logging
+from ..utils import backoff_delay, get_identifier, get_model_ct
+from ..utils.generations import WriteGenerations
 from ..utils.loading import UnifiedIndex
+from ..utils.state import DeadLetterStore, DigestStore
 
 VALID_GAPS = ['year', 'month', 'day', 'hour', 'minute', 'second']
 
+# The parts of a ``search`` result kept in the result cache.
+CACHED_RESULT_KEYS = ('results', 'hits', 'facets', 'spelling_suggestion', 'stats')
+
+# The ``ttl`` of searches cached for the connection's ``RESULT_CACHE_TTL``,
+# as ``None`` means they never expire.
+CONNECTION_TTL = object()
+
+# The fields which, together, tell results apart when paginating with a
+# cursor. Both are stored & indexed as they are by every backend.
+CURSOR_TIE_BREAKERS = (DJANGO_CT, DJANGO_ID)
+
+# The types of the fields backends analyze, which an exact match or a range
+# only tests a term of (unless they're facets).
+ANALYZED_FIELD_TYPES = ('text', 'ngram', 'edge_ngram')
+
 
 def log_query(func):
     """
@@ -47,6 +75,34 @@ def log_query(func):
     return wrapper
 
 
+def normalize_param(value):
+    """
+    Turns a search parameter into JSON-serializable data which is the same
+    for equivalent parameters, whatever the order of their sets & dicts.
+    Models become their ``app_label.model_name``, classes their dotted path
+    & other objects their text.
+    """
+    if isinstance(value, ModelBase):
+        return get_model_ct(value)
+
+    if isinstance(value, type):
+        return '%s.%s' % (value.__module__, value.__name__)
+
+    if isinstance(value, dict):
+        return sorted((force_text(key), normalize_param(item)) for key, item in value.items())
+
+    if isinstance(value, (set, frozenset)):
+        return sorted((normalize_param(item) for item in value), key=lambda item: json.dumps(item))
+
+    if isinstance(value, (list, tuple)):
+        return [normalize_param(item) for item in value]
+
+    if value is None or isinstance(value, (bool, float) + six.integer_types + six.string_types):
+        return value
+
+    return force_text(value)
+
+
 class EmptyResults(object):
     hits = 0
     docs = []
@@ -69,6 +125,15 @@ class BaseSearchBackend(object):
     RESERVED_WORDS = []
     RESERVED_CHARACTERS = []
 
+    # Errors which, when raised preparing a single object, are logged & the
+    # object skipped (if ``silently_fail``) instead of failing the update.
+    PREPARE_ERRORS = ()
+
+    # Errors which, when raised sending documents, count as a failure of all
+    # of them, to be retried (see ``send_with_retries``). ``IndexingError``
+    # always does.
+    RETRY_ERRORS = ()
+
     def __init__(self, connection_alias, **connection_options):
         self.connection_alias = connection_alias
         self.timeout = connection_options.get('TIMEOUT', 10)
@@ -76,12 +141,253 @@ class BaseSearchBackend(object):
         self.batch_size = connection_options.get('BATCH_SIZE', 1000)
         self.silently_fail = connection_options.get('SILENTLY_FAIL', True)
         self.distance_available = connection_options.get('DISTANCE_AVAILABLE', False)
-
-    def update(self, index, iterable):
+        self.skip_unchanged = connection_options.get('SKIP_UNCHANGED', False)
+        self.retries = connection_options.get('RETRIES', 0)
+        self.retry_backoff = connection_options.get('RETRY_BACKOFF', 1.0)
+        self.retry_max_backoff = connection_options.get('RETRY_MAX_BACKOFF', 30)
+        self.dead_letters = DeadLetterStore() if connection_options.get('DEAD_LETTERS', False) else None
+        self.result_cache = connection_options.get('RESULT_CACHE', 'default')
+        self.result_cache_ttl = connection_options.get('RESULT_CACHE_TTL', 0)
+        # Lookups answered from the result cache & those that went to the
+        # backend (see ``cached_search``).
+        self.result_cache_stats = {'hits': 0, 'misses': 0}
+        self._result_cache_lock = threading.Lock()
+        self.write_generations = WriteGenerations(self.result_cache)
+        # Whether writes bump the write generations (see ``write_generation``),
+        # which every process writing to the connection has to agree on.
+        self.track_writes = connection_options.get('WRITE_GENERATIONS', self.result_cache_ttl != 0)
+        self.log = logging.getLogger('searchstack')
+
+        if self.skip_unchanged:
+            self.digests = DigestStore()
+            # What ``SKIP_UNCHANGED`` saved: documents & bytes not sent, and
+            # requests not made because every document was unchanged.
+            self.skipped = {'documents': 0, 'bytes': 0, 'requests': 0}
+            self._skipped_lock = threading.Lock()
+
+    def update(self, index, iterable, commit=True):
         """
         Updates the backend when given a SearchIndex and a collection of
         documents.
 
+        By default this prepares the objects with ``prepare_documents`` and
+        hands the result to ``send_prepared``. Backends should implement
+        ``send_documents`` (or override this method entirely).
+        """
+        return self.send_prepared(index, self.prepare_documents(index, iterable), commit=commit)
+
+    def prepare_documents(self, index, iterable):
+        """
+        Yields the prepared data (as returned by ``SearchIndex.full_prepare``)
+        for each object in ``iterable``, skipping those that raise
+        ``SkipDocument``.
+
+        The documents produced here are backend-agnostic, which lets callers
+        (such as the pipelined ``update_index``) prepare documents in one
+        place & send them in another.
+
+        The objects are taken from ``iterable`` ``BATCH_SIZE`` at a time, &
+        the templates of each slice rendered together (see
+        ``SearchIndex.prerender_templates``), so that no more than a slice
+        is held at once.
+        """
+        iterator = iter(iterable)
+
+        while True:
+            objs = list(islice(iterator, self.batch_size))
+
+            if not objs:
+                break
+
+            with index.prerender_templates(objs):
+                for obj in objs:
+                    try:
+                        yield index.full_prepare(obj)
+                    except SkipDocument:
+                        self.log.debug("Indexing for object `%s` skipped", obj)
+                    except self.PREPARE_ERRORS as e:
+                        if not self.silently_fail:
+                            raise
+
+                        # We'll log the object identifier but won't include the actual object
+                        # to avoid the possibility of that generating encoding errors while
+                        # processing the log message:
+                        self.log.error("%s while preparing object for update" % e.__class__.__name__,
+                                       exc_info=True, extra={"data": {"index": index,
+                                                                      "object": get_identifier(obj)}})
+
+    def send_prepared(self, index, documents, commit=True):
+        """
+        Sends prepared documents to the backend with ``send_documents`` (see
+        ``send_with_retries``) & bumps the write generation of the index's
+        model.
+
+        With ``SKIP_UNCHANGED``, documents whose digest matches that of the
+        last version sent are left out (& counted in ``skipped``). The
+        digests of the others are recorded once they've been sent, except
+        for any ``send_documents`` reports as failed.
+        """
+        if not self.skip_unchanged:
+            try:
+                return self.send_with_retries(index, documents, commit=commit)
+            finally:
+                self.bump_write_generations(models=[index.get_model()])
+
+        digested = [(doc,) + self.document_digest(doc) for doc in documents]
+        stored = self.digests.get_many(self.connection_alias, [doc[ID] for doc, digest, size in digested])
+        changed = [(doc, digest) for doc, digest, size in digested if stored.get(doc[ID]) != digest]
+
+        with self._skipped_lock:
+            self.skipped['documents'] += len(digested) - len(changed)
+            self.skipped['bytes'] += sum(size for doc, digest, size in digested if stored.get(doc[ID]) == digest)
+
+            if digested and not changed:
+                self.skipped['requests'] += 1
+
+        if not changed:
+            return []
+
+        try:
+            failures = self.send_with_retries(index, [doc for doc, digest in changed], commit=commit)
+        finally:
+            self.bump_write_generations(models=[index.get_model()])
+
+        failed = set(doc_id for doc_id, error in failures or [])
+        self.digests.set_many(self.connection_alias, [(doc[ID], doc[DJANGO_CT], digest) for doc, digest in changed
+                                                      if doc[ID] not in failed])
+        return failures
+
+    def send_with_retries(self, index, documents, commit=True):
+        """
+        Sends documents with ``send_documents``, then sends the ones that
+        failed again, up to ``RETRIES`` times, waiting longer after each
+        attempt (starting from ``RETRY_BACKOFF`` seconds & doubling, up to
+        ``RETRY_MAX_BACKOFF``, with some jitter).
+
+        With ``DEAD_LETTERS``, documents which still fail are recorded in the
+        dead-letter store, for ``replay_dead_letters``.
+
+        Returns the failures of the last attempt, or raises its error.
+        """
+        if not self.retries and self.dead_letters is None:
+            return self.send_documents(index, documents, commit=commit)
+
+        documents = list(documents)
+        attempts = 0
+
+        while True:
+            attempts += 1
+            exc_info = None
+
+            try:
+                failures = self.send_documents(index, documents, commit=commit) or []
+            except IndexingError as e:
+                exc_info = sys.exc_info()
+                failures = e.errors
+            except self.RETRY_ERRORS as e:
+                exc_info = sys.exc_info()
+                failures = [(doc[ID], "%s: %s" % (e.__class__.__name__, e)) for doc in documents]
+
+            if not failures or attempts > self.retries:
+                break
+
+            failed = set(doc_id for doc_id, error in failures)
+            documents = [doc for doc in documents if doc[ID] in failed]
+            delay = backoff_delay(attempts, self.retry_backoff, self.retry_max_backoff)
+            self.log.warning("Retrying %d failed document(s) in %.1fs (attempt %d of %d).",
+                             len(documents), delay, attempts + 1, self.retries + 1)
+            sleep(delay)
+
+        if failures and self.dead_letters is not None:
+            by_id = dict((doc[ID], doc) for doc in documents)
+            self.dead_letters.add_many(self.connection_alias, [
+                (doc_id, by_id[doc_id][DJANGO_CT], by_id[doc_id][DJANGO_ID], force_text(error))
+                for doc_id, error in failures if doc_id in by_id
+            ])
+
+        if exc_info is not None:
+            six.reraise(*exc_info)
+
+        return failures
+
+    def document_digest(self, document):
+        """
+        Returns a digest of a prepared document & the size of the data it
+        was computed from (roughly what sending the document costs).
+        """
+        data = json.dumps(document, sort_keys=True, default=force_text).encode('utf-8')
+        return hashlib.sha1(data).hexdigest(), len(data)
+
+    def forget_digests(self, identifiers=None, models=None):
+        """
+        Drops the recorded digests of documents being removed from the
+        backend, either by identifier or by model (all of them if neither is
+        given), so that they're sent again when next updated. Backends should
+        call it from ``remove``, ``remove_many`` & ``clear``.
+        """
+        if not self.skip_unchanged:
+            return
+
+        if identifiers is not None:
+            self.digests.delete_many(self.connection_alias, identifiers)
+        elif models is not None:
+            self.digests.clear(self.connection_alias, models=[get_model_ct(model) for model in models])
+        else:
+            self.digests.clear(self.connection_alias)
+
+    def bump_write_generations(self, identifiers=None, models=None):
+        """
+        Bumps the write generations (see ``write_generation``) of the models
+        whose documents were written to, given by identifier or by model
+        (every model if neither is given). ``send_prepared`` calls it for
+        updates; backends should call it from ``remove``, ``remove_many`` &
+        ``clear``.
+
+        Does nothing unless the connection tracks writes (``WRITE_GENERATIONS``,
+        on by default with a ``RESULT_CACHE_TTL``), so that writes don't cost
+        cache round-trips when nothing is cached.
+        """
+        if not self.track_writes:
+            return
+
+        if identifiers is not None:
+            models = set('.'.join(force_text(identifier).split('.')[:2]) for identifier in identifiers)
+        elif models is not None:
+            models = [get_model_ct(model) for model in models]
+
+        self.write_generations.bump(self.connection_alias, models)
+
+    def write_generation(self, models=None):
+        """
+        Returns a token which changes whenever documents of ``models`` (by
+        default, of any indexed model) are written to on this connection.
+        Cached search results are keyed by it; it can also go in ETags.
+
+        Raises ``ImproperlyConfigured`` unless the connection tracks writes
+        (see ``bump_write_generations``), as the token would never change.
+        """
+        if not self.track_writes:
+            raise ImproperlyConfigured("Connection '%s' doesn't track writes; set WRITE_GENERATIONS (or "
+                                       "RESULT_CACHE_TTL) in its settings to cache searches or use "
+                                       "write generations." % self.connection_alias)
+
+        if not models:
+            from .. import connections
+            models = connections[self.connection_alias].get_unified_index().get_indexed_models()
+
+        generations = self.write_generations.get_many(self.connection_alias,
+                                                      [get_model_ct(model) for model in models])
+        data = json.dumps(sorted(generations.items())).encode('utf-8')
+        return hashlib.sha1(data).hexdigest()
+
+    def send_documents(self, index, documents, commit=True):
+        """
+        Sends an iterable of prepared documents (see ``prepare_documents``)
+        to the backend.
+
+        May return a list of ``(identifier, error)`` pairs for the documents
+        that couldn't be indexed.
+
         This method MUST be implemented by each backend, as it will be highly
         specific to each one.
         """
@@ -98,6 +404,26 @@ class BaseSearchBackend(object):
         """
         raise NotImplementedError
 
+    def remove_many(self, objs_or_strings, commit=True):
+        """
+        Removes several documents/objects from the backend. Each may be either
+        a model instance or an identifier, as with ``remove``.
+
+        By default this calls ``remove`` for each of them, only committing
+        after the last one. Backends should override it to remove a batch of
+        documents per request.
+        """
+        previous = None
+
+        for obj_or_string in objs_or_strings:
+            if previous is not None:
+                self.remove(previous, commit=False)
+
+            previous = obj_or_string
+
+        if previous is not None:
+            self.remove(previous, commit=commit)
+
     def clear(self, models=None, commit=True):
         """
         Clears the backend of all documents/objects for a collection of models.
@@ -107,6 +433,83 @@ class BaseSearchBackend(object):
         """
         raise NotImplementedError
 
+    def start_bulk_load(self):
+        """
+        Prepares the backend for a large number of updates, trading the
+        freshness of searches for indexing throughput until
+        ``finish_bulk_load`` is called. Calls may be nested.
+
+        By default this does nothing.
+        """
+
+    def finish_bulk_load(self):
+        """
+        Undoes ``start_bulk_load``, making everything sent since visible to
+        searches. By default this does nothing.
+        """
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        A context manager calling ``start_bulk_load`` on entry &
+        ``finish_bulk_load`` on exit, even if the block fails.
+        """
+        self.start_bulk_load()
+
+        try:
+            yield self
+        finally:
+            self.finish_bulk_load()
+
+    def start_generation(self):
+        """
+        Creates a new, empty copy of the index & sends all further writes to
+        it, leaving searches on the current one. Returns the new copy's name.
+
+        Used by ``rebuild_index --blue-green``; ``publish_generation`` then
+        switches searches over to it, or ``discard_generation`` drops it.
+        """
+        raise NotImplementedError("Subclasses must implement 'start_generation' to support rebuild_index --blue-green.")
+
+    def publish_generation(self):
+        """
+        Atomically switches searches to the generation created by
+        ``start_generation`` & removes the previous ones.
+        """
+        raise NotImplementedError("Subclasses must implement 'publish_generation' to support rebuild_index --blue-green.")
+
+    def discard_generation(self):
+        """
+        Drops the generation created by ``start_generation``, leaving the
+        current index untouched.
+        """
+        raise NotImplementedError("Subclasses must implement 'discard_generation' to support rebuild_index --blue-green.")
+
+    def scan(self, models, batch_size=None):
+        """
+        Yields every document of the given models that is in the index, as
+        lists of at most ``batch_size`` ``(id, django_id)`` pairs, in no
+        particular order.
+
+        Removing documents that have already been yielded must not cause any
+        others to be skipped.
+
+        By default this pages through ``SearchQuerySet`` results by offset,
+        reading all of the pairs before yielding any. Backends should override
+        it with a cursor (or scroll) that avoids deep paging.
+        """
+        from ..query import SearchQuerySet
+
+        batch_size = batch_size or self.batch_size
+        sqs = SearchQuerySet(using=self.connection_alias).models(*models).values_list('id', 'pk')
+        pairs = []
+
+        for start in range(0, sqs.count(), batch_size):
+            pairs.extend(tuple(pair) for pair in sqs[start:start + batch_size])
+
+        for start in range(0, len(pairs), batch_size):
+            yield pairs[start:start + batch_size]
+
     @log_query
     def search(self, query_string, **kwargs):
         """
@@ -124,6 +527,73 @@ class BaseSearchBackend(object):
         """
         raise NotImplementedError
 
+    def cached_search(self, query_string, ttl=CONNECTION_TTL, **kwargs):
+        """
+        Runs ``search`` through the result cache: its results are stored in
+        the ``RESULT_CACHE`` cache for ``ttl`` seconds (``RESULT_CACHE_TTL``
+        by default), under a key made of the query string & the normalized
+        parameters (see ``result_cache_key``), and identical searches are
+        answered from there until then. As with Django's caches, a ``ttl``
+        of ``None`` never expires & ``DEFAULT_TIMEOUT`` uses the cache's
+        default timeout. A ``ttl`` of ``0`` skips the cache.
+
+        Hits & misses are counted in ``result_cache_stats``.
+        """
+        if ttl is CONNECTION_TTL:
+            ttl = self.result_cache_ttl
+
+        if ttl == 0:
+            return self.search(query_string, **kwargs)
+
+        cache = caches[self.result_cache]
+        key = self.result_cache_key(query_string, kwargs)
+        results = cache.get(key)
+
+        with self._result_cache_lock:
+            self.result_cache_stats['misses' if results is None else 'hits'] += 1
+
+        if results is None:
+            results = self.search(query_string, **kwargs)
+            payload = dict((name, value) for name, value in results.items() if name in CACHED_RESULT_KEYS)
+            cache.set(key, payload, ttl)
+
+        return results
+
+    def search_chunks(self, query_string, chunk_size=None, **kwargs):
+        """
+        Yields the results of a search (as ``search`` takes it, less the
+        offsets) as lists of at most ``chunk_size`` (``BATCH_SIZE`` by
+        default) ``SearchResult`` objects, so that callers can walk any
+        number of results in constant memory.
+
+        By default this runs ``search`` for one offset window after another,
+        which gets slower the deeper it goes. Backends should override it
+        with a cursor (or scroll).
+        """
+        chunk_size = chunk_size or self.batch_size
+        start = 0
+
+        while True:
+            results = self.search(query_string, start_offset=start, end_offset=start + chunk_size, **kwargs)
+
+            if results.get('results'):
+                yield list(results['results'])
+
+            start += chunk_size
+
+            if not results.get('results') or start >= results.get('hits', 0):
+                break
+
+    def result_cache_key(self, query_string, kwargs):
+        """
+        Returns the key ``cached_search`` stores the results of a search
+        under. It includes the write generation of the models searched, so
+        that writing to one of them invalidates the results.
+        """
+        data = json.dumps([normalize_param(query_string), normalize_param(kwargs),
+                           self.write_generation(kwargs.get('models'))]).encode('utf-8')
+        return 'searchstack:%s:%s' % (self.connection_alias, hashlib.sha1(data).hexdigest())
+
     def build_search_kwargs(self, query_string, sort_by=None, start_offset=0, end_offset=None,
                             fields='', highlight=False, facets=None,
                             date_facets=None, query_facets=None,
@@ -473,6 +943,11 @@ class BaseSearchQuery(object):
         self._spelling_suggestion = None
         self.result_class = SearchResult
         self.stats = {}
+        # How long results are cached for (see ``SearchBackend.cached_search``).
+        self.cache_ttl = CONNECTION_TTL
+        # The ``(field, value)`` pairs of the result to resume after, when
+        # paginating with a cursor (see ``set_search_after``).
+        self.search_after = None
         from .. import connections
         self._using = using
         self.backend = connections[self._using].get_backend()
@@ -557,7 +1032,7 @@ class BaseSearchQuery(object):
         if kwargs:
             search_kwargs.update(kwargs)
 
-        results = self.backend.search(final_query, **search_kwargs)
+        results = self.backend.cached_search(final_query, ttl=self.cache_ttl, **search_kwargs)
         self._results = results.get('results', [])
         self._hit_count = results.get('hits', 0)
         self._facet_counts = self.post_process_facets(results)
@@ -594,12 +1069,38 @@ class BaseSearchQuery(object):
         if kwargs:
             search_kwargs.update(kwargs)
 
-        results = self.backend.search(self._raw_query, **search_kwargs)
+        results = self.backend.cached_search(self._raw_query, ttl=self.cache_ttl, **search_kwargs)
         self._results = results.get('results', [])
         self._hit_count = results.get('hits', 0)
         self._facet_counts = results.get('facets', {})
         self._spelling_suggestion = results.get('spelling_suggestion', None)
 
+    def get_results_in_chunks(self, chunk_size=None, **kwargs):
+        """
+        Yields all the results of the query, as lists of at most
+        ``chunk_size``, fetched one after another from the backend's
+        ``search_chunks``. Nothing is stored on the query. The offsets are
+        ignored & no facets, stats or spelling suggestion are asked for.
+        """
+        if self._more_like_this:
+            raise MoreLikeThisError("'More Like This' results can't be fetched in chunks.")
+
+        if self._raw_query:
+            query_string = self._raw_query
+            search_kwargs = self.build_params()
+            search_kwargs.update(self._raw_query_params)
+        else:
+            query_string = self.build_query()
+            search_kwargs = self.build_params()
+
+        search_kwargs.update(kwargs)
+
+        for name in ('start_offset', 'end_offset', 'facets', 'date_facets', 'query_facets', 'stats',
+                     'spelling_query'):
+            search_kwargs.pop(name, None)
+
+        return self.backend.search_chunks(query_string, chunk_size=chunk_size, **search_kwargs)
+
     def get_count(self):
         """
         Returns the number of results the backend found for the query.
@@ -697,6 +1198,10 @@ class BaseSearchQuery(object):
             # Match all.
             final_query = self.matching_all_fragment()
 
+        if self.search_after:
+            after_query = self.build_search_after().as_query_string(self.build_query_fragment)
+            final_query = "(%s) AND %s" % (final_query, after_query)
+
         if self.boost:
             boost_list = []
 
@@ -707,6 +1212,25 @@ class BaseSearchQuery(object):
 
         return final_query
 
+    def build_search_after(self):
+        """
+        Builds the ``SQ`` matching the results that come after the one
+        ``search_after`` was taken from, in the order of ``order_by``: those
+        with the same values for the first fields & a value beyond it for the
+        next one.
+        """
+        lookups = []
+
+        for position, (field, value) in enumerate(self.search_after):
+            lookup = SQ(**{'%s__%s' % (field.lstrip('-'), 'lt' if field.startswith('-') else 'gt'): value})
+
+            for previous_field, previous_value in reversed(self.search_after[:position]):
+                lookup = SQ(**{'%s__exact' % previous_field.lstrip('-'): previous_value}) & lookup
+
+            lookups.append(lookup)
+
+        return six.moves.reduce(operator.__or__, lookups)
+
     def combine(self, rhs, connector=SQ.AND):
         if connector == SQ.AND:
             self.add_filter(rhs.query_filter)
@@ -802,6 +1326,56 @@ class BaseSearchQuery(object):
         """
         self.order_by = []
 
+    def cursor_fields(self):
+        """
+        Returns the fields of ``order_by`` a cursor holds the values of: those
+        up to the ``DJANGO_CT`` & ``DJANGO_ID`` tie-breakers, which together
+        tell the results apart.
+        """
+        seen = set()
+
+        for position, field in enumerate(self.order_by):
+            seen.add(field.lstrip('-'))
+
+            if seen.issuperset(CURSOR_TIE_BREAKERS):
+                return self.order_by[:position + 1]
+
+        return self.order_by + [field for field in CURSOR_TIE_BREAKERS if field not in seen]
+
+    def set_search_after(self, pairs=None):
+        """
+        Switches to cursor pagination: the results are ordered by
+        ``DJANGO_CT`` & ``DJANGO_ID`` after the fields of ``order_by``, & if
+        the ``(field, value)`` pairs of a result (see ``cursor_fields``) are
+        given, only those coming after it are matched, however deep it was
+        in the results.
+
+        Raises ``SearchFieldError`` if the results are ordered by an analyzed
+        field, which the range filter couldn't match exactly, and
+        ``CursorError`` if the pairs are for another ordering.
+        """
+        from .. import connections
+        fields = connections[self._using].get_unified_index().all_searchfields()
+
+        for field in self.cursor_fields():
+            field_object = fields.get(field.lstrip('-'))
+
+            if (field_object is not None and field_object.field_type in ANALYZED_FIELD_TYPES
+                    and not hasattr(field_object, 'facet_for')):
+                raise SearchFieldError("Can't paginate with a cursor when ordering by the analyzed field "
+                                       "'%s'; order by its facet field instead." % field.lstrip('-'))
+
+        for field in CURSOR_TIE_BREAKERS:
+            if field not in [order_field.lstrip('-') for order_field in self.order_by]:
+                self.add_order_by(field)
+
+        pairs = [(field, value) for field, value in pairs or []]
+
+        if pairs and [field for field, value in pairs] != self.cursor_fields():
+            raise CursorError("The cursor doesn't match the ordering of the results.")
+
+        self.search_after = pairs
+
     def add_model(self, model):
         """
         Restricts the query requiring matches in the given model.
@@ -1001,6 +1575,8 @@ class BaseSearchQuery(object):
         clone.distance_point = self.distance_point.copy()
         clone._raw_query = self._raw_query
         clone._raw_query_params = self._raw_query_params
+        clone.cache_ttl = self.cache_ttl
+        clone.search_after = self.search_after
 
         return clone
 
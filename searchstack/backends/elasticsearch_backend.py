@@ -1,9 +1,12 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
+import copy
 import datetime
 import re
+import threading
 import warnings
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
@@ -12,7 +15,7 @@ from django.utils import six
 from . import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
 from .. import connections
 from ..constants import DEFAULT_OPERATOR, DJANGO_CT, DJANGO_ID, FUZZY_MAX_EXPANSIONS, FUZZY_MIN_SIM, ID
-from ..exceptions import MissingDependency, MoreLikeThisError, SkipDocument
+from ..exceptions import IndexingError, MissingDependency, MoreLikeThisError
 from ..inputs import Clean, Exact, PythonData, Raw
 from ..models import SearchResult
 from ..utils import log as logging
@@ -21,13 +24,8 @@ from ..utils.app_loading import haystack_get_model
 
 try:
     import elasticsearch
-    try:
-        # let's try this, for elasticsearch > 1.7.0
-        from elasticsearch.helpers import bulk
-    except ImportError:
-        # let's try this, for elasticsearch <= 1.7.0
-        from elasticsearch.helpers import bulk_index as bulk
     from elasticsearch.exceptions import NotFoundError
+    from elasticsearch.helpers import scan as scroll_scan
 except ImportError:
     raise MissingDependency("The 'elasticsearch' backend requires the installation of 'elasticsearch'. Please refer to the documentation.")
 
@@ -54,6 +52,14 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
         '[', ']', '^', '"', '~', '*', '?', ':', '/',
     )
 
+    PREPARE_ERRORS = (elasticsearch.TransportError,)
+    # Failed ``_bulk`` requests are reported document by document; this
+    # covers failing to set the index up.
+    RETRY_ERRORS = (elasticsearch.TransportError,)
+
+    # How long a scroll (see ``search_chunks``) is kept between requests.
+    SCROLL_TIMEOUT = '5m'
+
     # Settings to add an n-gram & edge n-gram analyzer.
     DEFAULT_SETTINGS = {
         'settings': {
@@ -99,6 +105,11 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
         }
     }
 
+    # Index settings turned off while bulk loading, and the values
+    # Elasticsearch uses when an index doesn't set them.
+    BULK_LOAD_SETTINGS = {'number_of_replicas': 0, 'refresh_interval': '-1'}
+    DEFAULT_LOAD_SETTINGS = {'number_of_replicas': 1, 'refresh_interval': '1s'}
+
     def __init__(self, connection_alias, **connection_options):
         super(ElasticsearchSearchBackend, self).__init__(connection_alias, **connection_options)
 
@@ -110,6 +121,14 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
 
         self.conn = elasticsearch.Elasticsearch(connection_options['URL'], timeout=self.timeout, **connection_options.get('KWARGS', {}))
         self.index_name = connection_options['INDEX_NAME']
+        # ``index_name`` points at the generation being built during
+        # ``rebuild_index --blue-green``; everyone else keeps using the alias.
+        self.alias_name = self.index_name
+        self.bulk_chunk_size = connection_options.get('BULK_CHUNK_SIZE', 500)
+        self.bulk_max_bytes = connection_options.get('BULK_MAX_BYTES', 10 * 1024 * 1024)
+        self.bulk_threads = connection_options.get('BULK_THREADS', 1)
+        # Refreshes are skipped while this is non-zero (see ``start_bulk_load``).
+        self.bulk_loads = 0
         self.log = logging.getLogger('searchstack')
         self.setup_complete = False
         self.existing_mapping = {}
@@ -153,7 +172,7 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
 
         self.setup_complete = True
 
-    def update(self, index, iterable, commit=True):
+    def send_documents(self, index, documents, commit=True):
         if not self.setup_complete:
             try:
                 self.setup()
@@ -164,39 +183,109 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
                 self.log.error("Failed to add documents to Elasticsearch: %s", e, exc_info=True)
                 return
 
-        prepped_docs = []
+        failures = []
+        chunks = self._bulk_chunks(documents)
+
+        if self.bulk_threads > 1:
+            # Keep at most a couple of chunks per thread in memory, rather
+            # than letting the pool read ahead through all of them.
+            pool = ThreadPool(self.bulk_threads)
+            slots = threading.BoundedSemaphore(self.bulk_threads * 2)
+            results = []
+
+            def send_chunk(chunk):
+                try:
+                    return self._send_bulk_chunk(chunk)
+                finally:
+                    slots.release()
 
-        for obj in iterable:
             try:
-                prepped_data = index.full_prepare(obj)
-                final_data = {}
+                for chunk in chunks:
+                    slots.acquire()
+                    results.append(pool.apply_async(send_chunk, (chunk,)))
+
+                for result in results:
+                    failures.extend(result.get())
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for chunk in chunks:
+                failures.extend(self._send_bulk_chunk(chunk))
 
-                # Convert the data to make sure it's happy.
-                for key, value in prepped_data.items():
-                    final_data[key] = self._from_python(value)
-                final_data['_id'] = final_data[ID]
+        if commit and not self.bulk_loads:
+            self.conn.indices.refresh(index=self.index_name)
 
-                prepped_docs.append(final_data)
-            except SkipDocument:
-                self.log.debug("Indexing for object `%s` skipped", obj)
-            except elasticsearch.TransportError as e:
-                if not self.silently_fail:
-                    raise
+        if failures:
+            if not self.silently_fail:
+                raise IndexingError("Failed to index %d document(s) in Elasticsearch." % len(failures), failures)
 
-                # We'll log the object identifier but won't include the actual object
-                # to avoid the possibility of that generating encoding errors while
-                # processing the log message:
-                self.log.error("%s while preparing object for update" % e.__class__.__name__, exc_info=True,
-                               extra={"data": {"index": index,
-                                               "object": get_identifier(obj)}})
+            self.log.error("Failed to index %d document(s) in Elasticsearch: %s", len(failures),
+                           ", ".join("%s (%s)" % failure for failure in failures[:10]))
 
-        bulk(self.conn, prepped_docs, index=self.index_name, doc_type='modelresult')
+        return failures
 
-        if commit:
-            self.conn.indices.refresh(index=self.index_name)
+    def _bulk_chunks(self, documents):
+        """
+        Converts the prepared documents one at a time & yields them as lists
+        of ``(id, action lines)`` pairs, each holding at most
+        ``BULK_CHUNK_SIZE`` documents & (unless a single document is larger)
+        ``BULK_MAX_BYTES`` of request body.
+        """
+        dumps = self.conn.transport.serializer.dumps
+        chunk = []
+        chunk_bytes = 0
+
+        for prepped_data in documents:
+            final_data = {}
+
+            # Convert the data to make sure it's happy.
+            for key, value in prepped_data.items():
+                final_data[key] = self._from_python(value)
+
+            doc_id = final_data[ID]
+            lines = "%s\n%s\n" % (dumps({'index': {'_id': doc_id}}), dumps(final_data))
+            size = len(lines.encode('utf-8'))
+
+            if chunk and (len(chunk) >= self.bulk_chunk_size or chunk_bytes + size > self.bulk_max_bytes):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+
+            chunk.append((doc_id, lines))
+            chunk_bytes += size
+
+        if chunk:
+            yield chunk
+
+    def _send_bulk_chunk(self, chunk):
+        """
+        Sends one chunk to the ``_bulk`` API, returning a list of
+        ``(id, error)`` pairs for the documents that failed.
+        """
+        try:
+            response = self.conn.bulk(body="".join(lines for doc_id, lines in chunk),
+                                      index=self.index_name, doc_type='modelresult')
+        except elasticsearch.TransportError as e:
+            return [(doc_id, "%s: %s" % (e.__class__.__name__, e)) for doc_id, lines in chunk]
+
+        failures = []
+
+        for item in response.get('items', []):
+            # Each item is keyed by its operation (``index`` or ``delete``).
+            for op_type, result in item.items():
+                if op_type == 'delete' and result.get('status') == 404:
+                    # Already gone.
+                    continue
+
+                if 'error' in result or result.get('status', 200) >= 300:
+                    failures.append((result.get('_id'), result.get('error', result.get('status'))))
+
+        return failures
 
     def remove(self, obj_or_string, commit=True):
         doc_id = get_identifier(obj_or_string)
+        self.forget_digests(identifiers=[doc_id])
 
         if not self.setup_complete:
             try:
@@ -212,7 +301,7 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
         try:
             self.conn.delete(index=self.index_name, doc_type='modelresult', id=doc_id, ignore=404)
 
-            if commit:
+            if commit and not self.bulk_loads:
                 self.conn.indices.refresh(index=self.index_name)
         except elasticsearch.TransportError as e:
             if not self.silently_fail:
@@ -220,6 +309,83 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
 
             self.log.error("Failed to remove document '%s' from Elasticsearch: %s", doc_id, e, exc_info=True)
 
+        self.bump_write_generations(identifiers=[doc_id])
+
+    def scan(self, models, batch_size=None):
+        """
+        Scrolls through the documents of the given models, fetching only
+        their ``django_id``.
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        batch_size = batch_size or self.batch_size
+        query = {
+            'query': {'filtered': {'filter': {'terms': {DJANGO_CT: [get_model_ct(model) for model in models]}}}},
+            '_source': [DJANGO_ID],
+        }
+        hits = scroll_scan(self.conn, query=query, index=self.index_name, doc_type='modelresult',
+                           size=batch_size)
+        batch = []
+
+        for hit in hits:
+            batch.append((hit['_id'], hit['_source'][DJANGO_ID]))
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def remove_many(self, objs_or_strings, commit=True):
+        """
+        Removes the documents with ``_bulk`` delete actions,
+        ``BULK_CHUNK_SIZE`` per request, refreshing the index once at the end.
+        """
+        if not self.setup_complete:
+            try:
+                self.setup()
+            except elasticsearch.TransportError as e:
+                if not self.silently_fail:
+                    raise
+
+                self.log.error("Failed to remove documents from Elasticsearch: %s", e, exc_info=True)
+                return
+
+        dumps = self.conn.transport.serializer.dumps
+        failures = []
+        chunk = []
+        doc_ids = []
+
+        for obj_or_string in objs_or_strings:
+            doc_id = get_identifier(obj_or_string)
+            chunk.append((doc_id, "%s\n" % dumps({'delete': {'_id': doc_id}})))
+            doc_ids.append(doc_id)
+
+            if len(chunk) >= self.bulk_chunk_size:
+                self.forget_digests(identifiers=[doc_id for doc_id, lines in chunk])
+                failures.extend(self._send_bulk_chunk(chunk))
+                chunk = []
+
+        if chunk:
+            self.forget_digests(identifiers=[doc_id for doc_id, lines in chunk])
+            failures.extend(self._send_bulk_chunk(chunk))
+
+        if commit and not self.bulk_loads:
+            self.conn.indices.refresh(index=self.index_name)
+
+        self.bump_write_generations(identifiers=doc_ids)
+
+        if failures:
+            if not self.silently_fail:
+                raise IndexingError("Failed to remove %d document(s) from Elasticsearch." % len(failures), failures)
+
+            self.log.error("Failed to remove %d document(s) from Elasticsearch: %s", len(failures),
+                           ", ".join("%s (%s)" % failure for failure in failures[:10]))
+
+        return failures
+
     def clear(self, models=None, commit=True):
         # We actually don't want to do this here, as mappings could be
         # very different.
@@ -229,8 +395,20 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
         if models is not None:
             assert isinstance(models, (list, tuple))
 
+        self.forget_digests(models=models)
+
         try:
-            if models is None:
+            if models is None and self.index_name != self.alias_name:
+                # A generation being built is emptied, but kept.
+                self.conn.delete_by_query(index=self.index_name, doc_type='modelresult',
+                                          body={'query': {'match_all': {}}})
+            elif models is None and self.conn.indices.exists_alias(name=self.alias_name):
+                # Deleting through the alias would delete the generation
+                # behind it & leave the alias dangling, so an empty
+                # generation takes its place instead.
+                self.start_generation()
+                self.publish_generation()
+            elif models is None:
                 self.conn.indices.delete(index=self.index_name, ignore=404)
                 self.setup_complete = False
                 self.existing_mapping = {}
@@ -254,6 +432,128 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
             else:
                 self.log.error("Failed to clear Elasticsearch index: %s", e, exc_info=True)
 
+        self.bump_write_generations(models=models)
+
+    def get_load_settings(self, index):
+        """
+        Returns the current values of the settings in ``BULK_LOAD_SETTINGS``
+        for ``index``.
+        """
+        load_settings = dict(self.DEFAULT_LOAD_SETTINGS)
+
+        try:
+            all_settings = self.conn.indices.get_settings(index=index)
+        except NotFoundError:
+            return load_settings
+
+        for index_settings in all_settings.values():
+            index_settings = index_settings['settings'].get('index', {})
+
+            for key in load_settings:
+                if key in index_settings:
+                    load_settings[key] = index_settings[key]
+
+        return load_settings
+
+    def start_bulk_load(self):
+        """
+        Turns off refreshes & replicas until ``finish_bulk_load``. Updates
+        sent meanwhile don't refresh the index, even with ``commit=True``.
+        """
+        self.bulk_loads += 1
+
+        if self.bulk_loads > 1:
+            return
+
+        try:
+            if not self.setup_complete:
+                self.setup()
+
+            self.bulk_load_settings = self.get_load_settings(self.index_name)
+            self.conn.indices.put_settings(index=self.index_name, body={'index': self.BULK_LOAD_SETTINGS})
+        except Exception:
+            self.bulk_loads -= 1
+            raise
+
+    def finish_bulk_load(self):
+        """
+        Restores the settings changed by ``start_bulk_load``, then merges &
+        refreshes the index once.
+        """
+        self.bulk_loads -= 1
+
+        if self.bulk_loads:
+            return
+
+        self.conn.indices.put_settings(index=self.index_name, body={'index': self.bulk_load_settings})
+        # Merging a large index outlasts any sensible request timeout, so
+        # it's left to finish in the background.
+        self.conn.indices.optimize(index=self.index_name, wait_for_merge=False)
+        self.conn.indices.refresh(index=self.index_name)
+
+    def start_generation(self):
+        # Replicas & refreshes only slow down the bulk load; the live index's
+        # values are put back when the generation is published.
+        self.generation_settings = self.get_load_settings(self.alias_name)
+        generation = '%s_%s' % (self.alias_name, datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f'))
+        body = copy.deepcopy(self.DEFAULT_SETTINGS)
+        body['settings'].update(self.BULK_LOAD_SETTINGS)
+        self.conn.indices.create(index=generation, body=body)
+
+        self.index_name = generation
+        self.existing_mapping = {}
+        self.setup()
+        # Nothing has been sent to the new generation yet.
+        self.forget_digests()
+
+        return generation
+
+    def publish_generation(self):
+        generation = self.index_name
+        assert generation != self.alias_name, "No generation has been started."
+
+        self.conn.indices.put_settings(index=generation, body={'index': self.generation_settings})
+        self.conn.indices.refresh(index=generation)
+
+        actions = [{'add': {'index': generation, 'alias': self.alias_name}}]
+
+        if self.conn.indices.exists_alias(name=self.alias_name):
+            previous = list(self.conn.indices.get_alias(name=self.alias_name))
+            actions = [{'remove': {'index': index, 'alias': self.alias_name}} for index in previous] + actions
+        elif self.conn.indices.exists(index=self.alias_name):
+            # An index created before generations were used has the name the
+            # alias needs, so it has to go first.
+            self.log.warning("Deleting index '%s' to replace it with an alias; searches will fail until "
+                             "the alias is created.", self.alias_name)
+            self.conn.indices.delete(index=self.alias_name)
+
+        self.conn.indices.update_aliases(body={'actions': actions})
+
+        # Remove the previous generations, including any left behind by
+        # failed rebuilds, but not ones started after this one.
+        pattern = re.compile(r'^%s_\d{20}$' % re.escape(self.alias_name))
+
+        for index in sorted(self.conn.indices.get_settings(index='%s_*' % self.alias_name)):
+            if pattern.match(index) and index < generation:
+                self.conn.indices.delete(index=index, ignore=404)
+
+        self.index_name = self.alias_name
+        self.existing_mapping = {}
+        self.setup_complete = False
+        # Searches now go to the new generation.
+        self.bump_write_generations()
+
+    def discard_generation(self):
+        generation = self.index_name
+        assert generation != self.alias_name, "No generation has been started."
+
+        self.index_name = self.alias_name
+        self.existing_mapping = {}
+        self.setup_complete = False
+        self.conn.indices.delete(index=generation, ignore=404)
+        # The digests recorded since are those of the discarded documents.
+        self.forget_digests()
+
     def build_search_kwargs(self, query_string, sort_by=None, start_offset=0, end_offset=None,
                             fields='', highlight=False, facets=None,
                             date_facets=None, query_facets=None,
@@ -529,6 +829,42 @@ class ElasticsearchSearchBackend(BaseSearchBackend):
                                      distance_point=kwargs.get('distance_point'),
                                      geo_sort=geo_sort)
 
+    def search_chunks(self, query_string, chunk_size=None, **kwargs):
+        """
+        Scrolls through the results of the search, in their order, a chunk
+        at a time. The scroll is cleared once exhausted, or when iteration
+        is abandoned.
+
+        Errors aren't silenced, as a partial walk would look like a complete
+        one.
+        """
+        if len(query_string) == 0:
+            return
+
+        if not self.setup_complete:
+            self.setup()
+
+        search_kwargs = self.build_search_kwargs(query_string, **kwargs)
+        search_kwargs['size'] = chunk_size or self.batch_size
+        geo_sort = any('_geo_distance' in order for order in search_kwargs.get('sort', []))
+
+        raw_results = self.conn.search(body=search_kwargs, index=self.index_name, doc_type='modelresult',
+                                       _source=True, scroll=self.SCROLL_TIMEOUT)
+        scroll_id = raw_results.get('_scroll_id')
+
+        try:
+            while raw_results.get('hits', {}).get('hits'):
+                yield self._process_results(raw_results,
+                                            highlight=kwargs.get('highlight'),
+                                            result_class=kwargs.get('result_class', SearchResult),
+                                            distance_point=kwargs.get('distance_point'),
+                                            geo_sort=geo_sort)['results']
+                raw_results = self.conn.scroll(scroll_id=scroll_id, scroll=self.SCROLL_TIMEOUT)
+                scroll_id = raw_results.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id:
+                self.conn.clear_scroll(scroll_id=scroll_id, ignore=404)
+
     def more_like_this(self, model_instance, additional_query_string=None,
                        start_offset=0, end_offset=None, models=None,
                        limit_to_registered_models=None, result_class=None, **kwargs):
@@ -921,7 +1257,7 @@ class ElasticsearchSearchQuery(BaseSearchQuery):
         if kwargs:
             search_kwargs.update(kwargs)
 
-        results = self.backend.search(final_query, **search_kwargs)
+        results = self.backend.cached_search(final_query, ttl=self.cache_ttl, **search_kwargs)
         self._results = results.get('results', [])
         self._hit_count = results.get('hits', 0)
         self._facet_counts = self.post_process_facets(results)
@@ -1,7 +1,9 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
+import json
 import warnings
+from xml.sax.saxutils import escape
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
@@ -9,7 +11,7 @@ from django.utils import six
 
 from . import BaseEngine, BaseSearchBackend, BaseSearchQuery, EmptyResults, log_query
 from ..constants import DJANGO_CT, DJANGO_ID, ID
-from ..exceptions import MissingDependency, MoreLikeThisError, SkipDocument
+from ..exceptions import MissingDependency, MoreLikeThisError
 from ..inputs import Clean, Exact, PythonData, Raw
 from ..models import SearchResult
 from ..utils import log as logging
@@ -39,6 +41,9 @@ class SolrSearchBackend(BaseSearchBackend):
         '[', ']', '^', '"', '~', '*', '?', ':', '/',
     )
 
+    PREPARE_ERRORS = (UnicodeDecodeError,)
+    RETRY_ERRORS = (IOError, SolrError)
+
     def __init__(self, connection_alias, **connection_options):
         super(SolrSearchBackend, self).__init__(connection_alias, **connection_options)
 
@@ -46,44 +51,120 @@ class SolrSearchBackend(BaseSearchBackend):
             raise ImproperlyConfigured("You must specify a 'URL' in your settings for connection '%s'." % connection_alias)
 
         self.conn = Solr(connection_options['URL'], timeout=self.timeout, **connection_options.get('KWARGS', {}))
+        self.commit_within = connection_options.get('COMMIT_WITHIN')
+        self.soft_commit = connection_options.get('SOFT_COMMIT', False)
+        self.stream_updates = connection_options.get('STREAM_UPDATES', False)
+        self.update_chunk_size = connection_options.get('UPDATE_CHUNK_SIZE', 500)
         self.log = logging.getLogger('searchstack')
 
-    def update(self, index, iterable, commit=True):
-        docs = []
-
-        for obj in iterable:
-            try:
-                docs.append(index.full_prepare(obj))
-            except SkipDocument:
-                self.log.debug("Indexing for object `%s` skipped", obj)
-            except UnicodeDecodeError:
-                if not self.silently_fail:
-                    raise
-
-                # We'll log the object identifier but won't include the actual object
-                # to avoid the possibility of that generating encoding errors while
-                # processing the log message:
-                self.log.error("UnicodeDecodeError while preparing object for update", exc_info=True,
-                               extra={"data": {"index": index,
-                                               "object": get_identifier(obj)}})
-
-        if len(docs) > 0:
-            try:
-                self.conn.add(docs, commit=commit, boost=index.get_field_weights())
-            except (IOError, SolrError) as e:
-                if not self.silently_fail:
-                    raise
-
-                self.log.error("Failed to add documents to Solr: %s", e, exc_info=True)
+    def get_commit_kwargs(self, commit, allow_commit_within=True):
+        """
+        Returns the ``pysolr`` keyword arguments deciding how a change made
+        with ``commit`` becomes visible: within ``COMMIT_WITHIN`` milliseconds
+        (leaving the commit to Solr), through a soft commit if ``SOFT_COMMIT``
+        is set, or else through a hard commit.
+        """
+        if self.commit_within is not None and allow_commit_within:
+            # ``pysolr`` writes this straight into an XML attribute.
+            return {'commit': False, 'commitWithin': '%d' % self.commit_within}
+
+        if commit and self.soft_commit:
+            return {'commit': False, 'softCommit': True}
+
+        return {'commit': commit}
+
+    def send_documents(self, index, documents, commit=True):
+        identifiers = []
+
+        def track(documents):
+            for doc in documents:
+                identifiers.append(doc[ID])
+                yield doc
+
+        try:
+            if self.stream_updates:
+                self.stream_documents(index, track(documents), commit=commit)
+            else:
+                docs = list(track(documents))
+
+                if len(docs) > 0:
+                    self.conn.add(docs, boost=index.get_field_weights(), **self.get_commit_kwargs(commit))
+        except (IOError, SolrError) as e:
+            if not self.silently_fail:
+                raise
+
+            self.log.error("Failed to add documents to Solr: %s", e, exc_info=True)
+            # Solr doesn't say which documents made it, so count all of those
+            # sent as failed.
+            return [(doc_id, "%s: %s" % (e.__class__.__name__, e)) for doc_id in identifiers]
+
+        return []
+
+    def stream_documents(self, index, documents, commit=True):
+        """
+        Posts the documents to Solr's JSON update handler as they are
+        prepared, ``UPDATE_CHUNK_SIZE`` documents per request, then commits
+        once (unless ``COMMIT_WITHIN`` leaves that to Solr).
+        """
+        commit_kwargs = self.get_commit_kwargs(commit)
+        # Fields are boosted 1.0 by default, so only send the others.
+        boosts = dict((name, boost) for name, boost in index.get_field_weights().items() if boost != 1.0)
+        path = 'update'
+
+        if 'commitWithin' in commit_kwargs:
+            path = '%s?commitWithin=%s' % (path, commit_kwargs['commitWithin'])
+
+        chunk = []
+
+        for doc in documents:
+            chunk.append(self._build_json_add(doc, boosts))
+
+            if len(chunk) >= self.update_chunk_size:
+                self._post_json(path, chunk)
+                chunk = []
+
+        if chunk:
+            self._post_json(path, chunk)
+
+        if commit_kwargs.get('commit') or commit_kwargs.get('softCommit'):
+            self.conn.commit(softCommit=commit_kwargs.get('softCommit', False))
+
+    def _build_json_add(self, doc, boosts):
+        # Mirrors what ``pysolr`` does when building its XML ``<doc>``.
+        json_doc = {}
+        add = {'doc': json_doc}
+
+        for key, value in doc.items():
+            if key == 'boost':
+                add['boost'] = value
+                continue
+
+            if isinstance(value, (list, tuple)):
+                value = [self.conn._from_python(bit) for bit in value if not self.conn._is_null_value(bit)]
+            elif self.conn._is_null_value(value):
+                continue
+            else:
+                value = self.conn._from_python(value)
+
+            if key in boosts:
+                value = {'value': value, 'boost': boosts[key]}
+
+            json_doc[key] = value
+
+        return json.dumps(add)
+
+    def _post_json(self, path, adds):
+        # The JSON update syntax repeats the ``add`` key once per document.
+        body = '{%s}' % ','.join('"add":%s' % add for add in adds)
+        self.conn._send_request('post', path, body, {'Content-type': 'application/json; charset=utf-8'})
 
     def remove(self, obj_or_string, commit=True):
         solr_id = get_identifier(obj_or_string)
+        self.forget_digests(identifiers=[solr_id])
 
         try:
-            kwargs = {
-                'commit': commit,
-                'id': solr_id
-            }
+            kwargs = self.get_commit_kwargs(commit, allow_commit_within=False)
+            kwargs['id'] = solr_id
             self.conn.delete(**kwargs)
         except (IOError, SolrError) as e:
             if not self.silently_fail:
@@ -91,10 +172,80 @@ class SolrSearchBackend(BaseSearchBackend):
 
             self.log.error("Failed to remove document '%s' from Solr: %s", solr_id, e, exc_info=True)
 
+        self.bump_write_generations(identifiers=[solr_id])
+
+    def remove_many(self, objs_or_strings, commit=True):
+        """
+        Removes the documents with a delete-by-id request per ``BATCH_SIZE``
+        identifiers, only committing with the last one.
+        """
+        solr_ids = []
+
+        try:
+            for obj_or_string in objs_or_strings:
+                # Hold on to a full batch until there's more to send, so the
+                # last request can carry the commit.
+                if len(solr_ids) >= self.batch_size:
+                    self._delete_ids(solr_ids, commit=False)
+                    solr_ids = []
+
+                solr_ids.append(get_identifier(obj_or_string))
+
+            self._delete_ids(solr_ids, commit=commit)
+        except (IOError, SolrError) as e:
+            if not self.silently_fail:
+                raise
+
+            self.log.error("Failed to remove documents from Solr: %s", e, exc_info=True)
+
+    def _delete_ids(self, solr_ids, commit):
+        kwargs = self.get_commit_kwargs(commit, allow_commit_within=False)
+        self.forget_digests(identifiers=solr_ids)
+
+        if not solr_ids:
+            if kwargs.get('commit') or kwargs.get('softCommit'):
+                self.conn.commit(softCommit=kwargs.get('softCommit', False))
+
+            return
+
+        # ``pysolr`` only deletes a single id at a time.
+        message = '<delete>%s</delete>' % ''.join('<id>%s</id>' % escape(solr_id) for solr_id in solr_ids)
+        self.conn._update(message, **kwargs)
+        self.bump_write_generations(identifiers=solr_ids)
+
+    def scan(self, models, batch_size=None):
+        """
+        Walks the documents of the given models with a ``cursorMark``,
+        fetching only their ``id`` & ``django_id``.
+        """
+        batch_size = batch_size or self.batch_size
+        kwargs = {
+            'fq': '%s:(%s)' % (DJANGO_CT, ' OR '.join(get_model_ct(model) for model in models)),
+            'fl': '%s,%s' % (ID, DJANGO_ID),
+            # A cursor requires a sort on the unique key.
+            'sort': '%s asc' % ID,
+            'rows': batch_size,
+        }
+        cursor = '*'
+
+        while True:
+            results = self.conn.search('*:*', cursorMark=cursor, **kwargs)
+            batch = [(doc[ID], doc[DJANGO_ID]) for doc in results.docs]
+
+            if batch:
+                yield batch
+
+            if not results.nextCursorMark or results.nextCursorMark == cursor:
+                break
+
+            cursor = results.nextCursorMark
+
     def clear(self, models=None, commit=True):
         if models is not None:
             assert isinstance(models, (list, tuple))
 
+        self.forget_digests(models=models)
+
         try:
             if models is None:
                 # *:* matches all docs in Solr
@@ -120,6 +271,8 @@ class SolrSearchBackend(BaseSearchBackend):
             else:
                 self.log.error("Failed to clear Solr index: %s", e, exc_info=True)
 
+        self.bump_write_generations(models=models)
+
     @log_query
     def search(self, query_string, **kwargs):
         if len(query_string) == 0:
@@ -279,6 +432,44 @@ class SolrSearchBackend(BaseSearchBackend):
 
         return kwargs
 
+    def search_chunks(self, query_string, chunk_size=None, **kwargs):
+        """
+        Walks the results of the search a chunk at a time with a
+        ``cursorMark``. A cursor requires a sort on the unique key, which
+        is added after any other sort to break ties.
+
+        Errors aren't silenced, as a partial walk would look like a complete
+        one.
+        """
+        if len(query_string) == 0:
+            return
+
+        search_kwargs = self.build_search_kwargs(query_string, **kwargs)
+        search_kwargs.pop('start', None)
+        search_kwargs['rows'] = chunk_size or self.batch_size
+        sort = search_kwargs.get('sort')
+
+        if not sort:
+            search_kwargs['sort'] = '%s asc' % ID
+        elif ID not in [part.split()[0] for part in sort.split(',')]:
+            search_kwargs['sort'] = '%s, %s asc' % (sort, ID)
+
+        cursor = '*'
+
+        while True:
+            raw_results = self.conn.search(query_string, cursorMark=cursor, **search_kwargs)
+            results = self._process_results(raw_results, highlight=kwargs.get('highlight'),
+                                            result_class=kwargs.get('result_class', SearchResult),
+                                            distance_point=kwargs.get('distance_point'))['results']
+
+            if results:
+                yield results
+
+            if not raw_results.nextCursorMark or raw_results.nextCursorMark == cursor:
+                break
+
+            cursor = raw_results.nextCursorMark
+
     def more_like_this(self, model_instance, additional_query_string=None,
                        start_offset=0, end_offset=None, models=None,
                        limit_to_registered_models=None, result_class=None, **kwargs):
@@ -681,7 +872,7 @@ class SolrSearchQuery(BaseSearchQuery):
         if kwargs:
             search_kwargs.update(kwargs)
 
-        results = self.backend.search(final_query, **search_kwargs)
+        results = self.backend.cached_search(final_query, ttl=self.cache_ttl, **search_kwargs)
         self._results = results.get('results', [])
         self._hit_count = results.get('hits', 0)
         self._facet_counts = self.post_process_facets(results)
@@ -49,3 +49,18 @@ class StatsError(HaystackError):
 class SkipDocument(HaystackError):
     """Raised when a document should be skipped while updating"""
     pass
+
+
+class IndexingError(HaystackError):
+    """
+    Raised when some documents could not be sent to the backend. ``errors``
+    is a list of ``(document id, error)`` pairs.
+    """
+    def __init__(self, message, errors=None):
+        super(IndexingError, self).__init__(message)
+        self.errors = errors or []
+
+
+class CursorError(HaystackError):
+    """Raised when a cursor is invalid or doesn't match the ordering of the results."""
+    pass
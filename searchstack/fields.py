@@ -2,8 +2,10 @@
 from __future__ import unicode_literals
 
 import re
+import threading
 
-from django.template import loader
+from django.core.signals import setting_changed
+from django.template import Context, loader
 from django.utils import datetime_safe, six
 
 from .exceptions import SearchFieldError
@@ -12,6 +14,27 @@ from .utils import get_model_ct_tuple
 # FIXME: use dateutil instead?
 DATETIME_REGEX = re.compile('^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})(T|\s+)(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2}).*?$')
 
+# Templates resolved by ``SearchField.get_template``, keyed per field & model.
+_template_cache = {}
+
+# Text rendered ahead of ``prepare`` by ``SearchField.prerender``, per thread.
+_prerendered = threading.local()
+
+
+def clear_template_cache(**kwargs):
+    """
+    Forgets the templates resolved by ``use_template`` fields. Called when
+    the ``UnifiedIndex`` is reset & when the template settings change.
+    """
+    _template_cache.clear()
+
+
+def _template_settings_changed(setting, **kwargs):
+    if setting in ('TEMPLATES', 'TEMPLATE_DIRS', 'TEMPLATE_LOADERS', 'INSTALLED_APPS'):
+        clear_template_cache()
+
+setting_changed.connect(_template_settings_changed)
+
 
 # All the SearchFields variants.
 
@@ -22,7 +45,7 @@ class SearchField(object):
     def __init__(self, model_attr=None, use_template=False, template_name=None,
                  document=False, indexed=True, stored=True, faceted=False,
                  default=None, null=False, index_fieldname=None,
-                 facet_class=None, boost=1.0, weight=None):
+                 facet_class=None, boost=1.0, weight=None, depends_on=None):
         # Track what the index thinks this field is called.
         self.instance_name = None
         self.model_attr = model_attr
@@ -37,6 +60,9 @@ class SearchField(object):
         self.index_fieldname = index_fieldname
         self.boost = weight or boost
         self.is_multivalued = False
+        # The model attributes the field's value is built from, when they
+        # can't be inferred from ``model_attr``.
+        self.depends_on = tuple(depends_on) if depends_on is not None else None
 
         # We supply the facet_class for making it easy to create a faceted
         # field based off of this field.
@@ -53,6 +79,16 @@ class SearchField(object):
         if self.index_fieldname is None:
             self.index_fieldname = self.instance_name
 
+    @property
+    def model_attr(self):
+        return self._model_attr
+
+    @model_attr.setter
+    def model_attr(self, value):
+        self._model_attr = value
+        # Split the lookup path once rather than on every ``prepare``.
+        self.model_attr_path = tuple(value.split('__')) if value is not None else ()
+
     def has_default(self):
         """Returns a boolean of whether this field has a default value."""
         return self._default is not None
@@ -74,11 +110,10 @@ class SearchField(object):
         if self.use_template:
             return self.prepare_template(obj)
         elif self.model_attr is not None:
-            # Check for `__` in the field for looking through the relation.
-            attrs = self.model_attr.split('__')
+            # Follow `__` in the field through the relation.
             current_object = obj
 
-            for attr in attrs:
+            for attr in self.model_attr_path:
                 if not hasattr(current_object, attr):
                     raise SearchFieldError("The model '%s' does not have a model_attr '%s'." % (repr(current_object), attr))
 
@@ -108,14 +143,11 @@ class SearchField(object):
         else:
             return None
 
-    def prepare_template(self, obj):
+    def get_template_names(self, obj):
         """
-        Flattens an object for indexing.
-
-        This loads a template
-        (``search/indexes/{app_label}/{model_name}_{field_name}.txt``) and
-        returns the result of rendering that template. ``object`` will be in
-        its context.
+        Returns the candidate template names for ``obj``: ``template_name`` if
+        provided, otherwise
+        ``search/indexes/{app_label}/{model_name}_{field_name}.txt``.
         """
         if self.instance_name is None and self.template_name is None:
             raise SearchFieldError("This field requires either its instance_name variable to be populated or an explicit template_name in order to load the correct template.")
@@ -129,8 +161,100 @@ class SearchField(object):
             app_label, model_name = get_model_ct_tuple(obj)
             template_names = ['search/indexes/%s/%s_%s.txt' % (app_label, model_name, self.instance_name)]
 
-        t = loader.select_template(template_names)
-        return t.render({'object': obj})
+        return template_names
+
+    def get_template(self, obj):
+        """
+        Returns the template used to render ``obj``.
+
+        Each template is only looked up through the template loaders once per
+        field & model; later calls are served from a cache.
+        """
+        template_name = self.template_name
+
+        if isinstance(template_name, list):
+            template_name = tuple(template_name)
+
+        key = (self, type(obj), self.instance_name, template_name)
+
+        try:
+            return _template_cache[key]
+        except KeyError:
+            template = _template_cache[key] = loader.select_template(self.get_template_names(obj))
+            return template
+
+    def prepare_template(self, obj):
+        """
+        Flattens an object for indexing.
+
+        This loads a template
+        (``search/indexes/{app_label}/{model_name}_{field_name}.txt``) and
+        returns the result of rendering that template. ``object`` will be in
+        its context.
+        """
+        rendered = getattr(_prerendered, 'values', None)
+
+        if rendered:
+            try:
+                return rendered[(id(self), id(obj))]
+            except KeyError:
+                pass
+
+        return self.get_template(obj).render({'object': obj})
+
+    def prepare_template_batch(self, objs):
+        """
+        Renders the template for each of ``objs``, returning a list of the
+        results.
+
+        The template is looked up once per model in the batch & Django
+        templates are rendered with a single reused ``Context``, rather than
+        building a new one for every object. Each object gets its own layer,
+        so that variables a template assigns don't leak into the next one.
+        """
+        templates = {}
+        context = None
+        results = []
+
+        for obj in objs:
+            template = templates.get(type(obj))
+
+            if template is None:
+                template = templates[type(obj)] = self.get_template(obj)
+
+            # The ``Template`` of the Django engine, if that's what this is.
+            django_template = getattr(template, 'template', None)
+
+            if not hasattr(django_template, 'render'):
+                results.append(template.render({'object': obj}))
+                continue
+
+            if context is None:
+                context = Context(autoescape=getattr(django_template.engine, 'autoescape', True))
+
+            with context.push(object=obj):
+                results.append(django_template.render(context))
+
+        return results
+
+    def prerender(self, objs):
+        """
+        Renders the template for all of ``objs`` at once (see
+        ``prepare_template_batch``) & keeps the results for ``prepare`` to
+        pick up in this thread, until ``prerender`` is called again with no
+        objects. Used through ``SearchIndex.prerender_templates``.
+        """
+        rendered = getattr(_prerendered, 'values', None)
+
+        if rendered is None:
+            rendered = _prerendered.values = {}
+
+        for key in [key for key in rendered if key[0] == id(self)]:
+            del rendered[key]
+
+        if objs:
+            rendered.update(((id(self), id(obj)), text)
+                            for obj, text in zip(objs, self.prepare_template_batch(objs)))
 
     def convert(self, value):
         """
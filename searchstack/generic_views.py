@@ -2,12 +2,14 @@
 from __future__ import unicode_literals
 
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.http import Http404
 from django.views.generic import FormView
 from django.views.generic.edit import FormMixin
 from django.views.generic.list import MultipleObjectMixin
 
+from .exceptions import CursorError
 from .forms import FacetedSearchForm, ModelSearchForm
+from .paginator import CursorPaginator, SearchPaginator
 from .query import SearchQuerySet
 
 RESULTS_PER_PAGE = getattr(settings, 'SEARCHSTACK_SEARCH_RESULTS_PER_PAGE', 20)
@@ -46,8 +48,10 @@ class SearchMixin(MultipleObjectMixin, FormMixin):
     context_object_name = None
     paginate_by = RESULTS_PER_PAGE
     paginate_orphans = 0
-    paginator_class = Paginator
+    paginator_class = SearchPaginator
     page_kwarg = 'page'
+    cursor_pagination = False
+    cursor_kwarg = 'cursor'
     form_name = 'form'
     search_field = 'q'
     object_list = None
@@ -64,6 +68,23 @@ class SearchMixin(MultipleObjectMixin, FormMixin):
         kwargs.update({'searchqueryset': self.get_queryset()})
         return kwargs
 
+    def paginate_queryset(self, queryset, page_size):
+        """
+        With ``cursor_pagination``, paginates with the ``cursor_kwarg``
+        parameter rather than ``page_kwarg`` (see ``CursorPaginator``).
+        """
+        if not self.cursor_pagination:
+            return super(SearchMixin, self).paginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(queryset, page_size)
+
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg) or None)
+        except CursorError:
+            raise Http404("Not a valid cursor.")
+
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def form_invalid(self, form):
         context = self.get_context_data(**{
             self.form_name: form,
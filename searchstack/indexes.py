@@ -4,8 +4,11 @@ from __future__ import unicode_literals
 import copy
 import threading
 import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
 
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.utils import six
 from django.utils.six import with_metaclass
 
 from . import connection_router, connections
@@ -13,6 +16,9 @@ from .constants import DEFAULT_ALIAS, DJANGO_CT, DJANGO_ID, ID, Indexable
 from .fields import *  # NOQA
 from .manager import SearchIndexManager
 from .utils import get_facet_field_name, get_identifier, get_model_ct
+from .utils.changes import changed_fields
+from .utils.fanout import FanOutBackend
+from .utils.relations import get_relation, related_lookups, resolve_relations
 
 try:
     from django.utils.encoding import force_text
@@ -80,6 +86,70 @@ class DeclarativeMetaclass(type):
         return super(DeclarativeMetaclass, cls).__new__(cls, name, bases, attrs)
 
 
+class PreparationPlan(object):
+    """
+    The per-object work of ``SearchIndex.prepare`` & ``full_prepare``,
+    resolved once per index.
+
+    Holds, in field order, the bound ``field.prepare`` & ``prepare_<field>``
+    callables for each field, plus the (usually short) list of the fields
+    which are facets to populate from their source or nullable fields to
+    drop when empty.
+    """
+    def __init__(self, index):
+        self.steps = []
+        self.final_steps = []
+
+        for field_name, field in index.fields.items():
+            custom_prepare = getattr(index, 'prepare_%s' % field_name, None)
+            self.steps.append((field.index_fieldname, field.prepare, custom_prepare))
+            source_field_name = None
+
+            if getattr(field, 'facet_for', None):
+                source_field_name = index.fields[field.facet_for].index_fieldname
+
+            null = field.null is True
+
+            if source_field_name is not None or null:
+                self.final_steps.append((field_name, field.index_fieldname, source_field_name, null))
+
+    def prepare(self, index, obj):
+        # ``prepare_<field>`` methods may look at what has been prepared so
+        # far, so the data is exposed on the index while it's being built.
+        data = index.prepared_data = {
+            ID: get_identifier(obj),
+            DJANGO_CT: get_model_ct(obj),
+            DJANGO_ID: force_text(obj.pk),
+        }
+
+        for index_fieldname, prepare, custom_prepare in self.steps:
+            # Use the possibly overridden name, which will default to the
+            # variable name of the field.
+            data[index_fieldname] = prepare(obj)
+
+            if custom_prepare is not None:
+                data[index_fieldname] = custom_prepare(obj)
+
+        return data
+
+    def finalize(self, data):
+        # One field at a time, in field order: a facet isn't populated from
+        # a source field which has already been dropped.
+        for field_name, index_fieldname, source_field_name, null in self.final_steps:
+            # Duplicate data for faceted fields. If there's data there, leave
+            # it alone. Otherwise, populate it with whatever the related field
+            # has.
+            if source_field_name is not None:
+                if data[field_name] is None and source_field_name in data:
+                    data[index_fieldname] = data[source_field_name]
+
+            # Remove any fields that lack a value and are ``null=True``.
+            if null and data[index_fieldname] is None:
+                del data[index_fieldname]
+
+        return data
+
+
 class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
     """
     Base class for building indexes.
@@ -102,6 +172,13 @@ class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
                 return self.get_model().objects.filter(pub_date__lte=datetime.datetime.now())
 
     """
+    # Whether ``build_queryset`` should apply the ``select_related`` &
+    # ``prefetch_related`` lookups inferred from the fields' ``model_attr``.
+    infer_related_lookups = True
+    # The model attributes read by an overridden ``prepare``/``full_prepare``
+    # (see ``get_dependencies``).
+    depends_on = None
+
     def __init__(self):
         self.prepared_data = None
         content_fields = []
@@ -142,7 +219,7 @@ class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
         """
         return self.index_queryset(using=using)
 
-    def build_queryset(self, using=None, start_date=None, end_date=None):
+    def build_queryset(self, using=None, start_date=None, end_date=None, after_pk=None, until_pk=None):
         """
         Get the default QuerySet to index when doing an index update.
 
@@ -151,11 +228,27 @@ class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
 
         The default is to use ``SearchIndex.index_queryset`` and filter
         based on ``SearchIndex.get_updated_field``
+
+        ``after_pk`` & ``until_pk`` restrict the QuerySet to a primary key
+        range (``after_pk < pk <= until_pk``), which is used for keyset
+        batching. Since the results are always ordered by primary key, slicing
+        ``build_queryset(after_pk=last_pk)[:batch_size]`` yields the next batch
+        without an ``OFFSET``.
+
+        Unless ``infer_related_lookups`` is ``False``, the relations traversed
+        by the fields' ``model_attr`` are loaded up front (see
+        ``get_related_lookups``).
         """
         extra_lookup_kwargs = {}
         model = self.get_model()
         updated_field = self.get_updated_field()
 
+        if after_pk is not None:
+            extra_lookup_kwargs['pk__gt'] = after_pk
+
+        if until_pk is not None:
+            extra_lookup_kwargs['pk__lte'] = until_pk
+
         update_field_msg = ("No updated date field found for '%s' "
                             "- not restricting by age.") % model.__name__
 
@@ -176,50 +269,206 @@ class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
         if not hasattr(index_qs, 'filter'):
             raise ImproperlyConfigured("The '%r' class must return a 'QuerySet' in the 'index_queryset' method." % self)
 
-        # `.select_related()` seems like a good idea here but can fail on
-        # nullable `ForeignKey` as well as what seems like other cases.
-        return index_qs.filter(**extra_lookup_kwargs).order_by(model._meta.pk.name)
+        index_qs = index_qs.filter(**extra_lookup_kwargs).order_by(model._meta.pk.name)
 
-    def prepare(self, obj):
+        if self.infer_related_lookups:
+            select_related, prefetch_related = self.get_related_lookups()
+
+            # Only the named relations are joined; a bare `.select_related()`
+            # would skip nullable `ForeignKey`s & follow everything else.
+            if select_related:
+                index_qs = index_qs.select_related(*select_related)
+
+            if prefetch_related:
+                index_qs = index_qs.prefetch_related(*prefetch_related)
+
+        return index_qs
+
+    def get_related_lookups(self):
         """
-        Fetches and adds/alters data before indexing.
+        Returns a ``(select_related, prefetch_related)`` pair of lookup lists
+        covering the relations walked by the fields' ``model_attr`` paths, so
+        that preparing a batch doesn't cost a query per object & relation.
+
+        Relations used only from templates or ``prepare_<field>`` methods
+        can't be inferred; override this (or ``index_queryset``) to add them.
         """
-        self.prepared_data = {
-            ID: get_identifier(obj),
-            DJANGO_CT: get_model_ct(obj),
-            DJANGO_ID: force_text(obj.pk),
-        }
+        paths = [field.model_attr_path for field in self.fields.values() if field.model_attr_path]
+        return related_lookups(self.get_model(), paths)
+
+    def get_dependencies(self):
+        """
+        Returns the names of the model fields that the documents of this
+        index are built from, or ``None`` if they can't all be known.
+
+        Each field contributes the fields named in its ``depends_on`` or,
+        failing that, the first attribute of its ``model_attr`` (relations
+        to many objects aren't changed by saving the instance, so they don't
+        count). Fields using a template, a ``prepare_<field>`` method or a
+        ``model_attr`` that isn't a model field (such as a method) need a
+        ``depends_on``, as does an overridden ``prepare`` (on the index).
+        """
+        dependencies = getattr(self, '_dependencies', False)
+
+        if dependencies is False:
+            dependencies = self._dependencies = self.build_dependencies()
+
+        return dependencies
+
+    def build_dependencies(self):
+        model = self.get_model()
+        cls = type(self)
+
+        # On Python 2, each access to a method through its class gives a new
+        # unbound method, so the functions are compared.
+        overridden = [name for name in ('prepare', 'full_prepare')
+                      if six.get_unbound_function(getattr(cls, name))
+                      is not six.get_unbound_function(getattr(SearchIndex, name))]
+
+        if self.depends_on is None and overridden:
+            return None
+
+        names = list(self.depends_on or ())
 
         for field_name, field in self.fields.items():
-            # Use the possibly overridden name, which will default to the
-            # variable name of the field.
-            self.prepared_data[field.index_fieldname] = field.prepare(obj)
+            if field.depends_on is not None:
+                names.extend(field.depends_on)
+            elif field.use_template or hasattr(self, 'prepare_%s' % field_name):
+                return None
+            elif field.model_attr_path:
+                names.append(field.model_attr_path[0])
+
+        dependencies = set()
 
-            if hasattr(self, "prepare_%s" % field_name):
-                value = getattr(self, "prepare_%s" % field_name)(obj)
-                self.prepared_data[field.index_fieldname] = value
+        for name in names:
+            try:
+                model_field = model._meta.get_field(name.split('__')[0])
+            except FieldDoesNotExist:
+                # Reverse relations are found by their accessor.
+                model_field = get_relation(model, name.split('__')[0])
+
+                if model_field is None:
+                    return None
+
+            if model_field in model._meta.concrete_fields:
+                dependencies.add(model_field.name)
+
+        return frozenset(dependencies)
+
+    def get_related_dependencies(self):
+        """
+        Returns the related models whose data ends up in the documents of
+        this index, through the relations in the fields' ``model_attr`` &
+        ``depends_on`` paths (such as ``model_attr='author__name'``).
+
+        Each is a ``(model, lookup, fields)`` triple: ``lookup`` filters the
+        indexed objects down to those related to an instance of ``model``
+        (given its pk) & ``fields`` are the names of ``model``'s fields that
+        are read, or ``None`` if any change may matter (the related object
+        itself or one of its methods is used).
+        """
+        model = self.get_model()
+        paths = [tuple(name.split('__')) for name in self.depends_on or ()]
+
+        for field in self.fields.values():
+            if field.depends_on is not None:
+                paths.extend(tuple(name.split('__')) for name in field.depends_on)
+            elif field.model_attr_path:
+                paths.append(field.model_attr_path)
+
+        dependencies = OrderedDict()
+
+        for path in paths:
+            lookup = []
+
+            for depth, (name, relation) in enumerate(resolve_relations(model, path)):
+                # Reverse relations are queried by their ``related_query_name``.
+                lookup.append(relation.name)
+                related_model = relation.related_model
+                key = (related_model, '__'.join(lookup))
+                fields = dependencies.get(key, frozenset())
+
+                if depth + 1 == len(path):
+                    fields = None
+                elif fields is not None:
+                    try:
+                        related_field = related_model._meta.get_field(path[depth + 1])
+                    except FieldDoesNotExist:
+                        related_field = get_relation(related_model, path[depth + 1])
 
-        return self.prepared_data
+                    if related_field is None:
+                        fields = None
+                    elif related_field in related_model._meta.concrete_fields:
+                        fields = fields | frozenset([related_field.name])
+
+                dependencies[key] = fields
+
+        return [(related_model, lookup, fields) for (related_model, lookup), fields in dependencies.items()]
+
+    def get_changed_fields(self, instance, update_fields=None, **kwargs):
+        """
+        Returns the names of the model fields changed by the save being
+        handled: those in ``update_fields`` if given, else those which differ
+        from the snapshot taken when the instance was loaded or last saved
+        (see ``searchstack.utils.changes``). Returns ``None`` if that's
+        unknown.
+        """
+        return changed_fields(instance, update_fields)
+
+    def get_preparation_plan(self):
+        """
+        Returns the compiled ``PreparationPlan`` for this index, building it
+        on first use (``UnifiedIndex.build`` normally builds it up front).
+        """
+        plan = getattr(self, '_preparation_plan', None)
+
+        if plan is None:
+            plan = self.build_preparation_plan()
+
+        return plan
+
+    def build_preparation_plan(self):
+        """
+        (Re)compiles the ``PreparationPlan`` used by ``prepare`` and
+        ``full_prepare``. Call this again if ``fields`` or the
+        ``prepare_<field>`` methods are altered after the index is built.
+        """
+        self._preparation_plan = PreparationPlan(self)
+        return self._preparation_plan
+
+    def prepare(self, obj):
+        """
+        Fetches and adds/alters data before indexing.
+        """
+        return self.get_preparation_plan().prepare(self, obj)
 
     def full_prepare(self, obj):
         self.prepared_data = self.prepare(obj)
+        return self.get_preparation_plan().finalize(self.prepared_data)
 
-        for field_name, field in self.fields.items():
-            # Duplicate data for faceted fields.
-            if getattr(field, 'facet_for', None):
-                source_field_name = self.fields[field.facet_for].index_fieldname
+    @contextmanager
+    def prerender_templates(self, objs):
+        """
+        Renders the templates of the ``use_template`` fields for a whole
+        batch of objects up front (see ``SearchField.prepare_template_batch``),
+        so that preparing each of ``objs`` within the block reuses the text.
 
-                # If there's data there, leave it alone. Otherwise, populate it
-                # with whatever the related field has.
-                if self.prepared_data[field_name] is None and source_field_name in self.prepared_data:
-                    self.prepared_data[field.index_fieldname] = self.prepared_data[source_field_name]
+        A field whose batch fails to render is left to render (& raise) one
+        object at a time as usual.
+        """
+        template_fields = [field for field in self.fields.values() if field.use_template]
 
-            # Remove any fields that lack a value and are ``null=True``.
-            if field.null is True:
-                if self.prepared_data[field.index_fieldname] is None:
-                    del self.prepared_data[field.index_fieldname]
+        for field in template_fields:
+            try:
+                field.prerender(objs)
+            except Exception:
+                field.prerender([])
 
-        return self.prepared_data
+        try:
+            yield
+        finally:
+            for field in template_fields:
+                field.prerender([])
 
     def get_content_field(self):
         """Returns the field that supplies the primary document to be indexed."""
@@ -243,6 +492,11 @@ class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
                 # There's no backend to handle it. Bomb out.
                 return None
 
+        if isinstance(using, (list, tuple)):
+            # Several connections with an equivalent index: prepare once &
+            # send to all of them at the same time.
+            return FanOutBackend([connections[alias].get_backend() for alias in using])
+
         return connections[using].get_backend()
 
     def update(self, using=None):
@@ -265,7 +519,8 @@ class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
 
         If ``using`` is provided, it specifies which connection should be
         used. Default relies on the routers to decide which backend should
-        be used.
+        be used. A list of connections (whose indexes are equivalent to this
+        one) gets the object prepared once & sent to all of them at once.
         """
         # Check to make sure we want to index this first.
         if self.should_update(instance, **kwargs):
@@ -279,6 +534,20 @@ class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
         Remove an object from the index. Attached to the class's
         post-delete hook.
 
+        If ``using`` is provided, it specifies which connection (or list of
+        connections) should be used. Default relies on the routers to decide
+        which backend should be used.
+        """
+        backend = self._get_backend(using)
+
+        if backend is not None:
+            backend.remove(instance, **kwargs)
+
+    def remove_queryset(self, qs, using=None, commit=True):
+        """
+        Removes every object in ``qs`` from the index, in batches (see
+        ``remove_many`` on the backend) rather than one request per object.
+
         If ``using`` is provided, it specifies which connection should be
         used. Default relies on the routers to decide which backend should
         be used.
@@ -286,7 +555,7 @@ class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
         backend = self._get_backend(using)
 
         if backend is not None:
-            backend.remove(instance, **kwargs)
+            backend.remove_many(qs.iterator(), commit=commit)
 
     def clear(self, using=None):
         """
@@ -331,9 +600,21 @@ class SearchIndex(with_metaclass(DeclarativeMetaclass, threading.local)):
         cause excessive reindexing. You should check conditions on the instance
         and return False if it is not to be indexed.
 
-        By default, returns True (always reindex).
+        By default, a save (as handled by the signal processors, which pass
+        ``created`` & ``update_fields``) is skipped when none of the fields
+        it changed are among ``get_dependencies``. Otherwise, returns True
+        (always reindex).
         """
-        return True
+        if 'update_fields' not in kwargs or kwargs.get('created'):
+            return True
+
+        dependencies = self.get_dependencies()
+
+        if dependencies is None:
+            return True
+
+        changed = self.get_changed_fields(instance, **kwargs)
+        return changed is None or not changed.isdisjoint(dependencies)
 
     def load_all_queryset(self):
         """
@@ -0,0 +1,209 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.encoding import force_text
+
+from ... import connections as haystack_connections
+from ...utils import backoff_delay, get_identifier
+from ...utils.state import IndexQueue, shared_state_file
+
+# The longest a failed entry waits before being retried, in seconds.
+MAX_BACKOFF = 3600
+
+options = {
+    ('-k', '--workers'): {
+        'action': 'store',
+        'dest': 'workers',
+        'default': 1,
+        'type': int,
+        'help': 'Number of threads draining the queue.',
+    },
+    ('-b', '--batch-size'): {
+        'action': 'store',
+        'dest': 'batchsize',
+        'default': 1000,
+        'type': int,
+        'help': 'Number of entries each worker claims at once.',
+    },
+    ('--max-attempts',): {
+        'action': 'store',
+        'dest': 'max_attempts',
+        'default': 5,
+        'type': int,
+        'help': 'Number of times an entry is tried before being parked. Default is 5.',
+    },
+    ('--backoff',): {
+        'action': 'store',
+        'dest': 'backoff',
+        'default': 1.0,
+        'type': float,
+        'help': 'Number of seconds before the first retry of a failed entry, doubled for every '
+                'further attempt. Default is 1.',
+    },
+    ('--lease',): {
+        'action': 'store',
+        'dest': 'lease',
+        'default': 300,
+        'type': int,
+        'help': 'Number of seconds a worker holds the entries it claimed. Entries still held after that '
+                '(e.g. because the worker died) are handed out again. Default is 300.',
+    },
+    ('--poll',): {
+        'action': 'store',
+        'dest': 'poll',
+        'default': None,
+        'type': float,
+        'help': 'Keep running, checking the queue every POLL seconds when it is empty. '
+                'By default the command exits once nothing is left to process.',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Indexes the changes recorded by the QueuedSignalProcessor."
+
+    def add_arguments(self, parser):
+        for args, kwargs in options.items():
+            parser.add_argument(*args, **kwargs)
+
+    def handle(self, **options):
+        for opt, val in options.items():
+            setattr(self, opt, val)
+
+        try:
+            self.queue = IndexQueue(shared_state_file())
+        except ImproperlyConfigured as e:
+            raise CommandError(force_text(e))
+
+        self.log = logging.getLogger('searchstack')
+        self.counts = OrderedDict((outcome, 0) for outcome in ('updated', 'removed', 'retried', 'parked'))
+        self._lock = threading.Lock()
+
+        if self.workers > 1:
+            threads = [threading.Thread(target=self.work) for i in range(self.workers)]
+
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+        else:
+            self.work()
+
+        if self.verbosity >= 1:
+            pending, parked = self.queue.counts()
+            self.stdout.write("Updated %(updated)d & removed %(removed)d documents, "
+                              "retried %(retried)d & parked %(parked)d entries." % self.counts)
+            self.stdout.write("%d entries pending, %d parked." % (pending, parked))
+
+    def work(self):
+        try:
+            while True:
+                entries = self.queue.claim(self.batchsize, self.lease)
+
+                if entries:
+                    self.process(entries)
+                elif self.poll is None:
+                    break
+                else:
+                    time.sleep(self.poll)
+        finally:
+            # Each thread gets its own connections; don't leak them.
+            connections.close_all()
+            self.queue.close()
+
+    def process(self, entries):
+        """
+        Indexes a batch of claimed entries, one request per connection &
+        model & kind of change.
+
+        Repeated entries for the same object are merged, the last action
+        winning. Objects are read back through ``index_queryset``, so that
+        what's sent reflects the database as it is now; those that are gone
+        are removed.
+        """
+        groups = OrderedDict()
+
+        for entry_id, action, model, pk, using, attempts in entries:
+            objects = groups.setdefault((using, model), OrderedDict())
+            ids, last_action, most_attempts = objects.pop(pk, ([], None, 0))
+            # Re-inserted, so that objects stay in the order of their last entry.
+            objects[pk] = (ids + [entry_id], action, max(attempts, most_attempts))
+
+        for (using, model), objects in groups.items():
+            try:
+                self.index_objects(using, model, objects)
+            except Exception as e:
+                self.log.exception("Error processing the queued changes to '%s' on '%s'.", model, using)
+                self.fail(objects.values(), e)
+
+    def index_objects(self, using, model, objects):
+        model_class = apps.get_model(model)
+        connection = haystack_connections[using]
+        index = connection.get_unified_index().get_index(model_class)
+        backend = connection.get_backend()
+
+        pks = [model_class._meta.pk.to_python(pk) for pk, (ids, action, attempts) in objects.items()
+               if action == 'update']
+        current = list(index.index_queryset(using=using).filter(pk__in=pks)) if pks else []
+        current_objs = dict((force_text(obj.pk), obj) for obj in current)
+
+        def identifier(pk):
+            # Removed objects are gone, so an unsaved instance stands in.
+            return get_identifier(current_objs.get(pk) or model_class(pk=model_class._meta.pk.to_python(pk)))
+
+        removed = [identifier(pk) for pk in objects if pk not in current_objs]
+        failures = []
+
+        if current:
+            failures = backend.update(index, current) or []
+
+        if removed:
+            backend.remove_many(removed)
+
+        failed = dict(failures)
+        done = []
+
+        for pk, entry in objects.items():
+            error = failed.get(identifier(pk))
+
+            if error is None:
+                done.extend(entry[0])
+            else:
+                self.fail([entry], error)
+
+        self.queue.ack(done)
+        self.add('updated', len(current) - len(failed))
+        self.add('removed', len(removed))
+
+    def fail(self, entries, error):
+        """
+        Releases ``entries`` (``(ids, action, attempts)`` tuples) to be
+        retried with an exponential backoff, or parks them once they've been
+        tried ``--max-attempts`` times.
+        """
+        error = force_text(error)
+
+        for ids, action, attempts in entries:
+            attempts += 1
+
+            if attempts >= self.max_attempts:
+                self.queue.park(ids, attempts, error)
+                self.add('parked', len(ids))
+            else:
+                self.queue.retry(ids, attempts, backoff_delay(attempts, self.backoff, MAX_BACKOFF), error)
+                self.add('retried', len(ids))
+
+    def add(self, outcome, count):
+        with self._lock:
+            self.counts[outcome] += count
@@ -1,10 +1,16 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
+from datetime import timedelta
+
 from django.core.management import call_command
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
 
+from ... import connections
+from ...utils import get_model_ct
 from .clear_index import options as clear_opts
+from .update_index import Command as UpdateIndexCommand
 from .update_index import options as update_opts
 
 
@@ -15,12 +21,111 @@ class Command(BaseCommand):
         # only a subset of clear_index/update_index options make sense when
         # called from rebuild_index:
         use_opts = [('--noinput',), ('-u', '--using'), ('--nocommit',), ('-b', '--batch-size'),
-                    ('-k', '--workers')]
+                    ('-k', '--workers'), ('--keyset',), ('--resume',), ('--bulk-load',), ('--fan-out',),
+                    ('--pipeline',), ('--read-workers',), ('--prepare-workers',), ('--send-workers',),
+                    ('--queue-size',)]
         for opt_args in use_opts:
             # try to get from clear_opts, otherwise must exist in update_opts
             opt_kwargs = clear_opts.get(opt_args, update_opts.get(opt_args))
             parser.add_argument(*opt_args, **opt_kwargs)
 
+        parser.add_argument(
+            '--blue-green', action='store_true', dest='blue_green', default=False,
+            help='Build a new copy of the index & switch searches to it once it is complete, '
+                 'instead of clearing the current one.'
+        )
+        parser.add_argument(
+            '--overlap', action='store', dest='overlap', default=300, type=int,
+            help='With --blue-green, number of seconds before the start of the rebuild from which objects '
+                 'updated meanwhile are indexed again before switching searches. Default is 300.'
+        )
+
     def handle(self, **options):
-        call_command('clear_index', **options)
+        if options.get('blue_green'):
+            return self.rebuild_blue_green(**options)
+
+        # Resuming carries on from where an interrupted rebuild stopped, so
+        # the index mustn't be cleared again.
+        if not options.get('resume'):
+            call_command('clear_index', **options)
+
         call_command('update_index', **options)
+
+    def rebuild_blue_green(self, **options):
+        if options.get('resume'):
+            raise CommandError("--blue-green always builds a new copy of the index & cannot be combined with "
+                               "--resume.")
+
+        backends = []
+        started = now()
+
+        try:
+            for using in options['using']:
+                backend = connections[using].get_backend()
+
+                try:
+                    generation = backend.start_generation()
+                except NotImplementedError:
+                    raise CommandError("The backend of connection '%s' doesn't support --blue-green." % using)
+
+                backends.append(backend)
+
+                if options['verbosity'] >= 1:
+                    self.stdout.write("Building '%s' for connection '%s'." % (generation, using))
+
+            call_command('update_index', **options)
+            self.catch_up(started - timedelta(seconds=options['overlap']), **options)
+        except:
+            # Searches never saw the new copies, so just drop them.
+            for backend in backends:
+                backend.discard_generation()
+
+            raise
+
+        for backend in backends:
+            backend.publish_generation()
+
+        if options['verbosity'] >= 1:
+            self.stdout.write("Switched searches to the rebuilt index.")
+
+    def catch_up(self, start_date, **options):
+        """
+        Brings the new copies up to date with the changes the site made to
+        the current index while they were being built: the objects updated
+        since ``start_date`` are indexed again (see ``get_updated_field``) &
+        the documents of objects deleted meanwhile removed from the copies.
+
+        Indexes without an updated field can't tell what changed; their
+        objects aren't indexed again (which would mean all of them), only
+        their deleted objects are removed.
+        """
+        if options['verbosity'] >= 1:
+            self.stdout.write("Catching up with the changes made during the rebuild.")
+
+        labels = set()
+        untracked = []
+
+        for using in options['using']:
+            for model, index in connections[using].get_unified_index().get_indexes().items():
+                if index.get_updated_field():
+                    labels.add(get_model_ct(model))
+                else:
+                    untracked.append((using, index))
+
+                    if options['verbosity'] >= 1:
+                        self.stdout.write("  '%s' has no updated field: objects updated during the rebuild "
+                                          "aren't indexed again." % get_model_ct(model))
+
+        if labels:
+            call_command('update_index', *sorted(labels), **dict(options, start_date=start_date, remove=True))
+
+        if untracked:
+            updater = UpdateIndexCommand()
+            updater.stdout = self.stdout
+            updater.verbosity = options['verbosity']
+            updater.commit = options['commit']
+
+            for using, index in untracked:
+                backend = connections[using].get_backend()
+                updater.remove_stale(backend, index, index.index_queryset(using=using),
+                                     options['batchsize'] or backend.batch_size)
@@ -0,0 +1,109 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+from itertools import groupby
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.utils.encoding import force_text
+
+from ... import connections
+from ...exceptions import IndexingError, NotHandled
+from ...utils.state import DeadLetterStore
+
+options = {
+    ('-u', '--using'): {
+        'action': 'append',
+        'dest': 'using',
+        'default': list(connections.connections_info.keys()),
+        'help': 'Replay only the dead letters of the named backend (can be used multiple times). '
+                'By default those of all backends are replayed.',
+    },
+    ('-b', '--batch-size'): {
+        'action': 'store',
+        'dest': 'batchsize',
+        'default': None,
+        'type': int,
+        'help': 'Number of documents to send at once.',
+    },
+    ('--discard',): {
+        'action': 'store_true',
+        'dest': 'discard',
+        'default': False,
+        'help': 'Drop the dead letters without sending anything.',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Sends the documents recorded in the dead-letter store (see DEAD_LETTERS) again."
+
+    def add_arguments(self, parser):
+        for args, kwargs in options.items():
+            parser.add_argument(*args, **kwargs)
+
+    def handle(self, **options):
+        self.verbosity = options['verbosity']
+        self.batchsize = options['batchsize']
+        self.store = DeadLetterStore()
+
+        for using in options['using']:
+            if options['discard']:
+                count = self.store.count(using)
+                self.store.clear(using)
+
+                if self.verbosity >= 1:
+                    self.stdout.write("Discarded %d dead letters of '%s'." % (count, using))
+            else:
+                self.replay(using)
+
+    def replay(self, using):
+        """
+        Reads the objects of ``using``'s dead letters back through
+        ``index_queryset`` & sends them again, a batch at a time; those that
+        are gone are removed. Letters are dropped once their document has
+        been sent, or removed.
+        """
+        connection = connections[using]
+        backend = connection.get_backend()
+        batch_size = self.batchsize or backend.batch_size
+        counts = {'indexed': 0, 'removed': 0, 'failed': 0}
+
+        for model, letters in groupby(self.store.get_all(using), lambda letter: letter[1]):
+            letters = list(letters)
+
+            try:
+                model_class = apps.get_model(model)
+                index = connection.get_unified_index().get_index(model_class)
+            except (LookupError, NotHandled):
+                self.stderr.write("Skipping %d dead letters of '%s' - no index." % (len(letters), model))
+                continue
+
+            for start in range(0, len(letters), batch_size):
+                batch = letters[start:start + batch_size]
+                pks = [model_class._meta.pk.to_python(pk) for identifier, model, pk, error in batch]
+                current = list(index.index_queryset(using=using).filter(pk__in=pks))
+                current_pks = set(force_text(obj.pk) for obj in current)
+                removed = [identifier for identifier, model, pk, error in batch if pk not in current_pks]
+                failures = []
+
+                if current:
+                    try:
+                        failures = backend.update(index, current) or []
+                    except IndexingError as e:
+                        failures = e.errors
+
+                if removed:
+                    backend.remove_many(removed)
+
+                # The backend records the documents that failed again.
+                failed = set(doc_id for doc_id, error in failures)
+                self.store.delete_many(using, [identifier for identifier, model, pk, error in batch
+                                               if identifier not in failed])
+                counts['indexed'] += len(current) - len(failed)
+                counts['removed'] += len(removed)
+                counts['failed'] += len(failed)
+
+        if self.verbosity >= 1:
+            self.stdout.write("Replayed the dead letters of '%s': %d documents indexed, %d removed & %d still "
+                              "failing." % (using, counts['indexed'], counts['removed'], counts['failed']))
@@ -6,14 +6,19 @@ import os
 from datetime import timedelta
 
 from dateutil.parser import parse as dateutil_parse
-from django.core.management.base import BaseCommand
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
 from django.db import connections, reset_queries
-from django.utils.encoding import force_text, smart_bytes
+from django.db.models import Max
+from django.utils.encoding import force_text
 from django.utils.timezone import now
 
 from ... import connections as haystack_connections
-from ...query import SearchQuerySet
+from ...utils import get_model_ct
 from ...utils.app_loading import haystack_get_models, haystack_load_apps
+from ...utils.fanout import FanOutBackend, group_equivalent
+from ...utils.pipeline import IndexingPipeline, QueryCounter
+from ...utils.state import CheckpointStore, HighWaterMarkStore, remaining_ranges
 
 
 def worker(queue):
@@ -38,6 +43,17 @@ def worker(queue):
 
             qs = index.build_queryset(start_date=start_date, end_date=end_date)
             do_update(backend, index, qs, start, end, total, verbosity=verbosity, commit=commit)
+        elif bits[0] == 'do_update_range':
+            func, model, after_pk, until_pk, start, end, total, using, start_date, end_date, verbosity, commit = bits
+
+            unified_index = haystack_connections[using].get_unified_index()
+            index = unified_index.get_index(model)
+            backend = haystack_connections[using].get_backend()
+
+            qs = index.build_queryset(using=using, start_date=start_date, end_date=end_date,
+                                      after_pk=after_pk, until_pk=until_pk)
+            do_update_batch(backend, index, qs, start, end, total, verbosity=verbosity, commit=commit)
+            CheckpointStore().complete(using, get_model_ct(model), after_pk, until_pk)
 
         queue.task_done()  # mark job as done
 
@@ -48,17 +64,27 @@ def do_update(backend, index, qs, start, end, total, verbosity=1, commit=True):
     small_cache_qs = qs.all()
     current_qs = small_cache_qs[start:end]
 
+    return do_update_batch(backend, index, current_qs, start, end, total, verbosity=verbosity, commit=commit)
+
+
+def do_update_batch(backend, index, current_qs, start, end, total, verbosity=1, commit=True):
+    """
+    Indexes a single batch, returning the number of SQL queries that took.
+    """
     if verbosity >= 2:
         if hasattr(os, 'getppid') and os.getpid() == os.getppid():
             print("  indexed %s - %d of %d." % (start + 1, end, total))
         else:
             print("  indexed %s - %d of %d (by %s)." % (start + 1, end, total, os.getpid()))
 
-    backend.update(index, current_qs, commit=commit)
+    with QueryCounter() as queries:
+        backend.update(index, current_qs, commit=commit)
 
     # cleanup connection query log when in DEBUG mode
     reset_queries()
 
+    return queries.count
+
 
 # defined statically to be useable in rebuild_index
 options = {
@@ -118,6 +144,84 @@ options = {
         'default': True,
         'help': 'Will pass commit=False to the backend.',
     },
+    ('--keyset',): {
+        'action': 'store_true',
+        'dest': 'keyset',
+        'default': False,
+        'help': 'Batch by primary key (pk > last_pk) instead of by offset. Keeps the cost of each '
+                'batch constant on large tables & hands disjoint pk ranges to the workers.',
+    },
+    ('--since-last-run',): {
+        'action': 'store_true',
+        'dest': 'since_last_run',
+        'default': False,
+        'help': 'Only index the objects updated (according to the index\'s get_updated_field) since the '
+                'newest one indexed by the previous --since-last-run run, less the --overlap.',
+    },
+    ('--overlap',): {
+        'action': 'store',
+        'dest': 'overlap',
+        'default': 300,
+        'type': int,
+        'help': 'Number of seconds before the last run\'s newest object to start from when using '
+                '--since-last-run, to catch changes committed late. Default is 300.',
+    },
+    ('--resume',): {
+        'action': 'store_true',
+        'dest': 'resume',
+        'default': False,
+        'help': 'Continue an interrupted run from its checkpoints, skipping the pk ranges it completed. '
+                'Implies --keyset.',
+    },
+    ('--bulk-load',): {
+        'action': 'store_true',
+        'dest': 'bulk_load',
+        'default': False,
+        'help': "Put the backends in bulk-load mode for the whole run (e.g. Elasticsearch's refreshes & "
+                'replicas are turned off), making the changes visible once at the end.',
+    },
+    ('--fan-out',): {
+        'action': 'store_true',
+        'dest': 'fan_out',
+        'default': False,
+        'help': 'Read & prepare each batch once for all of the --using connections with an equivalent index '
+                '(of the same SearchIndex class) for a model, and send it to their backends concurrently.',
+    },
+    ('--pipeline',): {
+        'action': 'store_true',
+        'dest': 'pipeline',
+        'default': False,
+        'help': 'Overlap reading from the database, preparing documents & sending them to the backend, '
+                'using threads. Reports the throughput of each stage.',
+    },
+    ('--read-workers',): {
+        'action': 'store',
+        'dest': 'read_workers',
+        'default': 1,
+        'type': int,
+        'help': 'Number of threads reading batches from the database when using --pipeline.',
+    },
+    ('--prepare-workers',): {
+        'action': 'store',
+        'dest': 'prepare_workers',
+        'default': 1,
+        'type': int,
+        'help': 'Number of threads preparing documents when using --pipeline.',
+    },
+    ('--send-workers',): {
+        'action': 'store',
+        'dest': 'send_workers',
+        'default': 1,
+        'type': int,
+        'help': 'Number of threads sending documents to the backend when using --pipeline.',
+    },
+    ('--queue-size',): {
+        'action': 'store',
+        'dest': 'queue_size',
+        'default': 2,
+        'type': int,
+        'help': 'Number of batches allowed to wait between two stages when using --pipeline.',
+    },
     ('app_or_model',): {
         'nargs': '*',
         'help': 'App label or Django content type (model name) to update the search index for.',
@@ -143,6 +247,43 @@ class Command(BaseCommand):
         if not self.app_or_model:
             self.app_or_model = haystack_load_apps()
 
+        if self.pipeline and self.workers > 0:
+            raise CommandError("--pipeline uses threads & cannot be combined with --workers.")
+
+        if self.since_last_run and (self.start_date or self.end_date):
+            raise CommandError("--since-last-run picks its own start date & cannot be combined with "
+                               "--age, --start or --end.")
+
+        if self.fan_out and (self.workers > 0 or self.since_last_run or self.resume):
+            raise CommandError("--fan-out cannot be combined with --workers, --since-last-run or --resume, "
+                               "which keep track of each connection separately.")
+
+        if self.resume:
+            self.keyset = True
+
+        # Keyset runs record the pk ranges they complete, for --resume.
+        self.checkpoints = CheckpointStore()
+        self.high_water_marks = HighWaterMarkStore()
+        # Bookkeeping which has to wait for the workers to finish.
+        self.deferred = []
+        # The (using, model) pairs already indexed along with another
+        # connection, with --fan-out.
+        self.fanned_out = set()
+        bulk_loading = []
+
+        try:
+            if self.bulk_load:
+                for using in self.using:
+                    backend = haystack_connections[using].get_backend()
+                    backend.start_bulk_load()
+                    bulk_loading.append(backend)
+
+            self.update_all()
+        finally:
+            for backend in bulk_loading:
+                backend.finish_bulk_load()
+
+    def update_all(self):
         # setup workers if needed
         if self.workers > 0:
             from multiprocessing import JoinableQueue, Process
@@ -172,10 +313,12 @@ class Command(BaseCommand):
             for process in self.processes:
                 process.join()
 
+        for func, args in self.deferred:
+            func(*args)
+
     def update_backend(self, label, using):
         from ...exceptions import NotHandled
 
-        backend = haystack_connections[using].get_backend()
         unified_index = haystack_connections[using].get_unified_index()
 
         for model in haystack_get_models(label):
@@ -186,6 +329,24 @@ class Command(BaseCommand):
                     self.stdout.write("Skipping '%s' - no index." % model)
                 continue
 
+            if (using, model) in self.fanned_out:
+                if self.verbosity >= 2:
+                    self.stdout.write("Skipping '%s' - indexed along with another connection." % model)
+                continue
+
+            backend, usings = self.get_targets(model, index, using)
+
+            if self.since_last_run:
+                self.start_date, high_water_mark = self.get_high_water_mark(index, using)
+
+            if self.keyset:
+                ranges = self.keyset_ranges(index, using)
+
+                if not ranges:
+                    if self.verbosity >= 1:
+                        self.stdout.write("Skipping '%s' - already indexed." % model)
+                    continue
+
             qs = index.build_queryset(using=using, start_date=self.start_date,
                                       end_date=self.end_date)
             total = qs.count()
@@ -193,65 +354,329 @@ class Command(BaseCommand):
             if self.verbosity >= 1:
                 self.stdout.write("Indexing %d %s" % (total, force_text(model._meta.verbose_name_plural)))
 
+                if len(usings) > 1:
+                    self.stdout.write("  sending to '%s' at once." % "', '".join(usings))
+
             batch_size = self.batchsize or backend.batch_size
 
-            for start in range(0, total, batch_size):
-                end = min(start + batch_size, total)
+            if backend.skip_unchanged:
+                skipped_before = dict(backend.skipped)
 
-                if self.workers == 0:
-                    do_update(backend, index, qs, start, end, total,
-                              verbosity=self.verbosity, commit=self.commit)
-                else:
-                    self.queue.put(('do_update', model, start, end, total, using,
-                                    self.start_date, self.end_date, self.verbosity, self.commit))
+            if self.pipeline:
+                documents, queries = self.update_pipelined(backend, index, using, qs, total, batch_size,
+                                                           ranges if self.keyset else None)
+            elif self.keyset:
+                documents, queries = self.update_keyset(backend, index, using, total, batch_size, ranges)
+            else:
+                documents, queries = 0, 0
+
+                for start in range(0, total, batch_size):
+                    end = min(start + batch_size, total)
+
+                    if self.workers == 0:
+                        queries += do_update(backend, index, qs, start, end, total,
+                                             verbosity=self.verbosity, commit=self.commit)
+                        documents += end - start
+                    else:
+                        self.queue.put(('do_update', model, start, end, total, using,
+                                        self.start_date, self.end_date, self.verbosity, self.commit))
+
+            if self.keyset:
+                self.when_done(self.checkpoints.finish, using, get_model_ct(model))
+
+            if self.since_last_run and high_water_mark is not None:
+                self.when_done(self.high_water_marks.set, using, get_model_ct(model), high_water_mark)
+
+            # Queries run by worker processes can't be seen from here.
+            if self.verbosity >= 1 and self.workers == 0 and documents:
+                self.stdout.write("  %d queries for %d documents (%.2f per document)." % (
+                    queries, documents, float(queries) / documents))
+
+            if self.verbosity >= 1 and self.workers == 0 and backend.skip_unchanged:
+                skipped = dict((key, value - skipped_before[key]) for key, value in backend.skipped.items())
+                self.stdout.write("  skipped %d unchanged documents (%d bytes, %d requests not sent)." % (
+                    skipped['documents'], skipped['bytes'], skipped['requests']))
 
             if self.remove:
                 if self.start_date or self.end_date:
                     # They're using a reduced set, which may not incorporate
-                    # all pks. Rebuild the list with everything.
-                    qs = index.index_queryset()
+                    # all pks. Check against everything instead.
+                    qs = index.index_queryset(using=using)
+
+                for alias in usings:
+                    self.remove_stale(haystack_connections[alias].get_backend(), index, qs, batch_size)
+
+    def get_targets(self, model, index, using):
+        """
+        Returns the backend to index ``model`` with & the connections it
+        sends to.
+
+        Normally that's just ``using``. With ``--fan-out``, the connections
+        after it in ``--using`` whose index for ``model`` is equivalent (see
+        ``group_equivalent``) are included: each batch is read & prepared
+        once & sent to all of them concurrently, and they skip ``model``
+        when their turn comes.
+        """
+        from ...exceptions import NotHandled
 
-                if not qs:
-                    # nothing to remove, go to next model
-                    continue
+        if not self.fan_out:
+            return haystack_connections[using].get_backend(), [using]
 
-                database_pks = set(smart_bytes(pk) for pk in qs.values_list('pk', flat=True))
-                total = len(database_pks)
+        aliases = list(self.using)
+        targets = [(using, index)]
 
-                # Since records may still be in the search index but not the local database
-                # we'll use that to create batches for processing.
-                # See https://github.com/django-haystack/django-haystack/issues/1186
-                index_total = SearchQuerySet(using=backend.connection_alias).models(model).count()
+        for alias in aliases[aliases.index(using) + 1:]:
+            try:
+                targets.append((alias, haystack_connections[alias].get_unified_index().get_index(model)))
+            except NotHandled:
+                continue
 
-                # Retrieve PKs from the index. Note that this cannot be a numeric range query because although
-                # pks are normally numeric they can be non-numeric UUIDs or other custom values. To reduce
-                # load on the search engine, we only retrieve the pk field, which will be checked against the
-                # full list obtained from the database, and the id field, which will be used to delete the
-                # record should it be found to be stale.
-                index_pks = SearchQuerySet(using=backend.connection_alias).models(model)
-                index_pks = index_pks.values_list('pk', 'id')
+        usings = group_equivalent(targets)[0][1]
 
-                # We'll collect all of the record IDs which are no longer present in the database and delete
-                # them after walking the entire index. This uses more memory than the incremental approach but
-                # avoids needing the pagination logic below to account for both commit modes:
-                stale_records = set()
+        if len(usings) == 1:
+            return haystack_connections[using].get_backend(), usings
 
-                for start in range(0, index_total, batch_size):
-                    upper_bound = start + batch_size
+        self.fanned_out.update((alias, model) for alias in usings[1:])
+        return FanOutBackend([haystack_connections[alias].get_backend() for alias in usings]), usings
 
-                    # If the database pk is no longer present, queue the index key for removal:
-                    for pk, rec_id in index_pks[start:upper_bound]:
-                        if smart_bytes(pk) not in database_pks:
-                            stale_records.add(rec_id)
+    def when_done(self, func, *args):
+        """
+        Calls ``func`` once the current model has been indexed: right away,
+        or after the workers have finished.
+        """
+        if self.workers == 0:
+            func(*args)
+        else:
+            self.deferred.append((func, args))
 
-                if stale_records:
-                    if self.verbosity >= 1:
-                        self.stdout.write("  removing %d stale records." % len(stale_records))
+    def get_high_water_mark(self, index, using):
+        """
+        Returns the start date for a ``--since-last-run`` update (``None``
+        the first time) & the new high-water mark to record once it's done,
+        the newest ``get_updated_field`` value (as text) it will index.
+
+        Both are ``None`` if the index has no ``get_updated_field``.
+        """
+        model = index.get_model()
+        updated_field = index.get_updated_field()
+
+        if not updated_field:
+            if self.verbosity >= 1:
+                self.stdout.write("No updated date field found for '%s' - indexing everything." % model.__name__)
+
+            return None, None
+
+        field = model._meta.get_field(updated_field)
+        previous = self.high_water_marks.get(using, get_model_ct(model))
+        start_date = None
+
+        if previous is not None:
+            start_date = field.to_python(previous) - timedelta(seconds=self.overlap)
+
+        # Taken before indexing, so anything updated while this run is going
+        # is picked up by the next one.
+        qs = index.build_queryset(using=using, start_date=start_date)
+        newest = qs.aggregate(newest=Max(updated_field))['newest']
+
+        if newest is None:
+            # Nothing new; keep the old mark.
+            return start_date, None
+
+        return start_date, newest.isoformat()
+
+    def remove_stale(self, backend, index, qs, batch_size):
+        """
+        Removes the documents of ``index`` whose object is no longer in ``qs``.
+
+        The index is walked with the backend's ``scan`` (a scroll or cursor,
+        so there's no deep paging) & each batch of primary keys is looked up
+        in the database with a single ``pk__in`` query. Only one batch is held
+        in memory at a time; the stale documents in each batch are removed
+        together with ``remove_many``.
+        """
+        model = index.get_model()
+        pk_field = model._meta.pk
+        removed = 0
+
+        for batch in backend.scan([model], batch_size=batch_size):
+            pks = {}
+            stale = []
+
+            for doc_id, pk in batch:
+                try:
+                    pks[pk_field.to_python(pk)] = doc_id
+                except ValidationError:
+                    # Can't be the pk of anything in the database.
+                    stale.append(doc_id)
+
+            existing = set(qs.filter(pk__in=list(pks)).values_list('pk', flat=True)) if pks else set()
+            stale.extend(doc_id for pk, doc_id in pks.items() if pk not in existing)
+
+            if self.verbosity >= 2:
+                for doc_id in stale:
+                    self.stdout.write("  removing %s." % doc_id)
+
+            if stale:
+                backend.remove_many(stale, commit=self.commit)
+
+            removed += len(stale)
+
+        if self.verbosity >= 1 and removed:
+            self.stdout.write("  removed %d stale records." % removed)
 
-                    for rec_id in stale_records:
-                        # Since the PK was not in the database list,
-                        # we'll delete the record from the search index:
-                        if self.verbosity >= 2:
-                            self.stdout.write("  removing %s." % rec_id)
+        return removed
 
-                        backend.remove(rec_id, commit=self.commit)
+    def keyset_ranges(self, index, using):
+        """
+        Returns the ``(after_pk, until_pk)`` ranges to index by primary key,
+        where ``None`` stands for the first or last record.
+
+        Normally that's everything, as a single range & any previous
+        checkpoints are discarded. With ``--resume``, it's whatever the last
+        run didn't complete (nothing at all if it finished).
+        """
+        model = index.get_model()
+        model_ct = get_model_ct(model)
+
+        if self.resume:
+            finished = self.checkpoints.status(using, model_ct)
+
+            if finished:
+                return []
+
+            if finished is not None:
+                return remaining_ranges(self.checkpoints.ranges(using, model_ct), model._meta.pk.to_python)
+
+        self.checkpoints.start(using, model_ct)
+        return [(None, None)]
+
+    def update_keyset(self, backend, index, using, total, batch_size, ranges):
+        """
+        Walks the records of each ``(after_pk, until_pk)`` range in primary
+        key order, fetching each batch with a ``pk > last_pk`` lookup instead
+        of an offset.
+
+        Without workers, each batch is loaded & indexed directly. With workers,
+        only the primary keys are read here & each worker receives a disjoint
+        ``(after_pk, until_pk]`` range to load itself. Either way, completed
+        ranges are recorded in the checkpoint store.
+
+        Returns the number of documents indexed & the queries that took
+        (both zero when using workers).
+        """
+        model = index.get_model()
+        model_ct = get_model_ct(model)
+        start = 0
+        documents = 0
+        queries = 0
+
+        for last_pk, range_until_pk in ranges:
+            while True:
+                qs = index.build_queryset(using=using, start_date=self.start_date, end_date=self.end_date,
+                                          after_pk=last_pk, until_pk=range_until_pk)
+
+                if self.workers == 0:
+                    with QueryCounter() as fetch:
+                        batch = list(qs[:batch_size])
+
+                    queries += fetch.count
+                else:
+                    batch = list(qs.values_list('pk', flat=True)[:batch_size])
+
+                if not batch:
+                    break
+
+                end = start + len(batch)
+
+                if self.workers == 0:
+                    queries += do_update_batch(backend, index, batch, start, end, max(total, end),
+                                               verbosity=self.verbosity, commit=self.commit)
+                    documents += len(batch)
+                    until_pk = batch[-1].pk
+                    self.checkpoints.complete(using, model_ct, last_pk, until_pk)
+                else:
+                    until_pk = batch[-1]
+                    self.queue.put(('do_update_range', model, last_pk, until_pk, start, end, max(total, end), using,
+                                    self.start_date, self.end_date, self.verbosity, self.commit))
+
+                start = end
+
+                if len(batch) < batch_size:
+                    break
+
+                last_pk = until_pk
+
+        return documents, queries
+
+    def update_pipelined(self, backend, index, using, qs, total, batch_size, ranges=None):
+        """
+        Indexes the records through an ``IndexingPipeline``, so that reading,
+        preparing & sending batches overlap, then reports each stage's
+        throughput.
+
+        With ``ranges`` (keyset mode), batches are read by primary key & each
+        is recorded in the checkpoint store once sent.
+
+        Returns the number of documents indexed & the queries that took.
+        """
+        model_ct = get_model_ct(index.get_model())
+        bounds = {}
+
+        if ranges is not None:
+            batches = self.keyset_batches(index, using, batch_size, ranges, bounds)
+        else:
+            batches = ((start, min(start + batch_size, total), qs.all()[start:start + batch_size])
+                       for start in range(0, total, batch_size))
+
+        def progress(start, end):
+            if start in bounds:
+                self.checkpoints.complete(using, model_ct, *bounds.pop(start))
+
+            if self.verbosity >= 2:
+                self.stdout.write("  indexed %s - %d of %d." % (start + 1, end, max(total, end)))
+
+        pipeline = IndexingPipeline(backend, index, commit=self.commit,
+                                    read_workers=self.read_workers,
+                                    prepare_workers=self.prepare_workers,
+                                    send_workers=self.send_workers,
+                                    queue_size=self.queue_size,
+                                    progress=progress)
+        stats = pipeline.run(batches)
+        reset_queries()
+
+        if self.verbosity >= 1:
+            for stage in stats.values():
+                self.stdout.write("  %s" % stage)
+
+        return stats['read'].items, sum(stage.queries for stage in stats.values())
+
+    def keyset_batches(self, index, using, batch_size, ranges, bounds):
+        """
+        Yields ``(start, end, queryset)`` batches covering disjoint
+        ``(after_pk, until_pk]`` ranges within each of ``ranges``. Only the
+        primary keys are read here.
+
+        The pk range of each batch is stored in ``bounds``, keyed by ``start``.
+        """
+        start = 0
+
+        for last_pk, range_until_pk in ranges:
+            while True:
+                qs = index.build_queryset(using=using, start_date=self.start_date, end_date=self.end_date,
+                                          after_pk=last_pk, until_pk=range_until_pk)
+                pks = list(qs.values_list('pk', flat=True)[:batch_size])
+
+                if not pks:
+                    break
+
+                end = start + len(pks)
+                bounds[start] = (last_pk, pks[-1])
+                yield start, end, index.build_queryset(using=using, start_date=self.start_date,
+                                                       end_date=self.end_date, after_pk=last_pk,
+                                                       until_pk=pks[-1])
+                start = end
+
+                if len(pks) < batch_size:
+                    break
+
+                last_pk = pks[-1]
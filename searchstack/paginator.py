@@ -0,0 +1,93 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import collections
+
+from django.core.paginator import Paginator
+
+
+class SearchPaginator(Paginator):
+    """
+    A ``Paginator`` for ``SearchQuerySet`` objects which fetches the
+    requested page before counting the results, so that the hit count (&
+    the facet counts) come with the page & a page costs a single search
+    (see ``SearchQuerySet.fetch``).
+
+    Plain Django's ``Paginator`` counts first, which runs a search of its
+    own. Other kinds of object lists are paginated as usual.
+    """
+    def page(self, number):
+        if hasattr(self.object_list, 'fetch'):
+            try:
+                number = int(number)
+            except (TypeError, ValueError):
+                pass
+            else:
+                if number >= 1:
+                    # Includes any orphans, which would join the last page.
+                    bottom = (number - 1) * self.per_page
+                    self.object_list.fetch(bottom, bottom + self.per_page + self.orphans)
+
+        return super(SearchPaginator, self).page(number)
+
+
+class CursorPage(collections.Sequence):
+    """
+    A page of the results of ``CursorPaginator``. The page after it is
+    reached with ``next_cursor``; there is no going back but to the first
+    page (without a cursor).
+    """
+    def __init__(self, object_list, cursor, next_cursor, paginator):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.paginator = paginator
+
+    def __repr__(self):
+        return '<Page after %s>' % (self.cursor or 'the start')
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator(object):
+    """
+    Paginates a ``SearchQuerySet`` with cursors rather than page numbers
+    (see ``SearchQuerySet.after``), so that every page costs a single search
+    as cheap as that of the first page, however deep it is.
+
+    ``count`` is the number of results from the current page on, not the
+    total, unless on the first page.
+    """
+    def __init__(self, object_list, per_page):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.count = 0
+
+    def page(self, cursor=None):
+        """
+        Returns the page of results after ``cursor``, or the first one.
+        Raises ``CursorError`` if the cursor is invalid.
+        """
+        results = self.object_list.after(cursor)
+        object_list = list(results.fetch(0, self.per_page))
+        # The hit count comes with the page.
+        self.count = results.count()
+        next_cursor = None
+
+        if self.count > self.per_page:
+            next_cursor = results.cursor(object_list[-1])
+
+        return CursorPage(object_list, cursor, next_cursor, self)
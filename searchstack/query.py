@@ -4,14 +4,17 @@ from __future__ import unicode_literals
 import operator
 import warnings
 
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
 from django.utils import six
 
 from . import connections
 from .backends import SQ
-from .constants import DEFAULT_OPERATOR, ITERATOR_LOAD_PER_QUERY, REPR_OUTPUT_SIZE
-from .exceptions import NotHandled
+from .constants import DEFAULT_OPERATOR, DJANGO_CT, DJANGO_ID, ITERATOR_LOAD_PER_QUERY, REPR_OUTPUT_SIZE
+from .exceptions import NotHandled, SearchFieldError
 from .inputs import AutoQuery, Raw
 from .utils import log as logging
+from .utils.cursors import dump_cursor, load_cursor
 
 
 class SearchQuerySet(object):
@@ -260,9 +263,10 @@ class SearchQuerySet(object):
             start = k
             bound = k + 1
 
-        # We need check to see if we need to populate more of the cache.
-        if len(self._result_cache) <= 0 or (None in self._result_cache[start:bound]
-                                            and not self._cache_is_full()):
+        # We need check to see if we need to populate more of the cache. A
+        # search which found nothing has nothing left to fill it with.
+        if ((len(self._result_cache) <= 0 or None in self._result_cache[start:bound])
+                and not self._cache_is_full()):
             try:
                 self._fill_cache(start, bound)
             except StopIteration:
@@ -475,6 +479,42 @@ class SearchQuerySet(object):
         clone._using = connection_name
         return clone
 
+    def cache(self, ttl=DEFAULT_TIMEOUT):
+        """
+        Caches the results of the searches run for this ``SearchQuerySet``
+        for ``ttl`` seconds (by default, the cache's default timeout), in the
+        connection's ``RESULT_CACHE``. A ``ttl`` of ``None`` caches them
+        until they're invalidated, and one of ``0`` disables caching, even
+        when the connection sets a ``RESULT_CACHE_TTL``.
+
+        Raises ``ImproperlyConfigured`` unless the connection tracks writes
+        (``WRITE_GENERATIONS``), which is what invalidates the results.
+        """
+        if ttl != 0 and not self.query.backend.track_writes:
+            raise ImproperlyConfigured("Caching searches on connection '%s' needs WRITE_GENERATIONS on, so "
+                                       "that writes invalidate them." % self.query._using)
+
+        clone = self._clone()
+        clone.query.cache_ttl = ttl
+        return clone
+
+    def after(self, cursor=None):
+        """
+        Paginates with a cursor rather than an offset: the results are
+        ordered by ``django_ct`` & ``django_id`` after any ``order_by`` fields
+        & only those after the result ``cursor`` was made for (see
+        ``cursor``) are matched, so that a page deep into the results costs
+        as little as the first one. Without a ``cursor``, the results start
+        from the first one.
+
+        Raises ``CursorError`` if the cursor is invalid or was made for
+        another ordering, and ``SearchFieldError`` if the results are ordered
+        by an analyzed field.
+        """
+        clone = self._clone()
+        clone.query.set_search_after(load_cursor(cursor) if cursor else None)
+        return clone
+
     # Methods that do not return a SearchQuerySet.
 
     def count(self):
@@ -537,6 +577,67 @@ class SearchQuerySet(object):
             clone = self._clone()
             return clone.query.get_spelling_suggestion(preferred_query)
 
+    def fetch(self, start, end):
+        """
+        Runs the search for the results from ``start`` to ``end`` & returns
+        them. The same request gets the hit count & the facet counts, so
+        afterwards ``count()``, ``facet_counts()`` & slices within the range
+        are answered without searching again.
+        """
+        return self[start:end]
+
+    def cursor(self, result):
+        """
+        Returns the cursor (an opaque, URL-safe token) which resumes the
+        results of ``after`` after ``result``. The fields it is ordered by
+        must be stored, to be read back from the result.
+
+        Raises ``SearchFieldError`` if ``result`` has no value for one of
+        them, as no range can match the results after it.
+        """
+        # The tie-breakers aren't attributes of results, but are what the
+        # results are made from.
+        values = {
+            DJANGO_CT: '%s.%s' % (result.app_label, result.model_name),
+            DJANGO_ID: result.pk,
+        }
+        pairs = []
+
+        for field in self.query.cursor_fields():
+            name = field.lstrip('-')
+            value = values[name] if name in values else getattr(result, name, None)
+
+            if value is None:
+                raise SearchFieldError("Can't resume after a result without a value for '%s'." % name)
+
+            pairs.append((field, value))
+
+        return dump_cursor(pairs)
+
+    def iterator(self, chunk_size=None):
+        """
+        Yields every result, fetched ``chunk_size`` (by default, the
+        backend's ``BATCH_SIZE``) at a time with the backend's cursor or
+        scroll (see ``search_chunks``).
+
+        Unlike iterating over the ``SearchQuerySet``, the results aren't kept
+        in its cache, so memory use stays the same however many there are.
+        With ``load_all``, objects are loaded a chunk at a time.
+        """
+        clone = self._clone()
+
+        for results in clone._get_chunks(chunk_size):
+            for result in clone.post_process_results(results):
+                yield result
+
+    def write_generation(self):
+        """
+        Returns a token which changes whenever documents of the models the
+        query involves (all indexed models, unless limited with ``models``)
+        are written to, e.g. for use in an ETag.
+        """
+        return self.query.backend.write_generation(self.query.models)
+
     def values(self, *fields):
         """
         Returns a list of dictionaries, each containing the key/value pairs for
@@ -567,6 +668,9 @@ class SearchQuerySet(object):
 
     # Utility methods.
 
+    def _get_chunks(self, chunk_size, **kwargs):
+        return self.query.get_results_in_chunks(chunk_size, **kwargs)
+
     def _clone(self, klass=None):
         if klass is None:
             klass = self.__class__
@@ -597,6 +701,9 @@ class EmptySearchQuerySet(SearchQuerySet):
     def _fill_cache(self, start, end):
         return False
 
+    def _get_chunks(self, chunk_size):
+        return []
+
     def facet_counts(self):
         return {}
 
@@ -630,6 +737,11 @@ class ValuesListSearchQuerySet(SearchQuerySet):
         }
         return super(ValuesListSearchQuerySet, self)._fill_cache(start, end, **kwargs)
 
+    def _get_chunks(self, chunk_size):
+        query_fields = set(self._internal_fields)
+        query_fields.update(self._fields)
+        return super(ValuesListSearchQuerySet, self)._get_chunks(chunk_size, fields=query_fields)
+
     def post_process_results(self, results):
         to_cache = []
 
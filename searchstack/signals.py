@@ -1,9 +1,23 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
-from django.db import models
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import models, transaction
 
 from .exceptions import NotHandled
+from .utils import log as logging
+from .utils import get_identifier, get_model_ct
+from .utils.changes import changed_fields, take_snapshot
+from .utils.fanout import group_equivalent
+from .utils.loading import indexes_changed
+from .utils.state import IndexQueue, shared_state_file
+
+# The most objects a save may cause to be reindexed through their relations
+# to it (see ``BaseSignalProcessor.propagate``).
+DEFAULT_RELATED_UPDATE_LIMIT = 1000
 
 
 class BaseSignalProcessor(object):
@@ -16,8 +30,22 @@ class BaseSignalProcessor(object):
     def __init__(self, connections, connection_router):
         self.connections = connections
         self.connection_router = connection_router
+        # The models whose instances get snapshots (see ``get_tracked_models``).
+        self._tracked_models = None
+        # The reverse dependency graph (see ``get_dependents``).
+        self._dependents = None
+        indexes_changed.connect(self.reset_caches)
+        self.log = logging.getLogger('searchstack')
         self.setup()
 
+    def reset_caches(self, **kwargs):
+        """
+        Drops what was derived from the indexes (which models are tracked &
+        the dependency graph) when they change.
+        """
+        self._tracked_models = None
+        self._dependents = None
+
     def setup(self):
         """
         A hook for setting up anything necessary for
@@ -38,35 +66,171 @@ class BaseSignalProcessor(object):
         # Do nothing.
         pass
 
-    def handle_save(self, sender, instance, **kwargs):
+    def handle_init(self, sender, instance, **kwargs):
         """
-        Given an individual model instance, determine which backends the
-        update should be sent to & update the object on those backends.
+        Given a freshly loaded model instance, snapshot its field values if
+        any of its indexes can tell from them whether a save needs indexing
+        (see ``SearchIndex.should_update``).
+
+        This runs for every instance of every model, so instances of models
+        that aren't tracked are let go before anything else.
         """
-        using_backends = self.connection_router.for_write(instance=instance)
+        tracked = self._tracked_models
+
+        if tracked is None:
+            tracked = self.get_tracked_models()
+
+        if sender in tracked:
+            take_snapshot(instance)
+
+    def tracks_changes(self, model):
+        """
+        Returns whether any index of ``model`` knows its dependencies, or
+        which of ``model``'s fields other indexes depend on.
+        """
+        return model in self.get_tracked_models()
+
+    def get_tracked_models(self):
+        """
+        Returns the set of models whose instances are snapshotted (see
+        ``tracks_changes``). It is worked out on first use, & again after the
+        indexes change (see ``reset_caches``).
+        """
+        if self._tracked_models is None:
+            tracked = set(model for model, dependents in self.get_dependency_graph().items()
+                          if any(fields is not None for using, index, lookup, fields in dependents))
+
+            for connection in self.connections.all():
+                for model, index in connection.get_unified_index().get_indexes().items():
+                    if index.get_dependencies() is not None:
+                        tracked.add(model)
+
+            self._tracked_models = tracked
+
+        return self._tracked_models
+
+    def get_dependents(self, model):
+        """
+        Returns a ``(using, index, lookup, fields)`` tuple for each index
+        whose documents include data from instances of ``model``, through
+        relations (see ``SearchIndex.get_related_dependencies``), on the
+        connections the routers send its writes to.
+
+        The graph is built on first use, & again after the indexes change
+        (see ``reset_caches``).
+        """
+        return self.get_dependency_graph().get(model, [])
+
+    def get_dependency_graph(self):
+        """
+        Returns the reverse dependency graph: a dictionary of the
+        ``get_dependents`` tuples of each related model.
+        """
+        if self._dependents is None:
+            dependents = {}
+
+            for connection in self.connections.all():
+                for index in connection.get_unified_index().get_indexes().values():
+                    if connection.using not in self.connection_router.for_write(index=index):
+                        continue
+
+                    for related_model, lookup, fields in index.get_related_dependencies():
+                        dependent = (connection.using, index, lookup, fields)
+                        dependents.setdefault(related_model, []).append(dependent)
+
+            # Set once the graph is built, as building unbuilt indexes resets
+            # the caches.
+            self._dependents = dependents
+
+        return self._dependents
+
+    def propagate(self, sender, instance, created=False, update_fields=None, **kwargs):
+        """
+        Given a model instance that was just saved, reindex the objects of
+        other indexes whose documents include its data (such as the books
+        of an author, for a ``model_attr='author__name'``).
+
+        Changes to fields no document reads are ignored. If a save would
+        reindex more than ``SEARCHSTACK_RELATED_UPDATE_LIMIT`` objects of an
+        index, none are & a warning is logged instead.
+        """
+        dependents = self.get_dependents(sender)
+        limit = getattr(settings, 'SEARCHSTACK_RELATED_UPDATE_LIMIT', DEFAULT_RELATED_UPDATE_LIMIT)
+
+        if not dependents or not limit:
+            return
+
+        # Anything may now point at a new instance.
+        changed = None if created else changed_fields(instance, update_fields)
 
-        for using in using_backends:
+        for using, index, lookup, fields in dependents:
+            if changed is not None and fields is not None and changed.isdisjoint(fields):
+                continue
+
+            qs = index.index_queryset(using=using).filter(**{lookup: instance.pk})
+            pks = list(qs.order_by().values_list('pk', flat=True).distinct()[:limit + 1])
+
+            if len(pks) > limit:
+                self.log.warning("Saving %r affects more than %d objects of '%s', which weren't reindexed. "
+                                 "Run update_index to catch up.", instance, limit, index.__class__.__name__)
+                continue
+
+            if pks:
+                self.update_dependents(using, index, pks, instance)
+
+    def update_dependents(self, using, index, pks, instance):
+        """
+        Reindexes the objects of ``index`` with the given ``pks``, a batch
+        (of the backend's ``BATCH_SIZE``) per request.
+        """
+        backend = self.connections[using].get_backend()
+        batch_size = backend.batch_size
+
+        for start in range(0, len(pks), batch_size):
+            qs = index.build_queryset(using=using).filter(pk__in=pks[start:start + batch_size])
+            backend.update(index, qs)
+
+    def get_targets(self, sender, instance):
+        """
+        Returns the indexes of ``instance`` on the connections the routers
+        send its writes to, as ``(index, using)`` pairs. Connections with
+        equivalent indexes are grouped, ``using`` being a list of them, so
+        that the object is prepared once & sent to all of them at the same
+        time (see ``FanOutBackend``).
+        """
+        targets = []
+
+        for using in self.connection_router.for_write(instance=instance):
             try:
-                index = self.connections[using].get_unified_index().get_index(sender)
-                index.update_object(instance, using=using)
+                targets.append((using, self.connections[using].get_unified_index().get_index(sender)))
             except NotHandled:
                 # TODO: Maybe log it or let the exception bubble?
                 pass
 
+        return [(index, usings if len(usings) > 1 else usings[0])
+                for index, usings in group_equivalent(targets)]
+
+    def handle_save(self, sender, instance, **kwargs):
+        """
+        Given an individual model instance, determine which backends the
+        update should be sent to & update the object on those backends.
+        """
+        for index, using in self.get_targets(sender, instance):
+            index.update_object(instance, using=using, created=kwargs.get('created', False),
+                                update_fields=kwargs.get('update_fields'))
+
+        self.propagate(sender, instance, **kwargs)
+
+        if self.tracks_changes(sender):
+            take_snapshot(instance, kwargs.get('update_fields'))
+
     def handle_delete(self, sender, instance, **kwargs):
         """
         Given an individual model instance, determine which backends the
         delete should be sent to & delete the object on those backends.
         """
-        using_backends = self.connection_router.for_write(instance=instance)
-
-        for using in using_backends:
-            try:
-                index = self.connections[using].get_unified_index().get_index(sender)
-                index.remove_object(instance, using=using)
-            except NotHandled:
-                # TODO: Maybe log it or let the exception bubble?
-                pass
+        for index, using in self.get_targets(sender, instance):
+            index.remove_object(instance, using=using)
 
 
 class RealtimeSignalProcessor(BaseSignalProcessor):
@@ -75,6 +239,10 @@ class RealtimeSignalProcessor(BaseSignalProcessor):
     search engine appropriately.
     """
     def setup(self):
+        # The models ``post_init`` is connected for, once they're known (see
+        # ``connect_init``); until then, it's connected for all of them.
+        self._init_senders = None
+        models.signals.post_init.connect(self.handle_init)
         # Naive (listen to all model saves).
         models.signals.post_save.connect(self.handle_save)
         models.signals.post_delete.connect(self.handle_delete)
@@ -82,8 +250,240 @@ class RealtimeSignalProcessor(BaseSignalProcessor):
         # being used, then hooking up signals only for those.
 
     def teardown(self):
+        self.disconnect_init()
         # Naive (listen to all model saves).
         models.signals.post_save.disconnect(self.handle_save)
         models.signals.post_delete.disconnect(self.handle_delete)
         # Efficient would be going through all backends & collecting all models
         # being used, then disconnecting signals only for those.
+
+    def handle_init(self, sender, instance, **kwargs):
+        if self._init_senders is None:
+            self.connect_init()
+
+        super(RealtimeSignalProcessor, self).handle_init(sender, instance, **kwargs)
+
+    def connect_init(self):
+        """
+        Connects ``post_init`` for the tracked models only (see
+        ``get_tracked_models``), so that instances of the other models don't
+        pay for it. The tracked models aren't known before the indexes can
+        be loaded, which is why it's connected for every model at first.
+        """
+        senders = self.get_tracked_models()
+        models.signals.post_init.disconnect(self.handle_init)
+
+        for sender in senders:
+            models.signals.post_init.connect(self.handle_init, sender=sender)
+
+        self._init_senders = senders
+
+    def disconnect_init(self):
+        if self._init_senders is None:
+            models.signals.post_init.disconnect(self.handle_init)
+        else:
+            for sender in self._init_senders:
+                models.signals.post_init.disconnect(self.handle_init, sender=sender)
+
+        self._init_senders = None
+
+    def reset_caches(self, **kwargs):
+        super(RealtimeSignalProcessor, self).reset_caches(**kwargs)
+
+        # The tracked models may have changed: back to every model, until the
+        # next instance tells which.
+        if getattr(self, '_init_senders', None) is not None:
+            self.disconnect_init()
+            models.signals.post_init.connect(self.handle_init)
+
+
+class BatchingSignalProcessor(RealtimeSignalProcessor):
+    """
+    Like ``RealtimeSignalProcessor``, but collects the saves & deletes made
+    during a database transaction & sends them once it commits: a single
+    ``update`` & a single ``remove_many`` per index & connection, however
+    many times each object changed.
+
+    Outside of a transaction (or on Django versions without
+    ``transaction.on_commit``), changes are sent straight away.
+
+    Rather than trusting the instances it saw, the batch is re-read through
+    ``index_queryset`` when it's sent: objects that are still there are
+    updated & the others removed. That way, changes that were rolled back
+    (whose commit hooks Django silently drops) can't leave stale documents
+    behind.
+    """
+    def setup(self):
+        # Pending changes are per thread, like the transactions they're in.
+        self._local = threading.local()
+        super(BatchingSignalProcessor, self).setup()
+
+    def get_batch(self, db):
+        """
+        Returns the changes waiting for database ``db`` to commit, as a
+        dictionary of ``{(using, index): {pk: identifier}}`` (the identifier
+        is ``None`` for objects reindexed because of a related object).
+        """
+        batches = getattr(self._local, 'batches', None)
+
+        if batches is None:
+            batches = self._local.batches = {}
+
+        return batches.setdefault(db, OrderedDict())
+
+    def handle_save(self, sender, instance, **kwargs):
+        self.add(sender, instance, check_update=True, **kwargs)
+        self.propagate(sender, instance, **kwargs)
+
+        if self.tracks_changes(sender):
+            take_snapshot(instance, kwargs.get('update_fields'))
+
+    def handle_delete(self, sender, instance, **kwargs):
+        self.add(sender, instance, **kwargs)
+
+    def add(self, sender, instance, check_update=False, **kwargs):
+        """
+        Adds a change to ``instance`` to the batch of the database it was
+        made on & makes sure the batch is sent when that database commits.
+        """
+        db = kwargs.get('using') or instance._state.db
+        batch = None
+
+        for using in self.connection_router.for_write(instance=instance):
+            try:
+                index = self.connections[using].get_unified_index().get_index(sender)
+            except NotHandled:
+                continue
+
+            if check_update and not index.should_update(instance, created=kwargs.get('created', False),
+                                                        update_fields=kwargs.get('update_fields')):
+                continue
+
+            if batch is None:
+                batch = self.get_batch(db)
+
+            # Later changes to the same object replace earlier ones. Django
+            # clears the pk of deleted instances, so keep their identifier.
+            batch.setdefault((using, index), OrderedDict())[instance.pk] = get_identifier(instance)
+
+        if batch is not None:
+            self.schedule(db, batch)
+
+    def update_dependents(self, using, index, pks, instance):
+        # Add them to the batch, where they'll be read back when it's sent.
+        db = instance._state.db
+        batch = self.get_batch(db)
+        identifiers = batch.setdefault((using, index), OrderedDict())
+
+        for pk in pks:
+            # There's no identifier to remove them by, should they be gone by
+            # then; their own delete will have seen to that.
+            identifiers.setdefault(pk, None)
+
+        self.schedule(db, batch)
+
+    def schedule(self, db, batch):
+        """
+        Makes sure ``batch`` is sent when database ``db`` commits.
+        """
+        on_commit = getattr(transaction, 'on_commit', None)
+
+        if on_commit is None:
+            self.flush(db, batch)
+        else:
+            # Every change registers a hook; the first that runs sends the
+            # whole batch & the others find nothing to do. A single hook
+            # would be lost if the savepoint that registered it rolled back.
+            on_commit(lambda: self.flush(db, batch), using=db)
+
+    def flush(self, db, batch):
+        """
+        Sends the changes in ``batch``, unless that has already been done.
+        """
+        if self._local.batches.get(db) is not batch:
+            return
+
+        del self._local.batches[db]
+
+        changes = list(batch.items())
+        batch.clear()
+
+        for (using, index), identifiers in changes:
+            backend = self.connections[using].get_backend()
+            current = list(index.index_queryset(using=using).filter(pk__in=list(identifiers)))
+            current_pks = set(obj.pk for obj in current)
+
+            if current:
+                backend.update(index, current)
+
+            removed = [identifier for pk, identifier in identifiers.items()
+                       if pk not in current_pks and identifier is not None]
+
+            if removed:
+                backend.remove_many(removed)
+
+
+class QueuedSignalProcessor(RealtimeSignalProcessor):
+    """
+    Rather than talking to the search engine while the request waits,
+    records each save & delete as an ``(action, model, pk, connection)``
+    entry in a durable queue (see ``IndexQueue``), which the
+    ``process_index_queue`` management command drains.
+
+    The queue needs ``SEARCHSTACK_STATE_FILE`` set to an absolute path that
+    the site & the workers share.
+
+    Entries are added once the transaction that made the change commits
+    (straight away outside of one, or on Django versions without
+    ``transaction.on_commit``), so that workers don't read the objects back
+    before the change is visible.
+    """
+    def setup(self):
+        self.queue = IndexQueue(shared_state_file())
+        super(QueuedSignalProcessor, self).setup()
+
+    def handle_save(self, sender, instance, **kwargs):
+        self.enqueue('update', sender, instance, check_update=True, **kwargs)
+        self.propagate(sender, instance, **kwargs)
+
+        if self.tracks_changes(sender):
+            take_snapshot(instance, kwargs.get('update_fields'))
+
+    def handle_delete(self, sender, instance, **kwargs):
+        self.enqueue('delete', sender, instance, **kwargs)
+
+    def enqueue(self, action, sender, instance, check_update=False, **kwargs):
+        """
+        Queues ``action`` for ``instance`` on each connection that indexes it.
+        """
+        entries = []
+
+        for using in self.connection_router.for_write(instance=instance):
+            try:
+                index = self.connections[using].get_unified_index().get_index(sender)
+            except NotHandled:
+                continue
+
+            if check_update and not index.should_update(instance, created=kwargs.get('created', False),
+                                                        update_fields=kwargs.get('update_fields')):
+                continue
+
+            entries.append((action, get_model_ct(sender), instance.pk, using))
+
+        if entries:
+            self.put(kwargs.get('using') or instance._state.db, entries)
+
+    def update_dependents(self, using, index, pks, instance):
+        model = get_model_ct(index.get_model())
+        self.put(instance._state.db, [('update', model, pk, using) for pk in pks])
+
+    def put(self, db, entries):
+        """
+        Adds ``entries`` to the queue when database ``db`` commits.
+        """
+        on_commit = getattr(transaction, 'on_commit', None)
+
+        if on_commit is None:
+            self.queue.put_many(entries)
+        else:
+            on_commit(lambda: self.queue.put_many(entries), using=db)
@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import importlib
+import random
 import re
 
 from django.conf import settings
@@ -70,6 +71,16 @@ def get_model_ct(model):
     return "%s.%s" % get_model_ct_tuple(model)
 
 
+def backoff_delay(attempts, base, maximum):
+    """
+    Returns how many seconds to wait before retrying something that failed
+    ``attempts`` times: ``base``, doubled for each further attempt (up to
+    ``maximum``), less a random part of up to half of that, so that things
+    which failed together aren't all retried at once.
+    """
+    return min(base * 2 ** (attempts - 1), maximum) * random.uniform(0.5, 1)
+
+
 def get_facet_field_name(fieldname):
     if fieldname in [ID, DJANGO_ID, DJANGO_CT]:
         return fieldname
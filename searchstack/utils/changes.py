@@ -0,0 +1,61 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+# Where ``take_snapshot`` keeps the field values of an instance.
+SNAPSHOT_ATTR = '_searchstack_snapshot'
+
+
+def take_snapshot(instance, update_fields=None):
+    """
+    Records the current values of the concrete fields of ``instance`` (those
+    which have been loaded), for ``changed_fields`` to compare against.
+
+    After a save limited to ``update_fields``, only those fields are
+    refreshed; the others still differ from what's in the database.
+    """
+    values = instance.__dict__
+    snapshot = values.get(SNAPSHOT_ATTR)
+    fields = instance._meta.concrete_fields
+
+    if update_fields is not None and snapshot is not None:
+        fields = [field for field in fields if field.name in update_fields or field.attname in update_fields]
+    else:
+        snapshot = values[SNAPSHOT_ATTR] = {}
+
+    for field in fields:
+        if field.attname in values:
+            snapshot[field.attname] = values[field.attname]
+
+
+def changed_fields(instance, update_fields=None):
+    """
+    Returns the names of the concrete fields of ``instance`` changed by the
+    save being handled: those in ``update_fields`` (names or attnames) if
+    given, else those whose values differ from its last snapshot. Returns
+    ``None`` if it has no snapshot.
+
+    Fields loaded since the snapshot was taken count as changed, while ones
+    that still aren't loaded (deferred) can't have been.
+    """
+    fields = instance._meta.concrete_fields
+
+    if update_fields is not None:
+        return frozenset(field.name for field in fields
+                         if field.name in update_fields or field.attname in update_fields)
+
+    snapshot = instance.__dict__.get(SNAPSHOT_ATTR)
+
+    if snapshot is None:
+        return None
+
+    values = instance.__dict__
+    changed = set()
+
+    for field in fields:
+        if field.attname not in values:
+            continue
+
+        if field.attname not in snapshot or snapshot[field.attname] != values[field.attname]:
+            changed.add(field.name)
+
+    return frozenset(changed)
@@ -0,0 +1,62 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import datetime
+import json
+
+from django.core import signing
+from django.utils.dateparse import parse_date, parse_datetime
+
+from ..exceptions import CursorError
+
+SALT = 'searchstack.cursor'
+
+
+class CursorSerializer(object):
+    """
+    Serializes the ``(field, value)`` pairs of a cursor as JSON, keeping
+    dates & datetimes as such (plain JSON would turn them into strings).
+    """
+    def dumps(self, pairs):
+        return json.dumps([[field, self.encode(value)] for field, value in pairs],
+                          separators=(',', ':')).encode('latin-1')
+
+    def loads(self, data):
+        return [(field, self.decode(value)) for field, value in json.loads(data.decode('latin-1'))]
+
+    def encode(self, value):
+        if isinstance(value, datetime.datetime):
+            return {'datetime': value.isoformat()}
+        elif isinstance(value, datetime.date):
+            return {'date': value.isoformat()}
+
+        return value
+
+    def decode(self, value):
+        if isinstance(value, dict):
+            if 'datetime' in value:
+                return parse_datetime(value['datetime'])
+            elif 'date' in value:
+                return parse_date(value['date'])
+
+        return value
+
+
+def dump_cursor(pairs):
+    """
+    Returns an opaque, URL-safe token holding the ``(field, value)`` pairs
+    of a cursor. Tokens are signed (with ``SECRET_KEY``), so that only the
+    values of actual results come back.
+    """
+    return signing.dumps(pairs, salt=SALT, serializer=CursorSerializer, compress=True)
+
+
+def load_cursor(token):
+    """
+    Returns the ``(field, value)`` pairs of a token made by ``dump_cursor``.
+    Raises ``CursorError`` if the token is invalid.
+    """
+    try:
+        return signing.loads(token, salt=SALT, serializer=CursorSerializer)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise CursorError("Invalid cursor '%s'." % token)
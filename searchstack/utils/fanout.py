@@ -0,0 +1,98 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import sys
+import threading
+from collections import OrderedDict
+
+from django.utils import six
+
+
+def fan_out(backends, func):
+    """
+    Calls ``func(backend)`` for each of ``backends`` at the same time, from a
+    thread per backend (the first runs in the calling thread), so that the
+    whole takes as long as the slowest call rather than the sum of them.
+
+    Returns the results, in the order of ``backends``. If any call fails, the
+    first error is re-raised once they have all finished.
+    """
+    results = [None] * len(backends)
+    errors = []
+
+    def call(position, backend):
+        try:
+            results[position] = func(backend)
+        except Exception:
+            errors.append((position, sys.exc_info()))
+
+    threads = []
+
+    for position, backend in enumerate(backends[1:], 1):
+        thread = threading.Thread(target=call, args=(position, backend))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    if backends:
+        call(0, backends[0])
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        six.reraise(*min(errors, key=lambda error: error[0])[1])
+
+    return results
+
+
+def group_equivalent(targets):
+    """
+    Groups ``(using, index)`` pairs whose indexes are equivalent (instances
+    of the same ``SearchIndex`` class) & would therefore produce the same
+    documents. Returns a list of ``(index, [using, ...])`` pairs, in the order
+    each group first appears; the index is that of the group's first
+    connection.
+    """
+    groups = OrderedDict()
+
+    for using, index in targets:
+        groups.setdefault(type(index), (index, []))[1].append(using)
+
+    return list(groups.values())
+
+
+class FanOutBackend(object):
+    """
+    Presents several backends as one, for indexing: each batch is prepared
+    once (by the first backend's ``prepare_documents``) & the documents are
+    sent to all of the backends concurrently (see ``fan_out``).
+
+    Only the indexing methods are provided. ``update`` & ``send_prepared``
+    return the failures reported by all of the backends.
+    """
+    # Digests are still skipped by each backend, but not reported.
+    skip_unchanged = False
+
+    def __init__(self, backends):
+        self.backends = list(backends)
+        self.batch_size = min(backend.batch_size for backend in self.backends)
+
+    def update(self, index, iterable, commit=True):
+        return self.send_prepared(index, self.prepare_documents(index, iterable), commit=commit)
+
+    def prepare_documents(self, index, iterable):
+        return self.backends[0].prepare_documents(index, iterable)
+
+    def send_prepared(self, index, documents, commit=True):
+        # The backends only read the documents, so they can share them.
+        documents = list(documents)
+        results = fan_out(self.backends, lambda backend: backend.send_prepared(index, documents, commit=commit))
+        return [failure for failures in results for failure in failures or []]
+
+    def remove(self, obj_or_string, **kwargs):
+        fan_out(self.backends, lambda backend: backend.remove(obj_or_string, **kwargs))
+
+    def remove_many(self, objs_or_strings, commit=True):
+        objs_or_strings = list(objs_or_strings)
+        fan_out(self.backends, lambda backend: backend.remove_many(objs_or_strings, commit=commit))
@@ -0,0 +1,67 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import time
+
+from django.core.cache import caches
+
+# The generation every write to the connection bumps, whatever the model.
+ALL_MODELS = '*'
+
+
+class WriteGenerations(object):
+    """
+    Per-(connection, model) write generations, held in a Django cache so
+    that every process sharing the cache sees them: each write to the
+    documents of a model bumps its generation, so that anything keyed by
+    the generations of the models it involves (cached search results,
+    ETags) changes when, & only when, those are written to.
+
+    Models are given as ``app_label.model_name`` strings. Generations start
+    from the current time (in microseconds) rather than from zero, so that
+    one evicted from the cache doesn't come back with a value it had before.
+    """
+    def __init__(self, cache_alias='default'):
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, using, model):
+        return 'searchstack:generation:%s:%s' % (using, model)
+
+    def get_many(self, using, models):
+        """
+        Returns a dict of the generations of ``models`` on ``using``, along
+        with that of the whole connection (under ``ALL_MODELS``).
+        """
+        keys = dict((self.key(using, model), model) for model in set(models) | set([ALL_MODELS]))
+        found = self.cache.get_many(list(keys))
+        generations = {}
+
+        for key, model in keys.items():
+            if key not in found:
+                self.cache.add(key, self.initial(), None)
+                found[key] = self.cache.get(key, 0)
+
+            generations[model] = found[key]
+
+        return generations
+
+    def bump(self, using, models=None):
+        """
+        Bumps the generations of ``models`` on ``using``, or that of the whole
+        connection if ``models`` is ``None``.
+        """
+        for model in (set(models) if models is not None else [ALL_MODELS]):
+            key = self.key(using, model)
+
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # Not set (or evicted): any new value will do.
+                self.cache.add(key, self.initial(), None)
+
+    def initial(self):
+        return int(time.time() * 1000000)
@@ -9,12 +9,18 @@ from collections import OrderedDict
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import Signal
 from django.utils.module_loading import module_has_submodule
 
 from ..exceptions import NotHandled, SearchFieldError
-from ..fields import SearchField
+from ..fields import SearchField, clear_template_cache
 from .app_loading import haystack_get_app_modules
 
+# Sent when a ``UnifiedIndex`` is reset (which building it does) or a
+# connection reloaded, so that what was derived from the indexes elsewhere
+# can be dropped.
+indexes_changed = Signal()
+
 
 def import_class(path):
     path_bits = path.split('.')
@@ -108,6 +114,7 @@ class ConnectionHandler(object):
         except KeyError:
             pass
 
+        indexes_changed.send(sender=self.__class__, using=key)
         return self.__getitem__(key)
 
     def all(self):
@@ -191,6 +198,8 @@ class UnifiedIndex(object):
         return indexes
 
     def reset(self):
+        clear_template_cache()
+        indexes_changed.send(sender=self.__class__, unified_index=self)
         self._indexes = {}
         self.fields = OrderedDict()
         self._built = False
@@ -217,6 +226,7 @@ class UnifiedIndex(object):
 
             self._indexes[model] = index
             self.collect_fields(index)
+            index.build_preparation_plan()
 
         self._built = True
 
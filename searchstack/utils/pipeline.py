@@ -0,0 +1,239 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import sys
+import threading
+from collections import OrderedDict, deque
+from time import time
+
+from django.db import connections
+from django.utils import six
+from django.utils.six.moves import queue
+
+# Marks the end of a stage's input.
+_DONE = object()
+
+
+class _CountingLog(deque):
+    def __init__(self, counters, *args, **kwargs):
+        super(_CountingLog, self).__init__(*args, **kwargs)
+        self.counters = counters
+
+    def append(self, item):
+        for counter in self.counters:
+            counter.count += 1
+
+        super(_CountingLog, self).append(item)
+
+
+class QueryCounter(object):
+    """
+    Counts the SQL queries run on the current thread's database connections
+    while it is active, even with ``DEBUG = False``.
+
+    ``reset_queries`` may be called inside the block; the count is kept
+    separately from the connections' query log.
+    """
+    def __init__(self):
+        self.count = 0
+        self._saved = []
+
+    def __enter__(self):
+        for conn in connections.all():
+            queries_log = conn.queries_log
+            # Keep any enclosing counter counting too.
+            counters = [self] + getattr(queries_log, 'counters', [])
+
+            self._saved.append((conn, conn.force_debug_cursor, queries_log))
+            conn.force_debug_cursor = True
+            conn.queries_log = _CountingLog(counters, queries_log, maxlen=queries_log.maxlen)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for conn, force_debug_cursor, queries_log in self._saved:
+            conn.force_debug_cursor = force_debug_cursor
+            queries_log.clear()
+            queries_log.extend(conn.queries_log)
+            conn.queries_log = queries_log
+
+        self._saved = []
+
+
+class StageStats(object):
+    """
+    Counters for a single pipeline stage.
+
+    ``busy`` is the time spent doing work, summed across all of the stage's
+    workers, so ``rate`` is the number of items per second the stage can
+    sustain with its current concurrency. The stage with the lowest ``rate``
+    is the bottleneck.
+    """
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.batches = 0
+        self.items = 0
+        self.busy = 0.0
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def add(self, items, elapsed, queries=0):
+        with self._lock:
+            self.batches += 1
+            self.items += items
+            self.busy += elapsed
+            self.queries += queries
+
+    @property
+    def rate(self):
+        if not self.busy:
+            return 0.0
+
+        return self.items / (self.busy / self.workers)
+
+    def __str__(self):
+        return "%s: %d items in %d batches, %.2fs busy, %.1f items/s with %d worker(s), %d queries" % (
+            self.name, self.items, self.batches, self.busy, self.rate, self.workers, self.queries)
+
+
+class IndexingPipeline(object):
+    """
+    Indexes a stream of batches as three overlapping stages:
+
+      * ``read`` evaluates each batch's queryset against the database,
+      * ``prepare`` turns the objects into documents using the backend's
+        ``prepare_documents``,
+      * ``send`` hands the documents to the backend's ``send_prepared``.
+
+    The stages are connected by bounded queues (``queue_size`` batches each),
+    so a slow stage applies backpressure instead of letting batches pile up
+    in memory. Each stage runs ``<stage>_workers`` threads; with a single
+    reader, the database is read from the calling thread.
+
+    If any stage fails, the remaining batches are drained without being
+    processed & the first error is re-raised from ``run``.
+    """
+    def __init__(self, backend, index, commit=True, read_workers=1, prepare_workers=1,
+                 send_workers=1, queue_size=2, progress=None):
+        self.backend = backend
+        self.index = index
+        self.commit = commit
+        self.read_workers = max(read_workers, 1)
+        self.prepare_workers = max(prepare_workers, 1)
+        self.send_workers = max(send_workers, 1)
+        self.queue_size = max(queue_size, 1)
+        self.progress = progress
+        self.stats = OrderedDict([
+            ('read', StageStats('read', self.read_workers)),
+            ('prepare', StageStats('prepare', self.prepare_workers)),
+            ('send', StageStats('send', self.send_workers)),
+        ])
+        self._errors = []
+
+    def run(self, batches):
+        """
+        Indexes ``batches``, an iterable of ``(start, end, queryset)`` tuples.
+
+        Returns the per-stage ``StageStats``.
+        """
+        read_queue = queue.Queue(self.queue_size)
+        prepare_queue = queue.Queue(self.queue_size)
+        send_queue = queue.Queue(self.queue_size)
+
+        readers = []
+
+        if self.read_workers > 1:
+            readers = self._start(self.read_workers, self.read, read_queue, prepare_queue)
+
+        preparers = self._start(self.prepare_workers, self.prepare, prepare_queue, send_queue)
+        senders = self._start(self.send_workers, self.send, send_queue, None)
+
+        try:
+            for batch in batches:
+                if self._errors:
+                    break
+
+                if readers:
+                    read_queue.put(batch)
+                else:
+                    self._process('read', self.read, batch, prepare_queue)
+        finally:
+            self._stop(readers, read_queue)
+            self._stop(preparers, prepare_queue)
+            self._stop(senders, send_queue)
+
+        if self._errors:
+            six.reraise(*self._errors[0])
+
+        return self.stats
+
+    def read(self, batch):
+        start, end, qs = batch
+        objects = list(qs)
+        return len(objects), (start, end, objects)
+
+    def prepare(self, batch):
+        start, end, objects = batch
+        documents = list(self.backend.prepare_documents(self.index, objects))
+        return len(objects), (start, end, documents)
+
+    def send(self, batch):
+        start, end, documents = batch
+        self.backend.send_prepared(self.index, documents, commit=self.commit)
+
+        if self.progress is not None:
+            self.progress(start, end)
+
+        return len(documents), None
+
+    def _process(self, name, func, item, outbox):
+        if self._errors:
+            # Something downstream failed. Keep draining so that nothing
+            # blocks on a full queue, but don't do any more work.
+            return
+
+        try:
+            started = time()
+
+            with QueryCounter() as queries:
+                items, result = func(item)
+
+            self.stats[name].add(items, time() - started, queries.count)
+        except Exception:
+            self._errors.append(sys.exc_info())
+            return
+
+        if outbox is not None:
+            outbox.put(result)
+
+    def _work(self, name, func, inbox, outbox):
+        try:
+            while True:
+                item = inbox.get()
+
+                if item is _DONE:
+                    break
+
+                self._process(name, func, item, outbox)
+        finally:
+            # Each thread gets its own database connections; don't leak them.
+            connections.close_all()
+
+    def _start(self, count, func, inbox, outbox):
+        threads = []
+
+        for i in range(count):
+            thread = threading.Thread(target=self._work, args=(func.__name__, func, inbox, outbox))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        return threads
+
+    def _stop(self, threads, inbox):
+        for thread in threads:
+            inbox.put(_DONE)
+
+        for thread in threads:
+            thread.join()
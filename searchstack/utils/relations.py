@@ -0,0 +1,86 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+
+def get_relation(model, name):
+    """
+    Returns the relation field reached through the attribute ``name`` of
+    instances of ``model`` (a forward relation or the accessor of a reverse
+    one), or ``None`` if that attribute isn't a relation to another model.
+    """
+    for field in model._meta.get_fields():
+        if not field.is_relation or field.related_model is None:
+            continue
+
+        if field.auto_created and not field.concrete:
+            accessor = field.get_accessor_name()
+        else:
+            accessor = field.name
+
+        if accessor == name:
+            return field
+
+    return None
+
+
+def resolve_relations(model, path):
+    """
+    Follows ``path`` (a sequence of attribute names, such as a ``model_attr``
+    split on ``__``) through the relations of ``model``.
+
+    Returns a list of ``(name, field)`` pairs for the leading attributes that
+    are relations, stopping at the first attribute that isn't one.
+    """
+    relations = []
+
+    for name in path:
+        field = get_relation(model, name)
+
+        if field is None:
+            break
+
+        relations.append((name, field))
+        model = field.related_model
+
+    return relations
+
+
+def related_lookups(model, paths):
+    """
+    Infers the ``select_related`` & ``prefetch_related`` lookups needed to
+    walk each of ``paths`` from an instance of ``model`` without a query per
+    relation.
+
+    Relations that lead to a single object are joined with
+    ``select_related``. Once a path crosses a relation to many objects, that
+    relation & everything after it is left to ``prefetch_related``.
+
+    Returns a ``(select_related, prefetch_related)`` pair of sorted lists.
+    """
+    select_related = set()
+    prefetch_related = set()
+
+    for path in paths:
+        lookup = []
+        to_many = False
+
+        for name, field in resolve_relations(model, path):
+            lookup.append(name)
+            to_many = to_many or field.many_to_many or field.one_to_many
+
+            if to_many:
+                prefetch_related.add('__'.join(lookup))
+            else:
+                select_related.add('__'.join(lookup))
+
+    # ``select_related('a__b')`` implies ``select_related('a')``.
+    select_related = set(
+        lookup for lookup in select_related
+        if not any(other.startswith(lookup + '__') for other in select_related)
+    )
+    prefetch_related = set(
+        lookup for lookup in prefetch_related
+        if not any(other.startswith(lookup + '__') for other in prefetch_related)
+    )
+
+    return sorted(select_related), sorted(prefetch_related)
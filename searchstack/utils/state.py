@@ -0,0 +1,401 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_text
+
+DEFAULT_STATE_FILE = '.searchstack_state.sqlite3'
+
+
+def shared_state_file():
+    """
+    Returns ``SEARCHSTACK_STATE_FILE`` for state that several processes
+    (& possibly hosts) have to share, such as the ``IndexQueue``. Raises
+    ``ImproperlyConfigured`` unless it is set to an absolute path, as each
+    process would otherwise find its own file under its current directory.
+    """
+    path = getattr(settings, 'SEARCHSTACK_STATE_FILE', None)
+
+    if not path or not os.path.isabs(path):
+        raise ImproperlyConfigured("SEARCHSTACK_STATE_FILE must be set to an absolute path, shared by the "
+                                   "site & the process_index_queue workers, to queue changes.")
+
+    return path
+
+
+class StateStore(object):
+    """
+    Keeps indexing state in an SQLite file (``SEARCHSTACK_STATE_FILE``), so
+    that it outlives the process that wrote it & can be shared between the
+    processes of ``update_index --workers``.
+
+    Each thread gets its own connection. Subclasses list the statements
+    creating their tables in ``schema``.
+    """
+    schema = ()
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'SEARCHSTACK_STATE_FILE', DEFAULT_STATE_FILE)
+        self._local = threading.local()
+
+    @property
+    def db(self):
+        db = getattr(self._local, 'db', None)
+
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+
+            with db:
+                for statement in self.schema:
+                    db.execute(statement)
+
+            self._local.db = db
+
+        return db
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class CheckpointStore(StateStore):
+    """
+    Records which ``(after_pk, until_pk]`` ranges of each model have been
+    indexed on each connection, so that an interrupted run can be resumed.
+
+    Primary keys are stored as text; callers convert them back with the
+    model's primary key field.
+    """
+    schema = (
+        'CREATE TABLE IF NOT EXISTS checkpoint_run ('
+        ' connection TEXT NOT NULL, model TEXT NOT NULL, done INTEGER NOT NULL,'
+        ' PRIMARY KEY (connection, model))',
+        'CREATE TABLE IF NOT EXISTS checkpoint_range ('
+        ' connection TEXT NOT NULL, model TEXT NOT NULL, after_pk TEXT, until_pk TEXT NOT NULL)',
+    )
+
+    def start(self, using, model):
+        """
+        Forgets any previous run of ``model`` on ``using`` & starts a new one.
+        """
+        with self.db as db:
+            db.execute('DELETE FROM checkpoint_range WHERE connection = ? AND model = ?', (using, model))
+            db.execute('INSERT OR REPLACE INTO checkpoint_run (connection, model, done) VALUES (?, ?, 0)',
+                       (using, model))
+
+    def complete(self, using, model, after_pk, until_pk):
+        """
+        Records that the ``(after_pk, until_pk]`` range has been indexed.
+        """
+        if after_pk is not None:
+            after_pk = force_text(after_pk)
+
+        with self.db as db:
+            db.execute('INSERT INTO checkpoint_range (connection, model, after_pk, until_pk) VALUES (?, ?, ?, ?)',
+                       (using, model, after_pk, force_text(until_pk)))
+
+    def finish(self, using, model):
+        """
+        Marks the run as done; its ranges are no longer needed.
+        """
+        with self.db as db:
+            db.execute('DELETE FROM checkpoint_range WHERE connection = ? AND model = ?', (using, model))
+            db.execute('UPDATE checkpoint_run SET done = 1 WHERE connection = ? AND model = ?', (using, model))
+
+    def status(self, using, model):
+        """
+        Returns ``None`` if there's no record of a run, else whether the last
+        run finished.
+        """
+        row = self.db.execute('SELECT done FROM checkpoint_run WHERE connection = ? AND model = ?',
+                              (using, model)).fetchone()
+        return None if row is None else bool(row[0])
+
+    def ranges(self, using, model):
+        """
+        Returns the ``(after_pk, until_pk)`` ranges completed by the current
+        run, in the order they were recorded.
+        """
+        return self.db.execute('SELECT after_pk, until_pk FROM checkpoint_range '
+                               'WHERE connection = ? AND model = ? ORDER BY rowid', (using, model)).fetchall()
+
+
+class HighWaterMarkStore(StateStore):
+    """
+    Records, per connection & model, the largest ``get_updated_field`` value
+    that has been indexed successfully.
+    """
+    schema = (
+        'CREATE TABLE IF NOT EXISTS high_water_mark ('
+        ' connection TEXT NOT NULL, model TEXT NOT NULL, value TEXT NOT NULL,'
+        ' PRIMARY KEY (connection, model))',
+    )
+
+    def get(self, using, model):
+        """
+        Returns the stored mark as text, or ``None`` if there isn't one.
+        """
+        row = self.db.execute('SELECT value FROM high_water_mark WHERE connection = ? AND model = ?',
+                              (using, model)).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, using, model, value):
+        with self.db as db:
+            db.execute('INSERT OR REPLACE INTO high_water_mark (connection, model, value) VALUES (?, ?, ?)',
+                       (using, model, value))
+
+    def clear(self, using, model):
+        with self.db as db:
+            db.execute('DELETE FROM high_water_mark WHERE connection = ? AND model = ?', (using, model))
+
+
+class DigestStore(StateStore):
+    """
+    Records a digest of the last document sent to each connection for each
+    identifier, so that unchanged documents needn't be sent again.
+    """
+    schema = (
+        'CREATE TABLE IF NOT EXISTS document_digest ('
+        ' connection TEXT NOT NULL, identifier TEXT NOT NULL, model TEXT NOT NULL, digest TEXT NOT NULL,'
+        ' PRIMARY KEY (connection, identifier))',
+    )
+    # Stay below SQLite's limit on the number of parameters.
+    chunk_size = 500
+
+    def get_many(self, using, identifiers):
+        """
+        Returns a dictionary of the stored digests for ``identifiers``.
+        """
+        identifiers = list(identifiers)
+        digests = {}
+
+        for start in range(0, len(identifiers), self.chunk_size):
+            chunk = identifiers[start:start + self.chunk_size]
+            rows = self.db.execute('SELECT identifier, digest FROM document_digest '
+                                   'WHERE connection = ? AND identifier IN (%s)' % ', '.join('?' * len(chunk)),
+                                   [using] + chunk)
+            digests.update(rows)
+
+        return digests
+
+    def set_many(self, using, digests):
+        """
+        Stores ``digests``, a list of ``(identifier, model, digest)`` tuples.
+        """
+        with self.db as db:
+            db.executemany('INSERT OR REPLACE INTO document_digest (connection, identifier, model, digest) '
+                           'VALUES (?, ?, ?, ?)', [(using,) + tuple(row) for row in digests])
+
+    def delete_many(self, using, identifiers):
+        identifiers = list(identifiers)
+
+        with self.db as db:
+            for start in range(0, len(identifiers), self.chunk_size):
+                chunk = identifiers[start:start + self.chunk_size]
+                db.execute('DELETE FROM document_digest WHERE connection = ? AND identifier IN (%s)'
+                           % ', '.join('?' * len(chunk)), [using] + chunk)
+
+    def clear(self, using, models=None):
+        """
+        Deletes the digests of ``using``, or only those of ``models`` (a list
+        of ``app_label.model_name`` strings).
+        """
+        with self.db as db:
+            if models is None:
+                db.execute('DELETE FROM document_digest WHERE connection = ?', (using,))
+            else:
+                db.executemany('DELETE FROM document_digest WHERE connection = ? AND model = ?',
+                               [(using, model) for model in models])
+
+
+class DeadLetterStore(StateStore):
+    """
+    Records the documents each connection still failed to index after its
+    retries (see the ``DEAD_LETTERS`` connection option), by identifier,
+    with their model, primary key & the last error, until they're replayed.
+    """
+    schema = (
+        'CREATE TABLE IF NOT EXISTS dead_letter ('
+        ' connection TEXT NOT NULL, identifier TEXT NOT NULL, model TEXT NOT NULL, pk TEXT NOT NULL,'
+        ' error TEXT, failed_at REAL NOT NULL, PRIMARY KEY (connection, identifier))',
+    )
+    chunk_size = 500
+
+    def add_many(self, using, letters):
+        """
+        Stores ``letters``, a list of ``(identifier, model, pk, error)``
+        tuples, replacing any previous letter for the same identifiers.
+        """
+        now = time.time()
+
+        with self.db as db:
+            db.executemany('INSERT OR REPLACE INTO dead_letter '
+                           '(connection, identifier, model, pk, error, failed_at) VALUES (?, ?, ?, ?, ?, ?)',
+                           [(using, identifier, model, force_text(pk), error, now)
+                            for identifier, model, pk, error in letters])
+
+    def get_all(self, using):
+        """
+        Returns the ``(identifier, model, pk, error)`` letters of ``using``,
+        grouped by model.
+        """
+        return self.db.execute('SELECT identifier, model, pk, error FROM dead_letter WHERE connection = ? '
+                               'ORDER BY model, rowid', (using,)).fetchall()
+
+    def count(self, using):
+        row = self.db.execute('SELECT COUNT(*) FROM dead_letter WHERE connection = ?', (using,)).fetchone()
+        return row[0]
+
+    def delete_many(self, using, identifiers):
+        identifiers = list(identifiers)
+
+        with self.db as db:
+            for start in range(0, len(identifiers), self.chunk_size):
+                chunk = identifiers[start:start + self.chunk_size]
+                db.execute('DELETE FROM dead_letter WHERE connection = ? AND identifier IN (%s)'
+                           % ', '.join('?' * len(chunk)), [using] + chunk)
+
+    def clear(self, using):
+        with self.db as db:
+            db.execute('DELETE FROM dead_letter WHERE connection = ?', (using,))
+
+
+class IndexQueue(StateStore):
+    """
+    A durable queue of ``(action, model, pk, connection)`` entries, written
+    by the ``QueuedSignalProcessor`` & drained by ``process_index_queue``.
+
+    ``action`` is either ``'update'`` or ``'delete'``, ``model`` is an
+    ``app_label.model_name`` string & primary keys are stored as text.
+
+    Workers ``claim`` entries for a while (their lease) & then ``ack``,
+    ``retry`` or ``park`` them. Entries whose lease runs out (because their
+    worker died) can be claimed again. Entries for an object that another
+    worker holds aren't handed out, so that two workers never index the same
+    object at the same time.
+    """
+    schema = (
+        'CREATE TABLE IF NOT EXISTS index_queue ('
+        ' id INTEGER PRIMARY KEY AUTOINCREMENT, action TEXT NOT NULL, model TEXT NOT NULL, pk TEXT NOT NULL,'
+        ' connection TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, available REAL NOT NULL,'
+        ' claim TEXT, claimed_until REAL, parked INTEGER NOT NULL DEFAULT 0, error TEXT)',
+        'CREATE INDEX IF NOT EXISTS index_queue_object ON index_queue (connection, model, pk)',
+    )
+    chunk_size = 500
+
+    def put_many(self, entries):
+        """
+        Adds ``entries``, a list of ``(action, model, pk, connection)`` tuples.
+        """
+        now = time.time()
+
+        with self.db as db:
+            db.executemany('INSERT INTO index_queue (action, model, pk, connection, available) '
+                           'VALUES (?, ?, ?, ?, ?)',
+                           [(action, model, force_text(pk), using, now)
+                            for action, model, pk, using in entries])
+
+    def claim(self, limit, lease):
+        """
+        Claims up to ``limit`` of the oldest available entries for ``lease``
+        seconds. Returns them as ``(id, action, model, pk, connection,
+        attempts)`` tuples, oldest first.
+        """
+        claim = uuid.uuid4().hex
+        now = time.time()
+
+        # A single statement, so that concurrent workers can't claim the
+        # same entries.
+        with self.db as db:
+            db.execute(
+                'UPDATE index_queue SET claim = ?, claimed_until = ? WHERE id IN ('
+                ' SELECT id FROM index_queue AS entry WHERE parked = 0 AND available <= ?'
+                ' AND NOT EXISTS (SELECT 1 FROM index_queue AS held WHERE held.connection = entry.connection'
+                '  AND held.model = entry.model AND held.pk = entry.pk AND held.claimed_until > ?)'
+                ' ORDER BY id LIMIT ?)',
+                (claim, now + lease, now, now, limit)
+            )
+
+        return self.db.execute('SELECT id, action, model, pk, connection, attempts FROM index_queue '
+                               'WHERE claim = ? ORDER BY id', (claim,)).fetchall()
+
+    def ack(self, ids):
+        """
+        Deletes the entries that have been processed.
+        """
+        self._update_many('DELETE FROM index_queue WHERE id IN (%s)', (), ids)
+
+    def retry(self, ids, attempts, delay, error=None):
+        """
+        Releases entries that failed, to be claimed again in ``delay``
+        seconds, recording the number of ``attempts`` made so far.
+        """
+        self._update_many('UPDATE index_queue SET attempts = ?, available = ?, error = ?, claim = NULL, '
+                          'claimed_until = NULL WHERE id IN (%s)',
+                          (attempts, time.time() + delay, error), ids)
+
+    def park(self, ids, attempts, error=None):
+        """
+        Sets aside entries that keep failing. They stay in the queue but are
+        no longer handed out.
+        """
+        self._update_many('UPDATE index_queue SET parked = 1, attempts = ?, error = ?, claim = NULL, '
+                          'claimed_until = NULL WHERE id IN (%s)', (attempts, error), ids)
+
+    def counts(self):
+        """
+        Returns the number of pending & parked entries.
+        """
+        total, parked = self.db.execute('SELECT COUNT(*), COALESCE(SUM(parked), 0) '
+                                        'FROM index_queue').fetchone()
+        return total - parked, parked
+
+    def clear(self):
+        with self.db as db:
+            db.execute('DELETE FROM index_queue')
+
+    def _update_many(self, statement, params, ids):
+        ids = list(ids)
+
+        with self.db as db:
+            for start in range(0, len(ids), self.chunk_size):
+                chunk = ids[start:start + self.chunk_size]
+                db.execute(statement % ', '.join('?' * len(chunk)), tuple(params) + tuple(chunk))
+
+
+def remaining_ranges(completed, to_python):
+    """
+    Returns the ``(after_pk, until_pk)`` ranges not covered by ``completed``
+    (as returned by ``CheckpointStore.ranges``), in order. ``after_pk`` is
+    ``None`` for a range from the first record & the last range always has
+    an ``until_pk`` of ``None`` (until the last record).
+
+    ``to_python`` converts the stored text back into primary keys, so they
+    compare the way the database orders them.
+    """
+    covered = sorted(
+        ((None if after_pk is None else to_python(after_pk), to_python(until_pk)) for after_pk, until_pk in completed),
+        key=lambda bounds: (bounds[0] is not None, bounds[0])
+    )
+    remaining = []
+    frontier = None
+
+    for after_pk, until_pk in covered:
+        if after_pk is not None and (frontier is None or after_pk > frontier):
+            remaining.append((frontier, after_pk))
+
+        if frontier is None or until_pk > frontier:
+            frontier = until_pk
+
+    remaining.append((frontier, None))
+    return remaining
@@ -2,12 +2,14 @@
 from __future__ import unicode_literals
 
 from django.conf import settings
-from django.core.paginator import InvalidPage, Paginator
+from django.core.paginator import InvalidPage
 from django.http import Http404
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 
+from .exceptions import CursorError
 from .forms import FacetedSearchForm, ModelSearchForm
+from .paginator import CursorPaginator, SearchPaginator
 from .query import EmptySearchQuerySet
 
 RESULTS_PER_PAGE = getattr(settings, 'SEARCHSTACK_SEARCH_RESULTS_PER_PAGE', 20)
@@ -21,8 +23,9 @@ class SearchView(object):
     request = None
     form = None
     results_per_page = RESULTS_PER_PAGE
+    cursor_pagination = False
 
-    def __init__(self, template=None, load_all=True, form_class=None, searchqueryset=None, context_class=RequestContext, results_per_page=None):
+    def __init__(self, template=None, load_all=True, form_class=None, searchqueryset=None, context_class=RequestContext, results_per_page=None, cursor_pagination=None):
         self.load_all = load_all
         self.form_class = form_class
         self.context_class = context_class
@@ -34,6 +37,9 @@ class SearchView(object):
         if results_per_page is not None:
             self.results_per_page = results_per_page
 
+        if cursor_pagination is not None:
+            self.cursor_pagination = cursor_pagination
+
         if template:
             self.template = template
 
@@ -96,7 +102,20 @@ class SearchView(object):
         In case someone does not want to use Django's built-in pagination, it
         should be a simple matter to override this method to do what they would
         like.
+
+        With ``cursor_pagination``, pages are reached with the ``cursor``
+        parameter rather than ``page`` (see ``CursorPaginator``).
         """
+        if self.cursor_pagination:
+            paginator = CursorPaginator(self.results, self.results_per_page)
+
+            try:
+                page = paginator.page(self.request.GET.get('cursor') or None)
+            except CursorError:
+                raise Http404("Not a valid cursor.")
+
+            return (paginator, page)
+
         try:
             page_no = int(self.request.GET.get('page', 1))
         except (TypeError, ValueError):
@@ -105,10 +124,8 @@ class SearchView(object):
         if page_no < 1:
             raise Http404("Pages should be 1 or greater.")
 
-        start_offset = (page_no - 1) * self.results_per_page
-        self.results[start_offset:start_offset + self.results_per_page]
-
-        paginator = Paginator(self.results, self.results_per_page)
+        # Fetches the page, the hit count & the facets in a single search.
+        paginator = SearchPaginator(self.results, self.results_per_page)
 
         try:
             page = paginator.page(page_no)
@@ -139,7 +156,7 @@ class SearchView(object):
             'suggestion': None,
         }
 
-        if self.results and hasattr(self.results, 'query') and self.results.query.backend.include_spelling:
+        if hasattr(self.results, 'query') and self.results.query.backend.include_spelling and self.results:
             context['suggestion'] = self.form.get_suggestion()
 
         context.update(self.extra_context())
@@ -177,7 +194,7 @@ class FacetedSearchView(SearchView):
         return extra
 
 
-def basic_search(request, template='search/search.html', load_all=True, form_class=ModelSearchForm, searchqueryset=None, context_class=RequestContext, extra_context=None, results_per_page=None):
+def basic_search(request, template='search/search.html', load_all=True, form_class=ModelSearchForm, searchqueryset=None, context_class=RequestContext, extra_context=None, results_per_page=None, cursor_pagination=False):
     """
     A more traditional view that also demonstrate an alternative
     way to use Haystack.
@@ -197,6 +214,9 @@ def basic_search(request, template='search/search.html', load_all=True, form_cla
           A paginator instance for the results.
         * query
           The query received by the form.
+
+    With ``cursor_pagination``, pages are reached with the ``cursor``
+    parameter rather than ``page`` (see ``CursorPaginator``).
     """
     query = ''
     results = EmptySearchQuerySet()
@@ -210,12 +230,20 @@ def basic_search(request, template='search/search.html', load_all=True, form_cla
     else:
         form = form_class(searchqueryset=searchqueryset, load_all=load_all)
 
-    paginator = Paginator(results, results_per_page or RESULTS_PER_PAGE)
+    if cursor_pagination:
+        paginator = CursorPaginator(results, results_per_page or RESULTS_PER_PAGE)
+
+        try:
+            page = paginator.page(request.GET.get('cursor') or None)
+        except CursorError:
+            raise Http404("Not a valid cursor.")
+    else:
+        paginator = SearchPaginator(results, results_per_page or RESULTS_PER_PAGE)
 
-    try:
-        page = paginator.page(int(request.GET.get('page', 1)))
-    except InvalidPage:
-        raise Http404("No such page of results!")
+        try:
+            page = paginator.page(int(request.GET.get('page', 1)))
+        except InvalidPage:
+            raise Http404("No such page of results!")
 
     context = {
         'form': form,
@@ -2,17 +2,20 @@
 from __future__ import unicode_literals
 
 import datetime
+import json
 import logging as std_logging
 import operator
+import re
 from decimal import Decimal
 
 import elasticsearch
 from django.conf import settings
 from django.test import TestCase
 from django.test.utils import override_settings
+from mock import patch
 
 from searchstack import connections, indexes, reset_search_queries
-from searchstack.exceptions import SkipDocument
+from searchstack.exceptions import IndexingError, SkipDocument
 from searchstack.inputs import AutoQuery
 from searchstack.models import SearchResult
 from searchstack.query import SQ, RelatedSearchQuerySet, SearchQuerySet
@@ -215,6 +218,333 @@ class TestSettings(TestCase):
         self.assertEqual(backend.conn.transport.max_retries, 42)
 
 
+class ElasticsearchBulkTestCase(TestCase):
+    """Exercises the bulk requests without a running server."""
+    def setUp(self):
+        super(ElasticsearchBulkTestCase, self).setUp()
+        self.smmi = ElasticsearchMockSearchIndex()
+        self.sample_objs = []
+
+        for i in range(1, 6):
+            mock = MockModel()
+            mock.id = i
+            mock.author = 'daniel%s' % i
+            mock.pub_date = datetime.date(2009, 2, 25) - datetime.timedelta(days=i)
+            self.sample_objs.append(mock)
+
+        self.requests = []
+        self.failing_ids = set()
+
+    def get_backend(self, **options):
+        from searchstack.backends.elasticsearch_backend import ElasticsearchSearchBackend
+        options.setdefault('URL', settings.SEARCHSTACK_CONNECTIONS['elasticsearch']['URL'])
+        options.setdefault('INDEX_NAME', 'testing')
+        backend = ElasticsearchSearchBackend('elasticsearch', **options)
+        backend.setup_complete = True
+        patch.object(backend.conn, 'bulk', side_effect=self.fake_bulk).start()
+        patch.object(backend.conn.indices, 'refresh').start()
+        self.addCleanup(patch.stopall)
+        return backend
+
+    def fake_bulk(self, body, index, doc_type):
+        lines = body.splitlines()
+        actions = [json.loads(line) for line in lines[::2]]
+        self.requests.append([json.loads(line) for line in lines[1::2]])
+        items = []
+
+        for action in actions:
+            doc_id = action['index']['_id']
+
+            if doc_id in self.failing_ids:
+                items.append({'index': {'_id': doc_id, 'status': 400, 'error': 'MapperParsingException'}})
+            else:
+                items.append({'index': {'_id': doc_id, 'status': 201}})
+
+        return {'took': 1, 'errors': bool(self.failing_ids), 'items': items}
+
+    def test_chunks_by_count(self):
+        backend = self.get_backend(BULK_CHUNK_SIZE=2)
+        backend.update(self.smmi, self.sample_objs)
+
+        self.assertEqual([len(docs) for docs in self.requests], [2, 2, 1])
+        self.assertEqual(self.requests[0][0]['id'], 'core.mockmodel.1')
+        self.assertEqual(self.requests[0][0]['name'], 'daniel1')
+        self.assertNotIn('_id', self.requests[0][0])
+        self.assertEqual(backend.conn.indices.refresh.call_count, 1)
+
+    def test_chunks_by_bytes(self):
+        backend = self.get_backend(BULK_MAX_BYTES=300)
+        backend.update(self.smmi, self.sample_objs, commit=False)
+
+        # No two documents fit in 300 bytes, so each is sent on its own.
+        self.assertEqual([len(docs) for docs in self.requests], [1, 1, 1, 1, 1])
+        self.assertFalse(backend.conn.indices.refresh.called)
+
+        # Documents larger than the limit are still sent.
+        self.requests = []
+        backend.bulk_max_bytes = 10
+        backend.update(self.smmi, self.sample_objs[:2], commit=False)
+        self.assertEqual([len(docs) for docs in self.requests], [1, 1])
+
+    def test_failures(self):
+        self.failing_ids = set(['core.mockmodel.2', 'core.mockmodel.5'])
+        backend = self.get_backend(BULK_CHUNK_SIZE=2, SILENTLY_FAIL=False)
+
+        with self.assertRaises(IndexingError) as cm:
+            backend.update(self.smmi, self.sample_objs)
+
+        # The other documents were still sent.
+        self.assertEqual([len(docs) for docs in self.requests], [2, 2, 1])
+        self.assertEqual(sorted(doc_id for doc_id, error in cm.exception.errors),
+                         ['core.mockmodel.2', 'core.mockmodel.5'])
+
+        backend.silently_fail = True
+        failures = backend.update(self.smmi, self.sample_objs)
+        self.assertEqual(failures, [('core.mockmodel.2', 'MapperParsingException'),
+                                    ('core.mockmodel.5', 'MapperParsingException')])
+
+    def test_failed_request(self):
+        backend = self.get_backend(BULK_CHUNK_SIZE=3)
+        backend.conn.bulk.side_effect = [elasticsearch.ConnectionError('N/A', 'down', None),
+                                         {'items': [{'index': {'_id': 'core.mockmodel.4', 'status': 201}},
+                                                    {'index': {'_id': 'core.mockmodel.5', 'status': 201}}]}]
+
+        failures = backend.update(self.smmi, self.sample_objs)
+        self.assertEqual([doc_id for doc_id, error in failures],
+                         ['core.mockmodel.1', 'core.mockmodel.2', 'core.mockmodel.3'])
+
+    @patch('searchstack.backends.sleep')
+    def test_retries(self, mock_sleep):
+        self.failing_ids = set(['core.mockmodel.2', 'core.mockmodel.5'])
+        backend = self.get_backend(BULK_CHUNK_SIZE=2, RETRIES=1)
+        patch.object(backend.log, 'warning').start()
+
+        def recover(*args, **kwargs):
+            # The cluster takes the documents it rejected the first time.
+            response = self.fake_bulk(*args, **kwargs)
+            self.failing_ids = set(['core.mockmodel.5'])
+            return response
+
+        backend.conn.bulk.side_effect = recover
+        failures = backend.update(self.smmi, self.sample_objs)
+
+        # Only the rejected documents are sent again.
+        self.assertEqual([[doc['id'] for doc in docs] for docs in self.requests[3:]],
+                         [['core.mockmodel.2', 'core.mockmodel.5']])
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertEqual(failures, [('core.mockmodel.5', 'MapperParsingException')])
+
+    def test_threads(self):
+        self.failing_ids = set(['core.mockmodel.3'])
+        backend = self.get_backend(BULK_CHUNK_SIZE=1, BULK_THREADS=3)
+        failures = backend.update(self.smmi, self.sample_objs)
+
+        self.assertEqual(len(self.requests), 5)
+        self.assertEqual(sorted(docs[0]['id'] for docs in self.requests),
+                         ['core.mockmodel.%s' % i for i in range(1, 6)])
+        self.assertEqual(failures, [('core.mockmodel.3', 'MapperParsingException')])
+
+    def test_remove_many(self):
+        backend = self.get_backend(BULK_CHUNK_SIZE=2, SILENTLY_FAIL=False)
+        bodies = []
+
+        def fake_bulk(body, index, doc_type):
+            actions = [json.loads(line) for line in body.splitlines()]
+            bodies.append(actions)
+            # Deleting a missing document isn't an error.
+            return {'items': [{'delete': {'_id': action['delete']['_id'], 'status': 404, 'found': False}}
+                              for action in actions]}
+
+        backend.conn.bulk.side_effect = fake_bulk
+        backend.remove_many(self.sample_objs[:3] + ['core.mockmodel.99'])
+
+        self.assertEqual(bodies, [
+            [{'delete': {'_id': 'core.mockmodel.1'}}, {'delete': {'_id': 'core.mockmodel.2'}}],
+            [{'delete': {'_id': 'core.mockmodel.3'}}, {'delete': {'_id': 'core.mockmodel.99'}}],
+        ])
+        self.assertEqual(backend.conn.indices.refresh.call_count, 1)
+
+    def test_scan(self):
+        backend = self.get_backend()
+        hits = [{'_id': 'core.mockmodel.%s' % i, '_source': {'django_id': '%s' % i}} for i in range(1, 6)]
+        patch.object(backend.conn, 'search', return_value={'_scroll_id': 'a', 'hits': {'hits': []}}).start()
+        patch.object(backend.conn, 'scroll', side_effect=[
+            {'_scroll_id': 'b', '_shards': {'failed': 0}, 'hits': {'hits': hits[:3]}},
+            {'_scroll_id': 'c', '_shards': {'failed': 0}, 'hits': {'hits': hits[3:]}},
+            {'_scroll_id': 'd', '_shards': {'failed': 0}, 'hits': {'hits': []}},
+        ]).start()
+
+        batches = list(backend.scan([MockModel], batch_size=2))
+        self.assertEqual(batches, [
+            [('core.mockmodel.1', '1'), ('core.mockmodel.2', '2')],
+            [('core.mockmodel.3', '3'), ('core.mockmodel.4', '4')],
+            [('core.mockmodel.5', '5')],
+        ])
+
+        search_kwargs = backend.conn.search.call_args[1]
+        self.assertEqual(search_kwargs['body']['query']['filtered']['filter'],
+                         {'terms': {'django_ct': ['core.mockmodel']}})
+        self.assertEqual(search_kwargs['body']['_source'], ['django_id'])
+
+    def test_search_chunks(self):
+        backend = self.get_backend()
+        ui = UnifiedIndex()
+        ui.build(indexes=[self.smmi])
+        patch.object(connections['elasticsearch'], '_index', ui).start()
+        hits = [{'_id': 'core.mockmodel.%s' % i, '_score': 1.0,
+                 '_source': {'django_ct': 'core.mockmodel', 'django_id': '%s' % i}} for i in range(1, 6)]
+        patch.object(backend.conn, 'search',
+                     return_value={'_scroll_id': 'a', 'hits': {'hits': hits[:2]}}).start()
+        patch.object(backend.conn, 'scroll', side_effect=[
+            {'_scroll_id': 'b', 'hits': {'hits': hits[2:4]}},
+            {'_scroll_id': 'c', 'hits': {'hits': hits[4:]}},
+            {'_scroll_id': 'c', 'hits': {'hits': []}},
+        ]).start()
+        clear_scroll = patch.object(backend.conn, 'clear_scroll').start()
+
+        chunks = list(backend.search_chunks('*:*', chunk_size=2, sort_by=[('pub_date', 'desc')]))
+        self.assertEqual([[result.pk for result in chunk] for chunk in chunks],
+                         [['1', '2'], ['3', '4'], ['5']])
+
+        search_kwargs = backend.conn.search.call_args[1]
+        self.assertEqual(search_kwargs['scroll'], backend.SCROLL_TIMEOUT)
+        self.assertEqual(search_kwargs['body']['size'], 2)
+        self.assertNotIn('from', search_kwargs['body'])
+        self.assertEqual(search_kwargs['body']['sort'], [{'pub_date': {'order': 'desc'}}])
+        self.assertEqual(backend.conn.scroll.call_args_list[0][1]['scroll_id'], 'a')
+        self.assertEqual(clear_scroll.call_args[1]['scroll_id'], 'c')
+
+        # An abandoned scroll is cleared too.
+        backend.conn.search.return_value = {'_scroll_id': 'd', 'hits': {'hits': hits[:2]}}
+        chunks = backend.search_chunks('*:*', chunk_size=2)
+        next(chunks)
+        chunks.close()
+        self.assertEqual(clear_scroll.call_args[1]['scroll_id'], 'd')
+
+
+    def test_generations(self):
+        backend = self.get_backend()
+        indices = backend.conn.indices
+        patch.object(indices, 'get_settings', side_effect=[
+            {'testing_20260101000000000000': {'settings': {'index': {'number_of_replicas': '2'}}}},
+            {'testing_20260101000000000000': {}, 'testing_20990101000000000000': {}, 'testing_other': {}},
+        ]).start()
+
+        for name in ('create', 'get_mapping', 'put_mapping', 'put_settings', 'exists_alias', 'get_alias',
+                     'update_aliases', 'delete'):
+            patch.object(indices, name).start()
+
+        indices.get_mapping.return_value = {}
+        indices.exists_alias.return_value = True
+        indices.get_alias.return_value = {'testing_20260101000000000000': {}}
+
+        generation = backend.start_generation()
+        self.assertTrue(re.match(r'^testing_\d{20}$', generation))
+        self.assertEqual(backend.index_name, generation)
+        create_kwargs = indices.create.call_args_list[0][1]
+        self.assertEqual(create_kwargs['index'], generation)
+        self.assertEqual(create_kwargs['body']['settings']['number_of_replicas'], 0)
+        self.assertEqual(create_kwargs['body']['settings']['refresh_interval'], '-1')
+        self.assertEqual(indices.put_mapping.call_args[1]['index'], generation)
+
+        # Writes go to the new generation.
+        backend.update(self.smmi, self.sample_objs)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(backend.conn.bulk.call_args[1]['index'], generation)
+
+        backend.publish_generation()
+        self.assertEqual(backend.index_name, 'testing')
+        indices.put_settings.assert_called_once_with(
+            index=generation, body={'index': {'number_of_replicas': '2', 'refresh_interval': '1s'}})
+        indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove': {'index': 'testing_20260101000000000000', 'alias': 'testing'}},
+            {'add': {'index': generation, 'alias': 'testing'}},
+        ]})
+        # Only the older generations are removed.
+        indices.delete.assert_called_once_with(index='testing_20260101000000000000', ignore=404)
+
+    def test_clear_generations(self):
+        backend = self.get_backend()
+        indices = backend.conn.indices
+
+        for name in ('get_settings', 'create', 'get_mapping', 'put_mapping', 'put_settings', 'exists_alias',
+                     'get_alias', 'update_aliases', 'delete'):
+            patch.object(indices, name).start()
+
+        patch.object(backend.conn, 'delete_by_query').start()
+        indices.get_settings.return_value = {'testing_20260101000000000000': {'settings': {}}}
+        indices.get_mapping.return_value = {}
+        indices.exists_alias.return_value = True
+        indices.get_alias.return_value = {'testing_20260101000000000000': {}}
+
+        # The generation behind the alias is replaced by an empty one.
+        backend.clear()
+        self.assertEqual(backend.index_name, 'testing')
+        generation = indices.create.call_args[1]['index']
+        self.assertTrue(re.match(r'^testing_\d{20}$', generation))
+        self.assertEqual(indices.update_aliases.call_args[1]['body']['actions'][-1],
+                         {'add': {'index': generation, 'alias': 'testing'}})
+        indices.delete.assert_called_once_with(index='testing_20260101000000000000', ignore=404)
+
+        # A generation being built is only emptied.
+        indices.delete.reset_mock()
+        generation = backend.start_generation()
+        backend.clear()
+        self.assertEqual(backend.index_name, generation)
+        backend.conn.delete_by_query.assert_called_once_with(index=generation, doc_type='modelresult',
+                                                             body={'query': {'match_all': {}}})
+        self.assertFalse(indices.delete.called)
+
+    def test_bulk_load(self):
+        backend = self.get_backend()
+        indices = backend.conn.indices
+        patch.object(indices, 'get_settings', return_value={
+            'testing': {'settings': {'index': {'number_of_replicas': '2', 'refresh_interval': '30s'}}},
+        }).start()
+        patch.object(indices, 'put_settings').start()
+        patch.object(indices, 'optimize').start()
+        patch.object(backend.conn, 'delete').start()
+
+        with self.assertRaises(ValueError):
+            with backend.bulk_load():
+                indices.put_settings.assert_called_once_with(
+                    index='testing', body={'index': {'number_of_replicas': 0, 'refresh_interval': '-1'}})
+
+                # Nested bulk loads leave the settings alone.
+                with backend.bulk_load():
+                    backend.update(self.smmi, self.sample_objs)
+                    backend.remove(self.sample_objs[0])
+
+                self.assertEqual(indices.put_settings.call_count, 1)
+                self.assertFalse(indices.refresh.called)
+                raise ValueError
+
+        self.assertEqual(backend.bulk_loads, 0)
+        indices.put_settings.assert_called_with(
+            index='testing', body={'index': {'number_of_replicas': '2', 'refresh_interval': '30s'}})
+        indices.optimize.assert_called_once_with(index='testing', wait_for_merge=False)
+        self.assertEqual(indices.refresh.call_count, 1)
+
+        backend.update(self.smmi, self.sample_objs)
+        self.assertEqual(indices.refresh.call_count, 2)
+
+    def test_discard_generation(self):
+        backend = self.get_backend()
+        indices = backend.conn.indices
+
+        for name in ('get_settings', 'create', 'get_mapping', 'put_mapping', 'update_aliases', 'delete'):
+            patch.object(indices, name).start()
+
+        indices.get_settings.side_effect = elasticsearch.NotFoundError(404, 'IndexMissingException', {})
+        indices.get_mapping.return_value = {}
+
+        generation = backend.start_generation()
+        backend.discard_generation()
+
+        self.assertEqual(backend.index_name, 'testing')
+        indices.delete.assert_called_once_with(index=generation, ignore=404)
+        self.assertFalse(indices.update_aliases.called)
+
 class ElasticsearchSearchBackendTestCase(ElasticSearchTestCase):
     def setUp(self):
         super(ElasticsearchSearchBackendTestCase, self).setUp()
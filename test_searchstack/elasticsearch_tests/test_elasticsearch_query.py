@@ -104,6 +104,21 @@ class ElasticsearchSearchQueryTestCase(TestCase):
         self.sq.add_filter(SQ(pub_date__in=[datetime.datetime(2009, 7, 6, 1, 56, 21)]))
         self.assertEqual(self.sq.build_query(), '((why) AND pub_date:("2009-07-06T01:56:21"))')
 
+    def test_build_query_with_search_after(self):
+        self.sq.add_filter(SQ(content='why'))
+        self.sq.add_order_by('-pub_date')
+        self.sq.set_search_after()
+        self.assertEqual(self.sq.order_by, ['-pub_date', 'django_ct', 'django_id'])
+        self.assertEqual(self.sq.build_query(), '(why)')
+
+        self.sq.set_search_after([('-pub_date', datetime.datetime(2009, 7, 6, 1, 56, 21)),
+                                  ('django_ct', 'core.mockmodel'), ('django_id', '3')])
+        self.assertEqual(self.sq.build_query(),
+                         '((why)) AND (pub_date:({* TO "2009-07-06T01:56:21"}) OR '
+                         '(pub_date:("2009-07-06T01:56:21") AND django_ct:({"core.mockmodel" TO *})) OR '
+                         '(pub_date:("2009-07-06T01:56:21") AND django_ct:("core.mockmodel") AND '
+                         'django_id:({"3" TO *})))')
+
     def test_build_query_in_with_set(self):
         self.sq.add_filter(SQ(content='why'))
         self.sq.add_filter(SQ(title__in=set(["A Famous Paper", "An Infamous Article"])))
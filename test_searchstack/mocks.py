@@ -43,20 +43,41 @@ MOCK_INDEX_DATA = {}
 class MockSearchBackend(BaseSearchBackend):
     model_name = 'mockmodel'
 
-    def update(self, index, iterable, commit=True):
+    def send_documents(self, index, documents, commit=True):
         global MOCK_INDEX_DATA
-        for obj in iterable:
-            doc = index.full_prepare(obj)
+        for doc in documents:
             MOCK_INDEX_DATA[doc['id']] = doc
 
     def remove(self, obj, commit=True):
         global MOCK_INDEX_DATA
+        self.forget_digests(identifiers=[get_identifier(obj)])
         if commit is True:
             del MOCK_INDEX_DATA[get_identifier(obj)]
+        self.bump_write_generations(identifiers=[get_identifier(obj)])
+
+    def remove_many(self, objs, commit=True):
+        global MOCK_INDEX_DATA
+        doc_ids = [get_identifier(obj) for obj in objs]
+        self.forget_digests(identifiers=doc_ids)
+        if commit is True:
+            for doc_id in doc_ids:
+                MOCK_INDEX_DATA.pop(doc_id, None)
+        self.bump_write_generations(identifiers=doc_ids)
 
     def clear(self, models=None, commit=True):
         global MOCK_INDEX_DATA
+        self.forget_digests(models=models)
         MOCK_INDEX_DATA = {}
+        self.bump_write_generations(models=models)
+
+    def scan(self, models, batch_size=None):
+        batch_size = batch_size or self.batch_size
+        model_cts = ['%s.%s' % (model._meta.app_label, model._meta.model_name) for model in models]
+        pairs = [(doc_id, doc['django_id']) for doc_id, doc in sorted(MOCK_INDEX_DATA.items())
+                 if doc['django_ct'] in model_cts]
+
+        for start in range(0, len(pairs), batch_size):
+            yield pairs[start:start + batch_size]
 
     @log_query
     def search(self, query_string, **kwargs):
@@ -1,6 +1,9 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
+import os
+import tempfile
+
 SECRET_KEY = "Please do not spew DeprecationWarnings"
 
 # Haystack settings for running tests.
@@ -64,6 +67,8 @@ SEARCHSTACK_CONNECTIONS = {
     },
 }
 
+SEARCHSTACK_STATE_FILE = os.path.join(tempfile.gettempdir(), 'searchstack_tests_state.sqlite3')
+
 MIDDLEWARE_CLASSES = ('django.middleware.common.CommonMiddleware',
                       'django.contrib.sessions.middleware.SessionMiddleware',
                       'django.middleware.csrf.CsrfViewMiddleware',
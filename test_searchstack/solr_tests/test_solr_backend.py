@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import datetime
+import json
 import logging as std_logging
 import os
 from decimal import Decimal
@@ -9,6 +10,7 @@ from decimal import Decimal
 import pysolr
 from django.conf import settings
 from django.test import TestCase
+from django.utils.encoding import force_text
 from django.test.utils import override_settings
 from mock import patch
 
@@ -720,6 +722,172 @@ class FailedSolrSearchBackendTestCase(TestCase):
         self.assertEqual(mock_log.call_count, 6)
 
 
+class SolrUpdateOptionsTestCase(TestCase):
+    """Exercises the update requests without a running server."""
+    def setUp(self):
+        super(SolrUpdateOptionsTestCase, self).setUp()
+        self.smmi = SolrMockSearchIndex()
+        self.sample_objs = []
+
+        for i in range(1, 6):
+            mock = MockModel()
+            mock.id = i
+            mock.author = 'daniel%s' % i
+            mock.pub_date = datetime.date(2009, 2, 25) - datetime.timedelta(days=i)
+            self.sample_objs.append(mock)
+
+        self.requests = []
+
+    def get_backend(self, **options):
+        from searchstack.backends.solr_backend import SolrSearchBackend
+        options.setdefault('URL', settings.SEARCHSTACK_CONNECTIONS['solr']['URL'])
+        backend = SolrSearchBackend('solr', **options)
+        patch.object(backend.conn, '_send_request', side_effect=self.fake_send_request).start()
+        self.addCleanup(patch.stopall)
+        return backend
+
+    def fake_send_request(self, method, path='', body=None, headers=None, files=None):
+        self.requests.append((method, path, body, headers))
+        return ''
+
+    def parse_adds(self, body):
+        # Every document is sent under a repeated ``add`` key.
+        return json.loads(body, object_pairs_hook=lambda pairs: pairs if pairs[0][0] == 'add' else dict(pairs))
+
+    def test_hard_commit(self):
+        backend = self.get_backend()
+        backend.update(self.smmi, self.sample_objs)
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn('commit=true', self.requests[0][1])
+
+    def test_commit_within(self):
+        backend = self.get_backend(COMMIT_WITHIN=5000)
+        backend.update(self.smmi, self.sample_objs)
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn('commitWithin="5000"', force_text(self.requests[0][2]))
+        self.assertNotIn('commit=true', self.requests[0][1])
+
+    def test_soft_commit(self):
+        backend = self.get_backend(SOFT_COMMIT=True)
+        backend.update(self.smmi, self.sample_objs)
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn('softCommit=true', self.requests[0][1])
+        self.assertNotIn('commit=true', self.requests[0][1])
+
+        backend.update(self.smmi, self.sample_objs, commit=False)
+        self.assertNotIn('softCommit=true', self.requests[1][1])
+
+        backend.remove(self.sample_objs[0])
+        self.assertIn('softCommit=true', self.requests[2][1])
+
+    def test_remove_many(self):
+        backend = self.get_backend(BATCH_SIZE=2)
+        backend.remove_many(self.sample_objs[:3] + ['core.mockmodel.99'])
+
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(force_text(self.requests[0][2]),
+                         '<delete><id>core.mockmodel.1</id><id>core.mockmodel.2</id></delete>')
+        self.assertNotIn('commit=true', self.requests[0][1])
+        self.assertEqual(force_text(self.requests[1][2]),
+                         '<delete><id>core.mockmodel.3</id><id>core.mockmodel.99</id></delete>')
+        self.assertIn('commit=true', self.requests[1][1])
+
+        # Nothing to remove still commits.
+        self.requests = []
+        backend.remove_many([])
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn('commit=true', self.requests[0][1])
+
+    def test_stream_updates(self):
+        backend = self.get_backend(STREAM_UPDATES=True, UPDATE_CHUNK_SIZE=2)
+        backend.update(self.smmi, self.sample_objs)
+
+        # Three chunks of documents, then a single commit.
+        self.assertEqual(len(self.requests), 4)
+        adds = [self.parse_adds(body) for method, path, body, headers in self.requests[:3]]
+        self.assertEqual([len(chunk) for chunk in adds], [2, 2, 1])
+        self.assertEqual(self.requests[0][1], 'update')
+        self.assertEqual(self.requests[0][3]['Content-type'], 'application/json; charset=utf-8')
+
+        doc = adds[0][0][1]['doc']
+        self.assertEqual(doc['id'], 'core.mockmodel.1')
+        self.assertEqual(doc['name'], 'daniel1')
+        self.assertEqual(doc['pub_date'], '2009-02-24T00:00:00Z')
+        self.assertEqual(doc['text'], 'Indexed!\n1')
+
+        self.assertIn('commit=true', self.requests[3][1])
+
+    def test_stream_updates_commit_within(self):
+        backend = self.get_backend(STREAM_UPDATES=True, COMMIT_WITHIN=1000)
+        backend.update(self.smmi, self.sample_objs)
+
+        # Solr takes care of the commit.
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.requests[0][1], 'update?commitWithin=1000')
+        self.assertEqual(len(self.parse_adds(self.requests[0][2])), 5)
+
+    def test_stream_updates_boost(self):
+        backend = self.get_backend(STREAM_UPDATES=True)
+        sbmsi = SolrBoostMockSearchIndex()
+        obj = AFourthMockModel(id=1, author='daniel', editor='david', pub_date=datetime.date(2009, 2, 25))
+        backend.update(sbmsi, [obj], commit=False)
+
+        self.assertEqual(len(self.requests), 1)
+        doc = self.parse_adds(self.requests[0][2])[0][1]['doc']
+        self.assertEqual(doc['author'], {'value': 'daniel', 'boost': 2.0})
+        self.assertEqual(doc['editor'], 'david')
+
+
+class SolrScanTestCase(TestCase):
+    def test_scan(self):
+        from searchstack.backends.solr_backend import SolrSearchBackend
+        backend = SolrSearchBackend('solr', URL=settings.SEARCHSTACK_CONNECTIONS['solr']['URL'])
+        pages = [
+            ([{'id': 'core.mockmodel.1', 'django_id': '1'}, {'id': 'core.mockmodel.2', 'django_id': '2'}], 'A'),
+            ([{'id': 'core.mockmodel.3', 'django_id': '3'}], 'B'),
+            ([], 'B'),
+        ]
+        results = [pysolr.Results({'response': {'docs': docs, 'numFound': 3}, 'nextCursorMark': cursor})
+                   for docs, cursor in pages]
+
+        with patch.object(backend.conn, 'search', side_effect=results) as mock_search:
+            batches = list(backend.scan([MockModel], batch_size=2))
+
+        self.assertEqual(batches, [
+            [('core.mockmodel.1', '1'), ('core.mockmodel.2', '2')],
+            [('core.mockmodel.3', '3')],
+        ])
+        self.assertEqual([c[1]['cursorMark'] for c in mock_search.call_args_list], ['*', 'A', 'B'])
+        self.assertEqual(mock_search.call_args[1]['fq'], 'django_ct:(core.mockmodel)')
+        self.assertEqual(mock_search.call_args[1]['sort'], 'id asc')
+
+    def test_search_chunks(self):
+        from searchstack.backends.solr_backend import SolrSearchBackend
+        backend = SolrSearchBackend('solr', URL=settings.SEARCHSTACK_CONNECTIONS['solr']['URL'])
+        ui = UnifiedIndex()
+        ui.build(indexes=[SolrMockSearchIndex()])
+        doc = lambda i: {'id': 'core.mockmodel.%s' % i, 'django_ct': 'core.mockmodel', 'django_id': '%s' % i,
+                         'score': 1.0}
+        pages = [([doc(1), doc(2)], 'A'), ([doc(3)], 'B'), ([], 'B')]
+        results = [pysolr.Results({'response': {'docs': docs, 'numFound': 3}, 'nextCursorMark': cursor})
+                   for docs, cursor in pages]
+
+        with patch.object(connections['solr'], '_index', ui):
+            with patch.object(backend.conn, 'search', side_effect=results) as mock_search:
+                chunks = list(backend.search_chunks('*:*', chunk_size=2, sort_by='pub_date desc',
+                                                    start_offset=10))
+
+        self.assertEqual([[result.pk for result in chunk] for chunk in chunks], [['1', '2'], ['3']])
+        self.assertEqual([c[1]['cursorMark'] for c in mock_search.call_args_list], ['*', 'A', 'B'])
+        # The unique key breaks ties, as cursors require.
+        self.assertEqual(mock_search.call_args[1]['sort'], 'pub_date desc, id asc')
+        self.assertEqual(mock_search.call_args[1]['rows'], 2)
+        self.assertNotIn('start', mock_search.call_args[1])
+
+
 class LiveSolrSearchQueryTestCase(TestCase):
     fixtures = ['initial_data.json']
 
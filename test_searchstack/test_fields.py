@@ -4,8 +4,12 @@ from __future__ import unicode_literals
 import datetime
 from decimal import Decimal
 
+from django.conf import settings
 from django.template import TemplateDoesNotExist
+from django.template.loader import select_template
 from django.test import TestCase
+from django.test.utils import override_settings
+from mock import patch
 from .core.models import MockModel, MockTag
 
 from searchstack.fields import *
@@ -32,8 +36,13 @@ class CharFieldTestCase(TestCase):
         mock.tag = mock_tag
         tag_name = CharField(model_attr='tag__name')
 
+        self.assertEqual(tag_name.model_attr_path, ('tag', 'name'))
         self.assertEqual(tag_name.prepare(mock), 'primary')
 
+        # Changing ``model_attr`` re-resolves the path.
+        tag_name.model_attr = 'tag__pk'
+        self.assertEqual(tag_name.prepare(mock), '%s' % mock_tag.pk)
+
         # Use the default.
         mock = MockModel()
         author = CharField(model_attr='author', default='')
@@ -417,6 +426,54 @@ class CharFieldWithTemplateTestCase(TestCase):
         template5.instance_name = 'template'
         self.assertEqual(template5.prepare(mock), 'BAR!\n')
 
+    def test_template_cache(self):
+        mock = MockModel()
+        mock.pk = 1
+        template = CharField(use_template=True)
+        template.instance_name = 'template'
+
+        with patch('searchstack.fields.loader.select_template', wraps=select_template) as select:
+            self.assertEqual(template.prepare(mock), 'Indexed!\n1')
+            mock.pk = 2
+            self.assertEqual(template.prepare(mock), 'Indexed!\n2')
+            self.assertEqual(select.call_count, 1)
+
+            # A change of name resolves the template again.
+            template.template_name = ['search/indexes/foo.txt']
+            self.assertEqual(template.prepare(mock), 'FOO!\n')
+            self.assertEqual(select.call_count, 2)
+
+            with override_settings(TEMPLATES=settings.TEMPLATES):
+                self.assertEqual(template.prepare(mock), 'FOO!\n')
+                self.assertEqual(select.call_count, 3)
+
+    def test_prepare_template_batch(self):
+        mocks = [MockModel(pk=pk) for pk in range(1, 4)]
+        template = CharField(use_template=True)
+        template.instance_name = 'template'
+
+        self.assertEqual(template.prepare_template_batch(mocks), ['Indexed!\n1', 'Indexed!\n2', 'Indexed!\n3'])
+        self.assertEqual(template.prepare_template_batch([]), [])
+
+        template.prerender(mocks[:2])
+        self.assertEqual(template.prepare(mocks[0]), 'Indexed!\n1')
+
+        with patch.object(template, 'get_template') as get_template:
+            self.assertEqual(template.prepare(mocks[1]), 'Indexed!\n2')
+            self.assertFalse(get_template.called)
+
+            template.prerender([])
+            template.prepare(mocks[1])
+            self.assertTrue(get_template.called)
+
+    def test_prepare_template_batch_isolation(self):
+        mocks = [MockModel(pk=pk) for pk in range(1, 4)]
+        template = CharField(use_template=True)
+        template.instance_name = 'assigned'
+
+        # Only the first object's render assigns ``year``.
+        self.assertEqual(template.prepare_template_batch(mocks), ['Assigned!\n1', '2', '3'])
+
 
 ##############################################################################
 # The following tests look like they don't do much, but it's important because
@@ -1,9 +1,12 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
+from django.http import Http404
 from django.test.client import RequestFactory
 from django.test.testcases import TestCase
+from mock import patch
 
+from searchstack import connections
 from searchstack.forms import ModelSearchForm
 from searchstack.generic_views import SearchView
 
@@ -39,6 +42,32 @@ class GenericSearchViewsTestCase(TestCase):
         self.assertIn('page_obj', context)
         self.assertNotIn('page', context)
 
+    def test_search_view_single_search(self):
+        """Test the generic SearchView fetches a page with a single search."""
+        backend = connections['default'].get_backend()
+
+        with patch.object(backend, 'search', wraps=backend.search) as search:
+            context = SearchView.as_view()(request=self.request).context_data
+
+        self.assertEqual(context['paginator'].count, len(context['object_list']))
+        self.assertEqual(search.call_count, 1)
+
+    def test_search_view_cursor_pagination(self):
+        """Test the generic SearchView paginates with a cursor."""
+        backend = connections['default'].get_backend()
+        view = SearchView.as_view(cursor_pagination=True, paginate_by=1)
+
+        with patch.object(backend, 'search', wraps=backend.search) as search:
+            context = view(request=self.request).context_data
+
+        self.assertEqual(context['paginator'].count, len(context['object_list']))
+        self.assertIsNone(context['page_obj'].cursor)
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(search.call_args[1]['sort_by'], ['django_ct', 'django_id'])
+
+        request = self.get_request(url='/some/random/url?q={0}&cursor=nope'.format(self.query))
+        self.assertRaises(Http404, view, request=request)
+
     def test_search_view_form_valid(self):
         """Test the generic SearchView form is valid."""
         v = SearchView()
@@ -7,10 +7,12 @@ from threading import Thread
 
 from django.test import TestCase
 from django.utils.six.moves import queue
-from .core.models import AFifthMockModel, AThirdMockModel, MockModel
+from mock import patch
+from .core.models import AFifthMockModel, AThirdMockModel, MockModel, MockTag
 
 from searchstack import connections, indexes
 from searchstack.exceptions import SearchFieldError
+from searchstack.utils.changes import take_snapshot
 from searchstack.utils.loading import UnifiedIndex
 
 
@@ -42,6 +44,27 @@ class GoodMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
         return MockModel
 
 
+class DependentMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
+    text = indexes.CharField(document=True, use_template=True, depends_on=['author'])
+    pub_date = indexes.DateTimeField(model_attr='pub_date', faceted=True)
+    tag = indexes.CharField(model_attr='tag__name')
+    extra = indexes.CharField(null=True, depends_on=['tag__name'])
+
+    def get_model(self):
+        return MockModel
+
+    def prepare_extra(self, obj):
+        return obj.tag.name.upper()
+
+
+class MethodDependentMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
+    text = indexes.CharField(document=True, model_attr='author')
+    hello = indexes.CharField(model_attr='hello')
+
+    def get_model(self):
+        return MockModel
+
+
 # For testing inheritance...
 class AltGoodMockSearchIndex(GoodMockSearchIndex, indexes.Indexable):
     additional = indexes.CharField(model_attr='author')
@@ -89,6 +112,20 @@ class GoodNullableMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
         return MockModel
 
 
+class NullableFacetForMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
+    text = indexes.CharField(document=True, use_template=True)
+    author = indexes.CharField(model_attr='author', null=True)
+    author_foo = indexes.FacetCharField(facet_for='author', null=True)
+    pub_date = indexes.DateTimeField(model_attr='pub_date', null=True)
+    pub_date_exact = indexes.FacetDateTimeField(facet_for='pub_date')
+
+    def get_model(self):
+        return MockModel
+
+    def prepare_pub_date(self, obj):
+        return None
+
+
 class GoodOverriddenFieldNameMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
     text = indexes.CharField(document=True, use_template=True, index_fieldname='more_content')
     author = indexes.CharField(model_attr='author', index_fieldname='name_s')
@@ -261,6 +298,26 @@ class SearchIndexTestCase(TestCase):
         # Restore the original attribute
         self.mi.__class__.get_updated_field = old_guf
 
+    def test_build_queryset_related_lookups(self):
+        class TagNameIndex(GoodMockSearchIndex):
+            tag_name = indexes.CharField(model_attr='tag__name')
+
+        index = TagNameIndex()
+        self.assertEqual(index.get_related_lookups(), (['tag'], []))
+        self.assertEqual(index.build_queryset().query.select_related, {'tag': {}})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(index.full_prepare(obj)['tag_name'] for obj in index.build_queryset()),
+                             ['primary', 'primary', 'secondary'])
+
+        # Opting out leaves the queryset alone.
+        index.infer_related_lookups = False
+        self.assertEqual(index.build_queryset().query.select_related, False)
+
+        # Nothing to infer.
+        self.assertEqual(self.mi.get_related_lookups(), ([], []))
+        self.assertEqual(self.mi.build_queryset().query.select_related, False)
+
 
     def test_prepare(self):
         mock = MockModel()
@@ -283,6 +340,60 @@ class SearchIndexTestCase(TestCase):
         self.assertEqual(len(self.cmi.full_prepare(mock)), 11)
         self.assertEqual(sorted(self.cmi.full_prepare(mock).keys()), ['author', 'author_exact', 'django_ct', 'django_id', 'extra', 'hello', 'id', 'pub_date', 'pub_date_exact', 'text', 'whee'])
 
+    def test_preparation_plan(self):
+        # ``UnifiedIndex.build`` compiles the plan up front & it's reused.
+        plan = self.mi.get_preparation_plan()
+        self.assertIs(self.mi.get_preparation_plan(), plan)
+        self.assertEqual(sorted(step[0] for step in plan.steps), ['author', 'extra', 'pub_date', 'text'])
+
+        plan = self.cmi.get_preparation_plan()
+        self.assertEqual(sorted(plan.final_steps), [('author_exact', 'author_exact', 'author', True),
+                                                    ('pub_date_exact', 'pub_date_exact', 'pub_date', True)])
+        custom = dict((step[0], step[2]) for step in plan.steps)
+        self.assertEqual(custom['author'], self.cmi.prepare_author)
+        self.assertEqual(custom['extra'], None)
+
+    def test_prerender_templates(self):
+        mocks = list(MockModel.objects.order_by('pk'))
+        expected = [self.mi.full_prepare(mock) for mock in mocks]
+
+        with patch('searchstack.fields.SearchField.prepare_template_batch',
+                   autospec=True, side_effect=lambda field, objs: ['pre!'] * len(objs)):
+            with self.mi.prerender_templates(mocks):
+                prepared = [self.mi.full_prepare(mock) for mock in mocks]
+
+            # The rendered text only lives as long as the block.
+            self.assertEqual(self.mi.full_prepare(mocks[0]), expected[0])
+
+        self.assertEqual([doc['text'] for doc in prepared], ['pre!'] * 3)
+        self.assertEqual([doc['extra'] for doc in prepared], ['pre!'] * 3)
+        self.assertEqual(prepared[0]['author'], expected[0]['author'])
+
+        # Without the patch, the batch renders exactly what rendering one by one does.
+        with self.mi.prerender_templates(mocks):
+            self.assertEqual([self.mi.full_prepare(mock) for mock in mocks], expected)
+
+    def test_prepare_documents_in_slices(self):
+        backend = connections['default'].get_backend()
+        mocks = list(MockModel.objects.order_by('pk'))
+        consumed = []
+
+        def objects():
+            for mock in mocks:
+                consumed.append(mock.pk)
+                yield mock
+
+        with patch.object(backend, 'batch_size', 2):
+            with patch.object(self.mi, 'prerender_templates', wraps=self.mi.prerender_templates) as prerender:
+                documents = backend.prepare_documents(self.mi, objects())
+                first = next(documents)
+                # Only the first slice has been read.
+                self.assertEqual(len(consumed), 2)
+                documents = [first] + list(documents)
+
+        self.assertEqual(documents, [self.mi.full_prepare(mock) for mock in mocks])
+        self.assertEqual([len(call[0][0]) for call in prerender.call_args_list], [2, 1])
+
     def test_thread_safety(self):
         # This is a regression. ``SearchIndex`` used to write to
         # ``self.prepared_data``, which would leak between threads if things
@@ -422,6 +533,76 @@ class SearchIndexTestCase(TestCase):
 
         self.sb.clear()
 
+    def test_remove_queryset(self):
+        self.mi.update()
+        self.assertEqual(self.sb.search('*')['hits'], 3)
+
+        with patch.object(self.sb, 'remove_many', wraps=self.sb.remove_many) as mock_remove_many:
+            self.mi.remove_queryset(MockModel.objects.filter(pk__in=[1, 3]))
+
+        self.assertEqual(mock_remove_many.call_count, 1)
+        self.assertEqual([(res.content_type(), res.pk) for res in self.sb.search('*')['results']], [('core.mockmodel', '2')])
+
+        self.mi.remove_queryset(MockModel.objects.all(), commit=False)
+        self.assertEqual(self.sb.search('*')['hits'], 1)
+        self.sb.clear()
+
+    def test_get_dependencies(self):
+        # Templates & methods can't be inferred.
+        self.assertEqual(self.mi.get_dependencies(), None)
+        self.assertEqual(MethodDependentMockSearchIndex().get_dependencies(), None)
+        self.assertEqual(DependentMockSearchIndex().get_dependencies(),
+                         frozenset(['author', 'pub_date', 'tag']))
+
+        class PreparedMockSearchIndex(DependentMockSearchIndex):
+            def prepare(self, obj):
+                data = super(PreparedMockSearchIndex, self).prepare(obj)
+                data['text'] += obj.foo
+                return data
+
+        self.assertEqual(PreparedMockSearchIndex().get_dependencies(), None)
+        self.assertEqual(PreparedMockSearchIndex().get_related_dependencies(),
+                         [(MockTag, 'tag', frozenset(['name']))])
+        self.assertEqual(MethodDependentMockSearchIndex().get_related_dependencies(), [])
+        PreparedMockSearchIndex.depends_on = ['foo']
+        self.assertEqual(PreparedMockSearchIndex().get_dependencies(),
+                         frozenset(['author', 'foo', 'pub_date', 'tag']))
+
+    def test_get_dependencies_inherited_prepare(self):
+        # Neither the index nor its parent override ``prepare``, which must
+        # hold on Python 2 too, where methods got through a class differ.
+        class ChildMockSearchIndex(DependentMockSearchIndex):
+            pass
+
+        self.assertEqual(ChildMockSearchIndex().get_dependencies(), frozenset(['author', 'pub_date', 'tag']))
+
+        obj = MockModel(pk=1, author='daniel1', foo='bar', tag_id=1)
+        index = ChildMockSearchIndex()
+        self.assertFalse(index.should_update(obj, created=False, update_fields=frozenset(['foo'])))
+
+    def test_should_update_dependencies(self):
+        dmi = DependentMockSearchIndex()
+        obj = MockModel(pk=1, author='daniel1', foo='bar', tag_id=1)
+
+        # Without the signal's arguments, always update.
+        self.assertTrue(dmi.should_update(obj))
+        self.assertTrue(dmi.should_update(obj, created=True, update_fields=frozenset(['foo'])))
+
+        self.assertFalse(dmi.should_update(obj, created=False, update_fields=frozenset(['foo'])))
+        self.assertTrue(dmi.should_update(obj, created=False, update_fields=frozenset(['foo', 'author'])))
+        self.assertTrue(dmi.should_update(obj, created=False, update_fields=frozenset(['tag_id'])))
+
+        # Nothing is known about what changed.
+        self.assertTrue(dmi.should_update(obj, created=False, update_fields=None))
+
+        take_snapshot(obj)
+        obj.foo = 'baz'
+        self.assertFalse(dmi.should_update(obj, created=False, update_fields=None))
+        obj.tag_id = 2
+        self.assertTrue(dmi.should_update(obj, created=False, update_fields=None))
+
+        self.assertTrue(self.mi.should_update(obj, created=False, update_fields=frozenset(['foo'])))
+
     def test_clear(self):
         self.mi.update()
         self.assertGreater(self.sb.search('*')['hits'], 0)
@@ -483,6 +664,33 @@ class SearchIndexTestCase(TestCase):
         self.assertEqual(len(prepared_data), 4)
         self.assertEqual(sorted(prepared_data.keys()), ['django_ct', 'django_id', 'id', 'text'])
 
+    def test_nullable_facets(self):
+        def field_by_field(index, obj):
+            # ``full_prepare`` as it was before preparation plans.
+            prepared_data = index.prepare(obj)
+
+            for field_name, field in index.fields.items():
+                if getattr(field, 'facet_for', None):
+                    source_field_name = index.fields[field.facet_for].index_fieldname
+
+                    if prepared_data[field_name] is None and source_field_name in prepared_data:
+                        prepared_data[field.index_fieldname] = prepared_data[source_field_name]
+
+                if field.null is True:
+                    if prepared_data[field.index_fieldname] is None:
+                        del prepared_data[field.index_fieldname]
+
+            return prepared_data
+
+        mock = MockModel()
+        mock.pk = 20
+        mock.pub_date = datetime.datetime(2009, 1, 31, 4, 19, 0)
+
+        for index in (self.cnmi, NullableFacetForMockSearchIndex()):
+            for author in (None, 'daniel'):
+                mock.author = author
+                self.assertEqual(index.full_prepare(mock), field_by_field(index, mock))
+
     def test_custom_facet_fields(self):
         mock = MockModel()
         mock.pk = 20
@@ -1,12 +1,46 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
+import datetime
+import logging
+import threading
+
 from django.conf import settings
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test import TestCase
-from mock import call, patch
+from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+from mock import Mock, call, patch
+
+from searchstack import connections, indexes
+from searchstack.utils.loading import UnifiedIndex
+from searchstack.exceptions import IndexingError
+from searchstack.utils.state import CheckpointStore, DeadLetterStore, HighWaterMarkStore, IndexQueue
+
+from . import mocks
+from .core.models import AnotherMockModel, MockModel
+from .mocks import MockSearchBackend
+
+__all__ = ['CoreManagementCommandsTestCase', 'FanOutUpdateIndexTestCase', 'KeysetUpdateIndexTestCase',
+           'PipelinedUpdateIndexTestCase', 'ProcessIndexQueueTestCase', 'RemoveStaleTestCase',
+           'ResumeUpdateIndexTestCase', 'RetryTestCase', 'SinceLastRunTestCase', 'SkipUnchangedTestCase']
+
+
+class KeysetMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
+    text = indexes.CharField(document=True, use_template=True)
+    author = indexes.CharField(model_attr='author')
 
-__all__ = ['CoreManagementCommandsTestCase']
+    def get_model(self):
+        return MockModel
+
+
+class UpdatedMockSearchIndex(KeysetMockSearchIndex):
+    def get_updated_field(self):
+        return 'pub_date'
 
 
 class CoreManagementCommandsTestCase(TestCase):
@@ -73,6 +107,75 @@ class CoreManagementCommandsTestCase(TestCase):
         self.assertTrue(mock_handle_clear.called)
         self.assertTrue(mock_handle_update.called)
 
+    @patch("searchstack.loading.ConnectionHandler.__getitem__")
+    @patch('searchstack.management.commands.update_index.Command.handle')
+    @patch('searchstack.management.commands.clear_index.Command.handle')
+    def test_rebuild_index_blue_green(self, mock_handle_clear, mock_handle_update, m):
+        backend = m.return_value.get_backend.return_value
+        backend.start_generation.return_value = 'testing_20261018000000000000'
+        AnotherMockModel.objects.create(pk=1, author='daniel1', pub_date=timezone.now())
+        backend.scan.return_value = [[('core.anothermockmodel.1', '1'), ('core.anothermockmodel.999', '999')]]
+        # Only one of the indexes can tell which objects were updated.
+        untracked = Mock(**{'get_updated_field.return_value': None,
+                            'get_model.return_value': AnotherMockModel,
+                            'index_queryset.return_value': AnotherMockModel.objects.all()})
+        m.return_value.get_unified_index.return_value.get_indexes.return_value = {
+            MockModel: UpdatedMockSearchIndex(), AnotherMockModel: untracked}
+        stdout = StringIO()
+        call_command('rebuild_index', verbosity=1, interactive=False, using=["eng"], blue_green=True,
+                     batchsize=10, stdout=stdout)
+
+        self.assertFalse(mock_handle_clear.called)
+        # Objects deleted meanwhile are removed from the new copy before it's published.
+        self.assertEqual(backend.method_calls, [call.start_generation(),
+                                                call.scan([AnotherMockModel], batch_size=10),
+                                                call.remove_many(['core.anothermockmodel.999'], commit=True),
+                                                call.publish_generation()])
+        # A full update, then a catch-up with the changes made meanwhile, for
+        # the indexes with an updated field only.
+        self.assertEqual(mock_handle_update.call_count, 2)
+        self.assertIsNone(mock_handle_update.call_args_list[0][1]['start_date'])
+        catch_up_options = mock_handle_update.call_args_list[1][1]
+        self.assertEqual(catch_up_options['app_or_model'], ['core.mockmodel'])
+        self.assertTrue(catch_up_options['remove'])
+        self.assertLess(catch_up_options['start_date'], timezone.now() - datetime.timedelta(seconds=299))
+        self.assertIn("'core.anothermockmodel' has no updated field", stdout.getvalue())
+
+        # A failed update leaves searches on the current index.
+        backend.reset_mock()
+        mock_handle_update.side_effect = ValueError
+
+        with self.assertRaises(ValueError):
+            call_command('rebuild_index', verbosity=0, interactive=False, using=["eng"], blue_green=True)
+
+        self.assertEqual(backend.method_calls, [call.start_generation(), call.discard_generation()])
+
+    @patch("searchstack.loading.ConnectionHandler.__getitem__")
+    @patch("searchstack.management.commands.update_index.Command.update_backend")
+    def test_update_index_bulk_load(self, m1, m2):
+        backend = m2.return_value.get_backend.return_value
+        call_command('update_index', verbosity=0, using=["eng"], bulk_load=True)
+
+        self.assertEqual(backend.method_calls, [call.start_bulk_load(), call.finish_bulk_load()])
+        m1.assert_any_call("core", "eng")
+
+        # The backend's settings are restored even if the update fails.
+        backend.reset_mock()
+        m1.side_effect = ValueError
+
+        with self.assertRaises(ValueError):
+            call_command('update_index', verbosity=0, using=["eng"], bulk_load=True)
+
+        self.assertEqual(backend.method_calls, [call.start_bulk_load(), call.finish_bulk_load()])
+
+    def test_rebuild_index_blue_green_unsupported(self):
+        with self.assertRaises(CommandError):
+            call_command('rebuild_index', verbosity=0, interactive=False, using=["default"], blue_green=True)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_index', verbosity=0, interactive=False, using=["default"], blue_green=True,
+                         resume=True)
+
     @patch('searchstack.management.commands.update_index.Command.handle')
     @patch('searchstack.management.commands.clear_index.Command.handle')
     def test_rebuild_index_nocommit(self, *mocks):
@@ -108,3 +211,689 @@ class CoreManagementCommandsTestCase(TestCase):
 
             self.assertIn('interactive', kwargs)
             self.assertEqual(False, kwargs['interactive'])
+
+
+class KeysetUpdateIndexTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(KeysetUpdateIndexTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[KeysetMockSearchIndex()])
+        connections['default']._index = self.ui
+
+    def tearDown(self):
+        connections['default']._index = self.old_ui
+        super(KeysetUpdateIndexTestCase, self).tearDown()
+
+    @patch.object(MockSearchBackend, 'update')
+    def test_keyset_batches(self, mock_update):
+        with CaptureQueriesContext(connection) as captured:
+            call_command('update_index', 'core', using=['default'], batchsize=5, keyset=True, verbosity=0)
+
+        batches = [list(c[0][1]) for c in mock_update.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [5, 5, 5, 5, 3])
+
+        pks = [obj.pk for batch in batches for obj in batch]
+        self.assertEqual(pks, list(MockModel.objects.order_by('pk').values_list('pk', flat=True)))
+
+        for query in captured.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+
+    def test_queries_per_document(self):
+        stdout = StringIO()
+        call_command('update_index', 'core', using=['default'], batchsize=5, keyset=True, stdout=stdout)
+        # One query per batch.
+        self.assertIn('5 queries for 23 documents (0.22 per document).', stdout.getvalue())
+
+        stdout = StringIO()
+        call_command('update_index', 'core', using=['default'], batchsize=5, stdout=stdout)
+        self.assertIn('5 queries for 23 documents (0.22 per document).', stdout.getvalue())
+
+    def test_build_queryset_pk_range(self):
+        index = self.ui.get_index(MockModel)
+        pks = list(MockModel.objects.order_by('pk').values_list('pk', flat=True))
+
+        qs = index.build_queryset(after_pk=pks[4], until_pk=pks[9])
+        self.assertEqual([obj.pk for obj in qs], pks[5:10])
+
+        qs = index.build_queryset(after_pk=pks[-3])
+        self.assertEqual([obj.pk for obj in qs], pks[-2:])
+
+
+class PipelinedUpdateIndexTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(PipelinedUpdateIndexTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[KeysetMockSearchIndex()])
+        connections['default']._index = self.ui
+        connections['default'].get_backend().clear()
+
+    def tearDown(self):
+        connections['default'].get_backend().clear()
+        connections['default']._index = self.old_ui
+        super(PipelinedUpdateIndexTestCase, self).tearDown()
+
+    def expected_ids(self):
+        return set('core.mockmodel.%s' % pk for pk in MockModel.objects.values_list('pk', flat=True))
+
+    def test_pipeline(self):
+        stdout = StringIO()
+        call_command('update_index', 'core', using=['default'], batchsize=5, pipeline=True,
+                     prepare_workers=3, send_workers=2, queue_size=1, stdout=stdout)
+
+        self.assertEqual(set(mocks.MOCK_INDEX_DATA), self.expected_ids())
+        self.assertEqual(mocks.MOCK_INDEX_DATA['core.mockmodel.1']['author'], 'daniel1')
+
+        output = stdout.getvalue()
+        self.assertIn('read: 23 items in 5 batches', output)
+        self.assertIn('prepare: 23 items in 5 batches', output)
+        self.assertIn('send: 23 items in 5 batches', output)
+
+    def test_pipeline_keyset(self):
+        with CaptureQueriesContext(connection) as captured:
+            call_command('update_index', 'core', using=['default'], batchsize=5, pipeline=True,
+                         keyset=True, send_workers=2, verbosity=0)
+
+        self.assertEqual(set(mocks.MOCK_INDEX_DATA), self.expected_ids())
+
+        for query in captured.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+
+    @patch.object(MockSearchBackend, 'send_documents', side_effect=ValueError('boom'))
+    def test_pipeline_errors_are_raised(self, mock_send):
+        self.assertRaises(ValueError, call_command, 'update_index', 'core', using=['default'],
+                          batchsize=1, pipeline=True, queue_size=1, verbosity=0)
+        # The remaining batches are drained, not sent.
+        self.assertEqual(mock_send.call_count, 1)
+
+    def test_pipeline_excludes_workers(self):
+        self.assertRaises(CommandError, call_command, 'update_index', 'core', using=['default'],
+                          pipeline=True, workers=2, verbosity=0)
+
+
+class RemoveStaleTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(RemoveStaleTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[KeysetMockSearchIndex()])
+        connections['default']._index = self.ui
+        connections['default'].get_backend().clear()
+        call_command('update_index', 'core', using=['default'], verbosity=0)
+
+    def tearDown(self):
+        connections['default'].get_backend().clear()
+        connections['default']._index = self.old_ui
+        super(RemoveStaleTestCase, self).tearDown()
+
+    def test_remove_stale(self):
+        stale_pks = list(MockModel.objects.order_by('pk').values_list('pk', flat=True)[:3])
+        MockModel.objects.filter(pk__in=stale_pks).delete()
+        # Indexed, but never saved.
+        mocks.MOCK_INDEX_DATA['core.mockmodel.99999'] = {'django_ct': 'core.mockmodel', 'django_id': '99999'}
+
+        stdout = StringIO()
+
+        with CaptureQueriesContext(connection) as captured:
+            call_command('update_index', 'core', using=['default'], batchsize=5, remove=True, stdout=stdout)
+
+        self.assertEqual(set(mocks.MOCK_INDEX_DATA),
+                         set('core.mockmodel.%s' % pk for pk in MockModel.objects.values_list('pk', flat=True)))
+        self.assertIn('removed 4 stale records.', stdout.getvalue())
+
+        # The index is checked against the database a batch at a time.
+        lookups = [query['sql'] for query in captured.captured_queries if ' IN (' in query['sql']]
+        self.assertEqual(len(lookups), 5)
+
+    def test_nothing_stale(self):
+        stdout = StringIO()
+        call_command('update_index', 'core', using=['default'], remove=True, stdout=stdout)
+
+        self.assertEqual(len(mocks.MOCK_INDEX_DATA), MockModel.objects.count())
+        self.assertNotIn('stale', stdout.getvalue())
+
+
+class ResumeUpdateIndexTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(ResumeUpdateIndexTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[KeysetMockSearchIndex()])
+        connections['default']._index = self.ui
+        connections['default'].get_backend().clear()
+        self.pks = list(MockModel.objects.order_by('pk').values_list('pk', flat=True))
+        self.checkpoints = CheckpointStore()
+        self.checkpoints.start('default', 'core.mockmodel')
+
+    def tearDown(self):
+        self.checkpoints.start('default', 'core.mockmodel')
+        self.checkpoints.close()
+        connections['default'].get_backend().clear()
+        connections['default']._index = self.old_ui
+        super(ResumeUpdateIndexTestCase, self).tearDown()
+
+    def count_batches(self, crash_on=None):
+        # Every indexing path ends up in ``send_documents``.
+        original = MockSearchBackend.send_documents
+        calls = []
+
+        def send_documents(backend, index, documents, commit=True):
+            calls.append(None)
+
+            if len(calls) == crash_on:
+                raise IOError('The search engine went away.')
+
+            return original(backend, index, documents, commit=commit)
+
+        return calls, patch.object(MockSearchBackend, 'send_documents', send_documents)
+
+    def indexed_pks(self):
+        return sorted(int(doc['django_id']) for doc in mocks.MOCK_INDEX_DATA.values())
+
+    def run_resumable(self, **options):
+        calls, crashing = self.count_batches(crash_on=3)
+
+        with crashing:
+            self.assertRaises(IOError, call_command, 'update_index', 'core', using=['default'],
+                              batchsize=5, keyset=True, verbosity=0, **options)
+
+        self.assertEqual(self.indexed_pks(), self.pks[:10])
+        self.assertEqual(self.checkpoints.status('default', 'core.mockmodel'), False)
+
+        mocks.MOCK_INDEX_DATA.clear()
+        calls, counting = self.count_batches()
+
+        with counting:
+            call_command('update_index', 'core', using=['default'], batchsize=5, resume=True, verbosity=0,
+                         **options)
+
+        # Only the batches that weren't completed are indexed again.
+        self.assertEqual(self.indexed_pks(), self.pks[10:])
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.checkpoints.status('default', 'core.mockmodel'), True)
+
+    def test_resume(self):
+        self.run_resumable()
+
+        stdout = StringIO()
+        call_command('update_index', 'core', using=['default'], resume=True, stdout=stdout)
+        self.assertIn("Skipping '<class 'test_searchstack.core.models.MockModel'>' - already indexed.",
+                      stdout.getvalue())
+
+    def test_resume_pipeline(self):
+        self.run_resumable(pipeline=True)
+
+    def test_resume_gaps(self):
+        # Ranges completed out of order by workers; only the gaps remain.
+        self.checkpoints.complete('default', 'core.mockmodel', self.pks[4], self.pks[9])
+        self.checkpoints.complete('default', 'core.mockmodel', self.pks[14], self.pks[19])
+        call_command('update_index', 'core', using=['default'], batchsize=5, resume=True, verbosity=0)
+
+        self.assertEqual(self.indexed_pks(), self.pks[:5] + self.pks[10:15] + self.pks[20:])
+
+    def test_new_run_starts_over(self):
+        self.checkpoints.complete('default', 'core.mockmodel', None, self.pks[9])
+        call_command('update_index', 'core', using=['default'], batchsize=5, keyset=True, verbosity=0)
+
+        self.assertEqual(self.indexed_pks(), self.pks)
+
+    @patch('searchstack.management.commands.update_index.Command.handle')
+    @patch('searchstack.management.commands.clear_index.Command.handle')
+    def test_rebuild_index_resume(self, mock_handle_clear, mock_handle_update):
+        call_command('rebuild_index', interactive=False, resume=True)
+
+        self.assertFalse(mock_handle_clear.called)
+        self.assertTrue(mock_handle_update.called)
+
+
+class SinceLastRunTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(SinceLastRunTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[UpdatedMockSearchIndex()])
+        connections['default']._index = self.ui
+        connections['default'].get_backend().clear()
+        self.high_water_marks = HighWaterMarkStore()
+        self.high_water_marks.clear('default', 'core.mockmodel')
+
+    def tearDown(self):
+        self.high_water_marks.clear('default', 'core.mockmodel')
+        self.high_water_marks.close()
+        connections['default'].get_backend().clear()
+        connections['default']._index = self.old_ui
+        super(SinceLastRunTestCase, self).tearDown()
+
+    def update(self, **options):
+        mocks.MOCK_INDEX_DATA.clear()
+        call_command('update_index', 'core', using=['default'], since_last_run=True, verbosity=0, **options)
+        return sorted(int(doc['django_id']) for doc in mocks.MOCK_INDEX_DATA.values())
+
+    def test_since_last_run(self):
+        newest = MockModel.objects.order_by('-pub_date')[0]
+
+        # The first run indexes everything & remembers the newest object.
+        self.assertEqual(len(self.update()), MockModel.objects.count())
+        self.assertEqual(self.high_water_marks.get('default', 'core.mockmodel'), newest.pub_date.isoformat())
+
+        # Only the newest object is within the overlap.
+        self.assertEqual(self.update(), [newest.pk])
+
+        edited = MockModel.objects.order_by('pub_date')[0]
+        edited.pub_date = newest.pub_date + datetime.timedelta(hours=1)
+        edited.save()
+
+        self.assertEqual(self.update(overlap=0), sorted([newest.pk, edited.pk]))
+        self.assertEqual(self.high_water_marks.get('default', 'core.mockmodel'), edited.pub_date.isoformat())
+
+        # A longer overlap reaches further back.
+        self.assertEqual(len(self.update(overlap=3 * 60 * 60)), 4)
+
+    def test_since_last_run_keyset(self):
+        self.update(keyset=True)
+        self.assertEqual(len(self.update(keyset=True, overlap=60 * 60)), 2)
+
+    def test_failed_run_keeps_mark(self):
+        self.update()
+        mark = self.high_water_marks.get('default', 'core.mockmodel')
+        MockModel.objects.update(pub_date=datetime.datetime(2020, 1, 1))
+
+        with patch.object(MockSearchBackend, 'update', side_effect=IOError):
+            self.assertRaises(IOError, self.update)
+
+        self.assertEqual(self.high_water_marks.get('default', 'core.mockmodel'), mark)
+
+    def test_excludes_dates(self):
+        self.assertRaises(CommandError, call_command, 'update_index', 'core', using=['default'],
+                          since_last_run=True, age=2, verbosity=0)
+
+
+class SkipUnchangedTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(SkipUnchangedTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[KeysetMockSearchIndex()])
+        connections['default']._index = self.ui
+        self.old_backend = connections['default'].get_backend()
+        self.backend = MockSearchBackend('default', SKIP_UNCHANGED=True)
+        connections['default']._backend = self.backend
+        self.backend.clear()
+        self.sent = []
+        send_documents = self.backend.send_documents
+
+        def record_sent(index, documents, commit=True):
+            documents = list(documents)
+            self.sent.extend(doc['id'] for doc in documents)
+            return send_documents(index, documents, commit=commit)
+
+        patch.object(self.backend, 'send_documents', side_effect=record_sent).start()
+
+    def tearDown(self):
+        patch.stopall()
+        self.backend.clear()
+        self.backend.digests.close()
+        connections['default']._backend = self.old_backend
+        connections['default']._index = self.old_ui
+        super(SkipUnchangedTestCase, self).tearDown()
+
+    def update(self, **options):
+        self.sent = []
+        stdout = StringIO()
+        call_command('update_index', 'core', using=['default'], batchsize=10, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_skip_unchanged(self):
+        output = self.update()
+        self.assertEqual(len(self.sent), 23)
+        self.assertIn('skipped 0 unchanged documents (0 bytes, 0 requests not sent).', output)
+
+        MockModel.objects.filter(pk=1).update(author='someone else')
+        output = self.update()
+        self.assertEqual(self.sent, ['core.mockmodel.1'])
+        self.assertEqual(mocks.MOCK_INDEX_DATA['core.mockmodel.1']['author'], 'someone else')
+        self.assertIn('skipped 22 unchanged documents', output)
+        # Only the batch with the changed document was sent.
+        self.assertIn('2 requests not sent', output)
+
+    def test_skip_unchanged_pipeline(self):
+        self.update(pipeline=True, verbosity=0)
+        self.update(pipeline=True, verbosity=0)
+        self.assertEqual(self.sent, [])
+
+    def test_removed_documents_are_sent_again(self):
+        self.update(verbosity=0)
+        self.backend.remove_many(['core.mockmodel.1', 'core.mockmodel.2'])
+        self.backend.remove('core.mockmodel.3')
+
+        self.update(verbosity=0)
+        self.assertEqual(sorted(self.sent), ['core.mockmodel.1', 'core.mockmodel.2', 'core.mockmodel.3'])
+
+        self.backend.clear(models=[MockModel])
+        self.update(verbosity=0)
+        self.assertEqual(len(self.sent), 23)
+
+    def test_failed_documents_are_sent_again(self):
+        self.backend.send_documents.side_effect = lambda index, documents, commit=True: [
+            (doc['id'], 'rejected') for doc in documents if doc['id'] == 'core.mockmodel.1']
+        self.update(verbosity=0)
+        self.backend.send_documents.reset_mock()
+        self.backend.send_documents.side_effect = None
+        self.backend.send_documents.return_value = []
+
+        self.update(verbosity=0)
+        self.assertEqual(self.backend.send_documents.call_count, 1)
+        self.assertEqual([doc['id'] for doc in self.backend.send_documents.call_args[0][1]], ['core.mockmodel.1'])
+
+
+class ProcessIndexQueueTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(ProcessIndexQueueTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[KeysetMockSearchIndex()])
+        connections['default']._index = self.ui
+        self.backend = connections['default'].get_backend()
+        self.backend.clear()
+        self.backend.update(self.ui.get_index(MockModel), MockModel.objects.filter(pk__in=[3, 4]))
+        self.queue = IndexQueue()
+        self.queue.clear()
+
+    def tearDown(self):
+        patch.stopall()
+        self.queue.clear()
+        self.queue.close()
+        self.backend.clear()
+        connections['default']._index = self.old_ui
+        super(ProcessIndexQueueTestCase, self).tearDown()
+
+    def process(self, **options):
+        stdout = StringIO()
+        call_command('process_index_queue', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_process(self):
+        MockModel.objects.filter(pk=1).update(author='someone else')
+        self.queue.put_many([
+            ('update', 'core.mockmodel', 1, 'default'),
+            ('update', 'core.mockmodel', 2, 'default'),
+            ('delete', 'core.mockmodel', 3, 'default'),
+            ('update', 'core.mockmodel', 1, 'default'),
+            # Gone by the time the queue is processed.
+            ('update', 'core.mockmodel', 999, 'default'),
+            # Deleted, then re-created.
+            ('delete', 'core.mockmodel', 4, 'default'),
+            ('update', 'core.mockmodel', 4, 'default'),
+        ])
+        update = patch.object(self.backend, 'update', wraps=self.backend.update).start()
+
+        output = self.process()
+
+        # Repeated entries are merged into a single request.
+        self.assertEqual(update.call_count, 1)
+        self.assertEqual(sorted(obj.pk for obj in update.call_args[0][1]), [1, 2, 4])
+        self.assertEqual(sorted(mocks.MOCK_INDEX_DATA),
+                         ['core.mockmodel.1', 'core.mockmodel.2', 'core.mockmodel.4'])
+        self.assertEqual(mocks.MOCK_INDEX_DATA['core.mockmodel.1']['author'], 'someone else')
+        self.assertEqual(self.queue.counts(), (0, 0))
+        self.assertIn('Updated 3 & removed 2 documents, retried 0 & parked 0 entries.', output)
+
+    def test_workers(self):
+        self.queue.put_many([('delete', 'core.mockmodel', pk, 'default') for pk in range(1, 24)])
+        remove_many = patch.object(self.backend, 'remove_many').start()
+
+        self.process(workers=3, batchsize=5, verbosity=0)
+
+        removed = [doc_id for call_args in remove_many.call_args_list for doc_id in call_args[0][0]]
+        self.assertEqual(sorted(removed), sorted('core.mockmodel.%s' % pk for pk in range(1, 24)))
+        self.assertEqual(remove_many.call_count, 5)
+        self.assertEqual(self.queue.counts(), (0, 0))
+
+    def test_retry_and_park(self):
+        self.queue.put_many([('update', 'core.mockmodel', 1, 'default')])
+        error = IOError('The search engine went away.')
+        update = patch.object(self.backend, 'update', side_effect=error).start()
+        patch.object(logging.getLogger('searchstack'), 'exception').start()
+
+        output = self.process(max_attempts=3, backoff=60)
+        self.assertIn('retried 1 & parked 0 entries.', output)
+        self.assertIn('1 entries pending, 0 parked.', output)
+
+        # Not retried before its backoff has passed.
+        self.process(max_attempts=3, backoff=60)
+        self.assertEqual(update.call_count, 1)
+
+        # Once it's due, it's retried & parked after the last attempt.
+        with self.queue.db as db:
+            db.execute('UPDATE index_queue SET available = 0')
+
+        output = self.process(max_attempts=3, backoff=0)
+        self.assertEqual(update.call_count, 3)
+        self.assertIn('retried 1 & parked 1 entries.', output)
+        self.assertEqual(self.queue.counts(), (0, 1))
+
+    def test_failed_documents_are_retried(self):
+        self.queue.put_many([('update', 'core.mockmodel', pk, 'default') for pk in (1, 2)])
+        patch.object(self.backend, 'update', return_value=[('core.mockmodel.1', 'rejected')]).start()
+
+        output = self.process(backoff=60)
+        self.assertIn('Updated 1 & removed 0 documents, retried 1 & parked 0 entries.', output)
+        self.assertEqual(self.queue.counts(), (1, 0))
+
+    def test_custom_identifiers(self):
+        self.queue.put_many([('update', 'core.mockmodel', 1, 'default'),
+                             ('delete', 'core.mockmodel', 3, 'default')])
+        patch('searchstack.management.commands.process_index_queue.get_identifier',
+              side_effect=lambda obj: 'custom-%s' % obj.pk).start()
+        patch.object(self.backend, 'update', return_value=[('custom-1', 'rejected')]).start()
+        remove_many = patch.object(self.backend, 'remove_many').start()
+
+        output = self.process(backoff=60)
+        self.assertEqual(remove_many.call_args[0][0], ['custom-3'])
+        self.assertIn('Updated 0 & removed 1 documents, retried 1 & parked 0 entries.', output)
+
+    def test_requires_absolute_state_file(self):
+        with override_settings(SEARCHSTACK_STATE_FILE='searchstack_state.sqlite3'):
+            self.assertRaises(CommandError, self.process)
+
+    def test_lease(self):
+        self.queue.put_many([('update', 'core.mockmodel', pk, 'default') for pk in (1, 2)])
+        held = self.queue.claim(1, 60)
+
+        # Nothing else is handed out for an object that's held.
+        self.queue.put_many([('update', 'core.mockmodel', 1, 'default')])
+        self.assertEqual([entry[3] for entry in self.queue.claim(10, 60)], ['2'])
+
+        # Until the lease runs out.
+        self.queue.claim(10, 60)
+        self.queue.retry([held[0][0]], 0, 0)
+        self.assertEqual(len(self.queue.claim(10, 60)), 2)
+
+
+class RetryTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(RetryTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.index = KeysetMockSearchIndex()
+        self.ui.build(indexes=[self.index])
+        connections['default']._index = self.ui
+        self.old_backend = connections['default'].get_backend()
+        self.backend = MockSearchBackend('default', RETRIES=2, DEAD_LETTERS=True)
+        connections['default']._backend = self.backend
+        self.backend.clear()
+        self.dead_letters = DeadLetterStore()
+        self.dead_letters.clear('default')
+        self.sleep = patch('searchstack.backends.sleep').start()
+        patch.object(self.backend.log, 'warning').start()
+        self.sent = []
+        # The ids to fail on each attempt; the last entry keeps being used.
+        self.failing = [set()]
+        send_documents = self.backend.send_documents
+
+        def failing_send(index, documents, commit=True):
+            documents = list(documents)
+            failing = self.failing.pop(0) if len(self.failing) > 1 else self.failing[0]
+            self.sent.append(sorted(doc['id'] for doc in documents))
+            send_documents(index, [doc for doc in documents if doc['id'] not in failing], commit=commit)
+            return [(doc['id'], 'rejected') for doc in documents if doc['id'] in failing]
+
+        patch.object(self.backend, 'send_documents', side_effect=failing_send).start()
+
+    def tearDown(self):
+        patch.stopall()
+        self.backend.clear()
+        self.dead_letters.clear('default')
+        self.dead_letters.close()
+        connections['default']._backend = self.old_backend
+        connections['default']._index = self.old_ui
+        super(RetryTestCase, self).tearDown()
+
+    def test_retries_failed_documents(self):
+        self.failing = [set(['core.mockmodel.1', 'core.mockmodel.2']), set(['core.mockmodel.2']), set()]
+        failures = self.backend.update(self.index, MockModel.objects.filter(pk__in=[1, 2, 3]))
+
+        # Only the documents that failed are sent again, after a growing delay.
+        self.assertEqual(failures, [])
+        self.assertEqual(self.sent, [['core.mockmodel.1', 'core.mockmodel.2', 'core.mockmodel.3'],
+                                     ['core.mockmodel.1', 'core.mockmodel.2'], ['core.mockmodel.2']])
+        self.assertEqual(self.sleep.call_count, 2)
+        self.assertTrue(0.5 <= self.sleep.call_args_list[0][0][0] <= 1)
+        self.assertTrue(1 <= self.sleep.call_args_list[1][0][0] <= 2)
+        self.assertEqual(sorted(mocks.MOCK_INDEX_DATA),
+                         ['core.mockmodel.1', 'core.mockmodel.2', 'core.mockmodel.3'])
+        self.assertEqual(self.dead_letters.get_all('default'), [])
+
+    def test_dead_letters(self):
+        self.failing = [set(['core.mockmodel.1', 'core.mockmodel.2'])]
+        failures = self.backend.update(self.index, MockModel.objects.filter(pk__in=[1, 2, 3]))
+
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(failures, [('core.mockmodel.1', 'rejected'), ('core.mockmodel.2', 'rejected')])
+        self.assertEqual(self.dead_letters.get_all('default'), [
+            ('core.mockmodel.1', 'core.mockmodel', '1', 'rejected'),
+            ('core.mockmodel.2', 'core.mockmodel', '2', 'rejected'),
+        ])
+
+        MockModel.objects.filter(pk=2).delete()
+        self.failing = [set()]
+        self.sent = []
+        stdout = StringIO()
+        call_command('replay_dead_letters', using=['default'], stdout=stdout)
+
+        self.assertEqual(self.sent, [['core.mockmodel.1']])
+        self.assertEqual(sorted(mocks.MOCK_INDEX_DATA), ['core.mockmodel.1', 'core.mockmodel.3'])
+        self.assertEqual(self.dead_letters.get_all('default'), [])
+        self.assertIn("Replayed the dead letters of 'default': 1 documents indexed, 1 removed & 0 still "
+                      "failing.", stdout.getvalue())
+
+    def test_replay_failures_are_kept(self):
+        self.failing = [set(['core.mockmodel.1'])]
+        self.backend.update(self.index, MockModel.objects.filter(pk__in=[1, 2]))
+
+        call_command('replay_dead_letters', using=['default'], verbosity=0)
+        self.assertEqual([letter[0] for letter in self.dead_letters.get_all('default')], ['core.mockmodel.1'])
+
+        call_command('replay_dead_letters', using=['default'], discard=True, verbosity=0)
+        self.assertEqual(self.dead_letters.get_all('default'), [])
+
+    def test_raises_after_retries(self):
+        self.backend.silently_fail = False
+        error = IndexingError('Rejected.', [('core.mockmodel.1', 'rejected')])
+        self.backend.send_documents.side_effect = error
+
+        with self.assertRaises(IndexingError):
+            self.backend.update(self.index, MockModel.objects.filter(pk__in=[1, 2]))
+
+        self.assertEqual(self.backend.send_documents.call_count, 3)
+        self.assertEqual([len(call_args[0][1]) for call_args in self.backend.send_documents.call_args_list],
+                         [2, 1, 1])
+        self.assertEqual([letter[0] for letter in self.dead_letters.get_all('default')], ['core.mockmodel.1'])
+
+
+class FanOutUpdateIndexTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(FanOutUpdateIndexTestCase, self).setUp()
+        mirror = {'ENGINE': 'test_searchstack.mocks.MockEngine'}
+        patch.dict(connections.connections_info, {'mirror': mirror}).start()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[KeysetMockSearchIndex()])
+        connections['default']._index = self.ui
+        connections['mirror']._index = self.ui
+        self.sent = []
+
+        for alias in ('default', 'mirror'):
+            backend = connections[alias].get_backend()
+            record = self.recorder(alias, backend.send_prepared)
+            patch.object(backend, 'send_prepared', side_effect=record).start()
+
+        full_prepare = KeysetMockSearchIndex.full_prepare
+        self.full_prepare = patch.object(KeysetMockSearchIndex, 'full_prepare', autospec=True,
+                                         side_effect=lambda index, obj: full_prepare(index, obj)).start()
+
+    def tearDown(self):
+        patch.stopall()
+        connections['default'].get_backend().clear()
+        connections._connections.pop('mirror', None)
+        connections['default']._index = self.old_ui
+        super(FanOutUpdateIndexTestCase, self).tearDown()
+
+    def recorder(self, alias, send_prepared):
+        def record(index, documents, commit=True):
+            documents = list(documents)
+            self.sent.append((alias, threading.current_thread().name, [doc['id'] for doc in documents]))
+            return send_prepared(index, documents, commit=commit)
+
+        return record
+
+    def test_fan_out(self):
+        stdout = StringIO()
+        call_command('update_index', 'core', using=['default', 'mirror'], batchsize=10, fan_out=True,
+                     stdout=stdout)
+
+        # Each object is prepared once & sent to both backends, from
+        # different threads.
+        self.assertEqual(self.full_prepare.call_count, 23)
+        self.assertEqual([len(ids) for alias, thread, ids in self.sent if alias == 'default'], [10, 10, 3])
+        self.assertEqual([ids for alias, thread, ids in self.sent if alias == 'default'],
+                         [ids for alias, thread, ids in self.sent if alias == 'mirror'])
+        self.assertEqual(len(set(thread for alias, thread, ids in self.sent)), 4)
+        self.assertIn("sending to 'default', 'mirror' at once.", stdout.getvalue())
+        self.assertEqual(stdout.getvalue().count('Indexing 23 mock models'), 1)
+
+    def test_without_fan_out(self):
+        call_command('update_index', 'core', using=['default', 'mirror'], batchsize=10, verbosity=0)
+        self.assertEqual(self.full_prepare.call_count, 46)
+
+    def test_different_indexes(self):
+        ui = UnifiedIndex()
+        ui.build(indexes=[UpdatedMockSearchIndex()])
+        connections['mirror']._index = ui
+
+        call_command('update_index', 'core', using=['default', 'mirror'], batchsize=10, fan_out=True,
+                     verbosity=0)
+        self.assertEqual(sorted(set(alias for alias, thread, ids in self.sent)), ['default', 'mirror'])
+        self.assertEqual(len(set(thread for alias, thread, ids in self.sent)), 1)
+
+    def test_fan_out_excludes_workers(self):
+        self.assertRaises(CommandError, call_command, 'update_index', 'core', fan_out=True, workers=2)
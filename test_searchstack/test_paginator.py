@@ -0,0 +1,121 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import datetime
+
+from django.core.paginator import EmptyPage
+from django.test import TestCase
+from mock import patch
+
+from searchstack import connections
+from searchstack.exceptions import CursorError
+from searchstack.paginator import CursorPaginator, SearchPaginator
+from searchstack.query import SearchQuerySet
+from searchstack.utils.loading import UnifiedIndex
+
+from .core.models import MockModel
+from .mocks import MockSearchResult
+from .test_views import BasicMockModelSearchIndex
+
+
+class SearchPaginatorTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(SearchPaginatorTestCase, self).setUp()
+        self.old_unified_index = connections['default']._index
+        self.ui = UnifiedIndex()
+        self.bmmsi = BasicMockModelSearchIndex()
+        self.ui.build(indexes=[self.bmmsi])
+        connections['default']._index = self.ui
+
+        self.backend = connections['default'].get_backend()
+        self.backend.clear()
+        self.backend.update(self.bmmsi, MockModel.objects.all())
+        self.search = patch.object(self.backend, 'search', wraps=self.backend.search).start()
+
+    def tearDown(self):
+        patch.stopall()
+        connections['default']._index = self.old_unified_index
+        super(SearchPaginatorTestCase, self).tearDown()
+
+    def test_single_search(self):
+        sqs = SearchQuerySet()
+        paginator = SearchPaginator(sqs, 10)
+        page = paginator.page(2)
+
+        self.assertEqual([int(result.pk) for result in page.object_list], list(range(11, 21)))
+        self.assertEqual(paginator.count, 23)
+        self.assertEqual(paginator.num_pages, 3)
+        sqs.facet_counts()
+        self.assertEqual(self.search.call_count, 1)
+        self.assertEqual(self.search.call_args[1]['start_offset'], 10)
+        self.assertEqual(self.search.call_args[1]['end_offset'], 20)
+
+    def test_orphans(self):
+        paginator = SearchPaginator(SearchQuerySet(), 10, orphans=3)
+        self.assertEqual(len(paginator.page(2).object_list), 13)
+        self.assertEqual(self.search.call_count, 1)
+
+    def test_invalid_page(self):
+        paginator = SearchPaginator(SearchQuerySet(), 10)
+        self.assertRaises(EmptyPage, paginator.page, 4)
+        self.assertRaises(EmptyPage, paginator.page, 0)
+
+    def test_list(self):
+        paginator = SearchPaginator(list(range(23)), 10)
+        self.assertEqual(paginator.page(3).object_list, [20, 21, 22])
+
+
+class CursorPaginatorTestCase(TestCase):
+    fixtures = ['bulk_data.json']
+
+    def setUp(self):
+        super(CursorPaginatorTestCase, self).setUp()
+        self.old_unified_index = connections['default']._index
+        self.ui = UnifiedIndex()
+        self.bmmsi = BasicMockModelSearchIndex()
+        self.ui.build(indexes=[self.bmmsi])
+        connections['default']._index = self.ui
+
+        self.backend = connections['default'].get_backend()
+        self.backend.clear()
+        self.backend.update(self.bmmsi, MockModel.objects.all())
+        self.search = patch.object(self.backend, 'search', wraps=self.backend.search).start()
+
+    def tearDown(self):
+        patch.stopall()
+        connections['default']._index = self.old_unified_index
+        super(CursorPaginatorTestCase, self).tearDown()
+
+    def test_pages(self):
+        # The mock results have no stored fields to make the cursor from.
+        patch.object(MockSearchResult, 'pub_date', datetime.datetime(2009, 7, 6), create=True).start()
+        paginator = CursorPaginator(SearchQuerySet().order_by('-pub_date'), 10)
+        page = paginator.page()
+
+        self.assertEqual(len(page), 10)
+        self.assertEqual(paginator.count, 23)
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+        self.assertEqual(self.search.call_count, 1)
+        self.assertEqual(self.search.call_args[1]['sort_by'], ['-pub_date', 'django_ct', 'django_id'])
+
+        # The next page starts from the first result, after the last one.
+        page = paginator.page(page.next_cursor)
+        self.assertTrue(page.has_previous())
+        self.assertEqual(self.search.call_count, 2)
+        self.assertEqual(self.search.call_args[1]['start_offset'], 0)
+        self.assertEqual(self.search.call_args[1]['end_offset'], 10)
+
+    def test_last_page(self):
+        paginator = CursorPaginator(SearchQuerySet(), 30)
+        page = paginator.page()
+        self.assertEqual(len(page), 23)
+        self.assertFalse(page.has_next())
+        self.assertIsNone(page.next_cursor)
+
+    def test_invalid_cursor(self):
+        paginator = CursorPaginator(SearchQuerySet(), 10)
+        self.assertRaises(CursorError, paginator.page, 'nope')
+        self.assertFalse(self.search.called)
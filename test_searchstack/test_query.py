@@ -3,12 +3,16 @@ from __future__ import unicode_literals
 
 import datetime
 
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 from django.test.utils import override_settings
+from mock import patch
 
 from searchstack import connections, indexes, reset_search_queries
 from searchstack.backends import SQ, BaseSearchQuery
-from searchstack.exceptions import FacetingError
+from searchstack.exceptions import CursorError, FacetingError, SearchFieldError
 from searchstack.models import SearchResult
 from searchstack.query import (EmptySearchQuerySet, SearchQuerySet, ValuesListSearchQuerySet,
                                ValuesSearchQuerySet)
@@ -324,6 +328,15 @@ class CharPKMockModelSearchIndex(indexes.SearchIndex, indexes.Indexable):
         return CharPKMockModel
 
 
+class CursorMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
+    text = indexes.TextField(document=True, use_template=True)
+    author = indexes.TextField(model_attr='author', faceted=True)
+    pub_date = indexes.DateTimeField(model_attr='pub_date')
+
+    def get_model(self):
+        return MockModel
+
+
 @override_settings(DEBUG=True)
 class SearchQuerySetTestCase(TestCase):
     fixtures = ['initial_data.json', 'bulk_data.json']
@@ -414,6 +427,62 @@ class SearchQuerySetTestCase(TestCase):
 
         connections['default']._index = old_ui
 
+    def test_iterator(self):
+        results = self.msqs.all()
+        len(results)
+        reset_search_queries()
+
+        check = [result.pk for result in results.iterator(chunk_size=10)]
+        self.assertEqual(check, [str(pk) for pk in range(1, 24)])
+        offsets = [(query['additional_kwargs']['start_offset'], query['additional_kwargs']['end_offset'])
+                   for query in connections['default'].queries]
+        self.assertEqual(offsets, [(0, 10), (10, 20), (20, 30)])
+        # Nothing is cached.
+        self.assertEqual(results._result_cache, [])
+
+        # Objects are loaded a chunk at a time.
+        loaded = list(self.msqs.load_all().iterator(chunk_size=10))
+        self.assertEqual([result.object.pk for result in loaded], list(range(1, 24)))
+
+        self.assertEqual(list(self.msqs.values_list('pk', flat=True).iterator()),
+                         [str(pk) for pk in range(1, 24)])
+        self.assertEqual(list(self.msqs.none().iterator()), [])
+
+    def test_after(self):
+        sqs = self.msqs.order_by('-pub_date').after()
+        self.assertEqual(sqs.query.order_by, ['-pub_date', 'django_ct', 'django_id'])
+        self.assertEqual(sqs.query.search_after, [])
+
+        pub_date = datetime.datetime(2009, 7, 6, 1, 56, 21)
+        cursor = sqs.cursor(SearchResult('core', 'mockmodel', '3', 1.0, pub_date=pub_date))
+        self.assertEqual(sqs.after(cursor).query.search_after,
+                         [('-pub_date', pub_date), ('django_ct', 'core.mockmodel'), ('django_id', '3')])
+        # Ordering by the tie-breakers already tells the results apart.
+        sqs = self.msqs.order_by('-django_id', 'django_ct', 'pub_date').after()
+        self.assertEqual(sqs.query.cursor_fields(), ['-django_id', 'django_ct'])
+
+        self.assertRaises(CursorError, sqs.after, 'nope')
+        self.assertRaises(CursorError, sqs.after, cursor[:-1])
+        self.assertRaises(CursorError, self.msqs.order_by('pub_date').after, cursor)
+
+    def test_cursor_missing_values(self):
+        sqs = self.msqs.order_by('-pub_date').after()
+        # Whether the field isn't stored or the object has no value for it.
+        self.assertRaises(SearchFieldError, sqs.cursor, SearchResult('core', 'mockmodel', '3', 1.0))
+        self.assertRaises(SearchFieldError, sqs.cursor,
+                          SearchResult('core', 'mockmodel', '3', 1.0, pub_date=None))
+
+    def test_after_analyzed_fields(self):
+        ui = UnifiedIndex()
+        ui.build(indexes=[CursorMockSearchIndex()])
+        connections['default']._index = ui
+
+        # A range or exact match on an analyzed field only tests its terms.
+        self.assertRaises(SearchFieldError, self.msqs.order_by('-author').after)
+        self.assertRaises(SearchFieldError, self.msqs.order_by('pub_date', 'text').after)
+        self.assertEqual(self.msqs.order_by('author_exact', 'pub_date').after().query.order_by,
+                         ['author_exact', 'pub_date', 'django_ct', 'django_id'])
+
     def test_fill_cache(self):
         reset_search_queries()
         self.assertEqual(len(connections['default'].queries), 0)
@@ -783,6 +852,153 @@ class SearchQuerySetTestCase(TestCase):
         self.assertEqual(repr(sqs.query.query_filter.children[1]), repr(sqs2.query.query_filter))
 
 
+class ResultCacheTestCase(TestCase):
+    fixtures = ['initial_data.json']
+
+    def setUp(self):
+        super(ResultCacheTestCase, self).setUp()
+        self.old_unified_index = connections['default']._index
+        self.ui = UnifiedIndex()
+        self.bmmsi = BasicMockModelSearchIndex()
+        self.ui.build(indexes=[self.bmmsi])
+        connections['default']._index = self.ui
+
+        self.backend = connections['default'].get_backend()
+        self.backend.clear()
+        self.backend.update(self.bmmsi, MockModel.objects.all())
+        caches['default'].clear()
+        patch.dict(self.backend.result_cache_stats, {'hits': 0, 'misses': 0}).start()
+        patch.object(self.backend, 'track_writes', True).start()
+        self.search = patch.object(self.backend, 'search', wraps=self.backend.search).start()
+
+    def tearDown(self):
+        patch.stopall()
+        caches['default'].clear()
+        connections['default']._index = self.old_unified_index
+        super(ResultCacheTestCase, self).tearDown()
+
+    def test_disabled_by_default(self):
+        self.assertEqual(len(SearchQuerySet().filter(content='foo')), 3)
+        self.assertEqual(len(SearchQuerySet().filter(content='foo')), 3)
+        self.assertEqual(self.search.call_count, 2)
+        self.assertEqual(self.backend.result_cache_stats, {'hits': 0, 'misses': 0})
+
+    def test_no_cache_calls_when_disabled(self):
+        self.backend.track_writes = False
+        caches = patch('searchstack.utils.generations.caches').start()
+        self.backend.update(self.bmmsi, MockModel.objects.all()[:1])
+        self.backend.remove_many(['core.mockmodel.1'])
+        self.backend.clear(models=[MockModel])
+        len(SearchQuerySet().filter(content='foo'))
+        self.assertEqual(caches.mock_calls, [])
+
+    def test_cache(self):
+        sqs = SearchQuerySet().filter(content='foo').cache(ttl=60)
+        self.assertEqual([result.pk for result in sqs], ['1', '2', '3'])
+        misses = self.backend.result_cache_stats['misses']
+
+        # Identical searches are answered from the cache, with results which
+        # survived pickling.
+        results = [result for result in SearchQuerySet().filter(content='foo').cache(ttl=60)]
+        self.assertEqual([result.pk for result in results], ['1', '2', '3'])
+        self.assertTrue(all(isinstance(result, SearchResult) for result in results))
+        self.assertEqual(results[0].object.pk, 1)
+        self.assertEqual(self.backend.result_cache_stats, {'hits': misses, 'misses': misses})
+        self.assertEqual(self.search.call_count, misses)
+
+        # Different searches aren't.
+        len(SearchQuerySet().filter(content='bar').cache(ttl=60))
+        self.assertEqual(self.backend.result_cache_stats['misses'], misses + 1)
+
+        # Nor are those that don't use it.
+        len(SearchQuerySet().filter(content='foo').cache(ttl=0))
+        self.assertEqual(self.search.call_count, misses + 2)
+
+    def test_connection_default(self):
+        patch.object(self.backend, 'result_cache_ttl', 60).start()
+        len(SearchQuerySet().filter(content='foo'))
+        len(SearchQuerySet().filter(content='foo'))
+        self.assertEqual(self.backend.result_cache_stats, {'hits': 1, 'misses': 1})
+
+        len(SearchQuerySet().filter(content='foo').cache(ttl=0))
+        self.assertEqual(self.search.call_count, 2)
+
+    def test_cache_timeout(self):
+        cache = caches['default']
+        set_ = patch.object(cache, 'set', wraps=cache.set).start()
+        len(SearchQuerySet().filter(content='foo').cache())
+        self.assertEqual(set_.call_args[0][2], DEFAULT_TIMEOUT)
+
+        # A cache without expiry keeps the results until they're invalidated.
+        cache.clear()
+        patch.object(cache, 'default_timeout', None).start()
+        len(SearchQuerySet().filter(content='foo').cache())
+        self.assertIsNone(cache.get_backend_timeout(set_.call_args[0][2]))
+        calls = self.search.call_count
+        len(SearchQuerySet().filter(content='foo').cache())
+        self.assertEqual(self.search.call_count, calls)
+
+        cache.clear()
+        len(SearchQuerySet().filter(content='foo').cache(ttl=None))
+        self.assertIsNone(set_.call_args[0][2])
+
+    def test_requires_write_tracking(self):
+        self.backend.track_writes = False
+        self.assertRaises(ImproperlyConfigured, SearchQuerySet().cache, ttl=60)
+        self.assertRaises(ImproperlyConfigured, SearchQuerySet().write_generation)
+        # Not caching is fine.
+        self.assertEqual(len(SearchQuerySet().filter(content='foo').cache(ttl=0)), 3)
+
+    def test_writes_from_other_processes(self):
+        sqs = SearchQuerySet().models(MockModel).cache(ttl=60)
+        len(sqs._clone())
+
+        # A backend that never read a generation, like that of update_index.
+        writer = type(self.backend)('default', WRITE_GENERATIONS=True)
+        writer.remove_many(['core.mockmodel.1'])
+
+        self.assertEqual(len(sqs._clone()), 2)
+        self.assertEqual(self.backend.result_cache_stats, {'hits': 0, 'misses': 2})
+
+    def test_write_generations(self):
+        sqs = SearchQuerySet().models(MockModel)
+        generation = sqs.write_generation()
+        self.assertEqual(sqs.write_generation(), generation)
+
+        # Only writes to the model's documents change it.
+        self.backend.remove_many(['core.anothermockmodel.1'])
+        self.assertEqual(sqs.write_generation(), generation)
+
+        for write in (lambda: self.backend.update(self.bmmsi, MockModel.objects.all()[:1]),
+                      lambda: self.backend.remove_many(['core.mockmodel.1']),
+                      lambda: self.backend.clear(models=[MockModel]),
+                      lambda: self.backend.clear()):
+            write()
+            self.assertNotEqual(sqs.write_generation(), generation)
+            generation = sqs.write_generation()
+
+    def test_invalidation(self):
+        sqs = SearchQuerySet().models(MockModel).cache(ttl=60)
+        len(sqs._clone())
+        len(sqs._clone())
+        self.assertEqual(self.backend.result_cache_stats, {'hits': 1, 'misses': 1})
+
+        self.backend.remove_many(['core.anothermockmodel.1'])
+        len(sqs._clone())
+        self.assertEqual(self.backend.result_cache_stats, {'hits': 2, 'misses': 1})
+
+        self.backend.remove_many(['core.mockmodel.1'])
+        self.assertEqual(len(sqs._clone()), 2)
+        self.assertEqual(self.backend.result_cache_stats, {'hits': 2, 'misses': 2})
+
+    def test_key_normalization(self):
+        key = self.backend.result_cache_key
+        self.assertEqual(key('foo', {'models': {MockModel, AnotherMockModel}, 'narrow_queries': {'a', 'b'}}),
+                         key('foo', {'narrow_queries': {'b', 'a'}, 'models': {AnotherMockModel, MockModel}}))
+        self.assertNotEqual(key('foo', {'models': {MockModel}}), key('foo', {'models': {AnotherMockModel}}))
+        self.assertNotEqual(key('foo', {'result_class': SearchResult}), key('foo', {}))
+
+
 class ValuesQuerySetTestCase(SearchQuerySetTestCase):
     def test_values_sqs(self):
         sqs = self.msqs.auto_query("test").values("id")
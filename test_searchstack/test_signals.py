@@ -0,0 +1,352 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from searchstack import connection_router, connections, indexes
+from searchstack.signals import BatchingSignalProcessor, QueuedSignalProcessor, RealtimeSignalProcessor
+from searchstack.utils.loading import UnifiedIndex
+from searchstack.utils.state import IndexQueue
+
+from .core.models import AnotherMockModel, MockModel, MockTag
+
+
+class BatchingMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
+    text = indexes.CharField(document=True, model_attr='author')
+    foo = indexes.CharField(model_attr='foo')
+
+    def get_model(self):
+        return MockModel
+
+    def should_update(self, instance, **kwargs):
+        return instance.foo != 'skip'
+
+
+class DependentMockSearchIndex(indexes.SearchIndex, indexes.Indexable):
+    text = indexes.CharField(document=True, model_attr='author')
+    pub_date = indexes.DateTimeField(model_attr='pub_date')
+    tag = indexes.CharField(model_attr='tag__name')
+
+    def get_model(self):
+        return MockModel
+
+
+class RealtimeSignalProcessorTestCase(TestCase):
+    def setUp(self):
+        super(RealtimeSignalProcessorTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[DependentMockSearchIndex()])
+        connections['default']._index = self.ui
+
+        self.tag = MockTag.objects.create(name='primary')
+        self.update = patch.object(connections['default'].get_backend(), 'update').start()
+        self.processor = RealtimeSignalProcessor(connections, connection_router)
+
+    def tearDown(self):
+        self.processor.teardown()
+        patch.stopall()
+        connections['default']._index = self.old_ui
+        super(RealtimeSignalProcessorTestCase, self).tearDown()
+
+    def test_skips_unchanged_dependencies(self):
+        obj = MockModel.objects.create(author='daniel1', tag=self.tag)
+        self.assertEqual(self.update.call_count, 1)
+
+        # Only fields the documents don't use changed.
+        obj.foo = 'bar'
+        obj.save()
+        obj = MockModel.objects.get(pk=obj.pk)
+        obj.foo = 'baz'
+        obj.save()
+        obj.author = 'daniel2'
+        obj.save(update_fields=['foo'])
+        self.assertEqual(self.update.call_count, 1)
+
+        obj.save()
+        self.assertEqual(self.update.call_count, 2)
+        obj.save()
+        self.assertEqual(self.update.call_count, 2)
+
+        obj = MockModel.objects.only('foo').get(pk=obj.pk)
+        obj.foo = 'qux'
+        obj.save()
+        self.assertEqual(self.update.call_count, 2)
+
+    def test_propagates_related_changes(self):
+        other_tag = MockTag.objects.create(name='secondary')
+        objs = [MockModel.objects.create(author='daniel%s' % i, tag=self.tag) for i in range(3)]
+        MockModel.objects.create(author='daniel3', tag=other_tag)
+        self.update.reset_mock()
+        patch.object(connections['default'].get_backend(), 'batch_size', 2).start()
+
+        self.tag.name = 'renamed'
+        self.tag.save()
+
+        # The tagged objects are reindexed in batches.
+        self.assertEqual([sorted(obj.pk for obj in call[0][1]) for call in self.update.call_args_list],
+                         [[objs[0].pk, objs[1].pk], [objs[2].pk]])
+        self.assertEqual(self.update.call_args[0][1][0].tag.name, 'renamed')
+
+        # Nothing the documents use changed.
+        self.update.reset_mock()
+        self.tag.save()
+        MockTag.objects.get(pk=self.tag.pk).save()
+        self.assertFalse(self.update.called)
+
+    def test_fan_out(self):
+        mirror = {'ENGINE': 'test_searchstack.mocks.MockEngine'}
+        patch.dict(connections.connections_info, {'mirror': mirror}).start()
+        self.addCleanup(connections._connections.pop, 'mirror', None)
+        connections['mirror']._index = self.ui
+        default_send = patch.object(connections['default'].get_backend(), 'send_prepared').start()
+        mirror_send = patch.object(connections['mirror'].get_backend(), 'send_prepared').start()
+        patch.object(connection_router, 'for_write', return_value=['default', 'mirror']).start()
+
+        with patch.object(DependentMockSearchIndex, 'full_prepare', return_value={}) as full_prepare:
+            MockModel.objects.create(author='daniel1', tag=self.tag)
+
+        # Prepared once & sent to both connections.
+        self.assertEqual(full_prepare.call_count, 1)
+        self.assertEqual(default_send.call_count, 1)
+        self.assertEqual(mirror_send.call_count, 1)
+        self.assertFalse(self.update.called)
+
+    def test_init_skips_untracked_models(self):
+        MockTag(name='secondary')
+        self.assertIn(MockTag, self.processor.get_tracked_models())
+        self.assertNotIn(AnotherMockModel, self.processor.get_tracked_models())
+
+        # Once the tracked models are known, only their instances are seen.
+        with patch('searchstack.signals.take_snapshot') as take_snapshot:
+            with patch.object(self.processor, 'get_tracked_models') as get_tracked_models:
+                AnotherMockModel(author='daniel1')
+                self.assertFalse(take_snapshot.called)
+                self.assertFalse(get_tracked_models.called)
+
+            MockTag(name='secondary')
+            self.assertEqual(take_snapshot.call_count, 1)
+
+        # Until the indexes change.
+        self.ui.build(indexes=[BatchingMockSearchIndex()])
+        self.assertIsNone(self.processor._init_senders)
+        MockTag(name='secondary')
+        self.assertNotIn(MockTag, self.processor._init_senders)
+
+    def test_follows_index_changes(self):
+        self.assertEqual(len(self.processor.get_dependents(MockTag)), 1)
+        self.assertTrue(self.processor.tracks_changes(MockTag))
+
+        # Answered from the caches until the indexes change.
+        with patch.object(self.ui, 'get_indexes') as get_indexes:
+            self.assertTrue(self.processor.tracks_changes(MockTag))
+            self.assertEqual(len(self.processor.get_dependents(MockTag)), 1)
+            self.assertFalse(get_indexes.called)
+
+        # Rebuilt in place.
+        self.ui.build(indexes=[BatchingMockSearchIndex()])
+        self.assertEqual(self.processor.get_dependents(MockTag), [])
+        self.assertFalse(self.processor.tracks_changes(MockTag))
+
+        # Replaced.
+        ui = UnifiedIndex()
+        ui.build(indexes=[DependentMockSearchIndex()])
+        connections['default']._index = ui
+        self.assertEqual(len(self.processor.get_dependents(MockTag)), 1)
+        self.assertTrue(self.processor.tracks_changes(MockTag))
+
+    @override_settings(SEARCHSTACK_RELATED_UPDATE_LIMIT=2)
+    def test_propagation_limit(self):
+        for i in range(3):
+            MockModel.objects.create(author='daniel%s' % i, tag=self.tag)
+
+        self.update.reset_mock()
+        self.tag.name = 'renamed'
+
+        with patch.object(self.processor.log, 'warning') as warning:
+            self.tag.save()
+
+        self.assertFalse(self.update.called)
+        self.assertEqual(warning.call_count, 1)
+
+
+class BatchingSignalProcessorTestCase(TransactionTestCase):
+    available_apps = ['test_searchstack.core']
+
+    def setUp(self):
+        super(BatchingSignalProcessorTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.bmsi = BatchingMockSearchIndex()
+        self.ui.build(indexes=[self.bmsi])
+        connections['default']._index = self.ui
+
+        self.tag = MockTag.objects.create(name='primary')
+        backend = connections['default'].get_backend()
+        self.update = patch.object(backend, 'update').start()
+        self.remove_many = patch.object(backend, 'remove_many').start()
+        self.processor = BatchingSignalProcessor(connections, connection_router)
+
+    def tearDown(self):
+        self.processor.teardown()
+        patch.stopall()
+        connections['default']._index = self.old_ui
+        super(BatchingSignalProcessorTestCase, self).tearDown()
+
+    def updated(self):
+        return [[obj.pk for obj in call[0][1]] for call in self.update.call_args_list]
+
+    def removed(self):
+        return [call[0][0] for call in self.remove_many.call_args_list]
+
+    def test_batches_transaction(self):
+        with transaction.atomic():
+            first = MockModel.objects.create(author='daniel1', tag=self.tag)
+            second = MockModel.objects.create(author='daniel2', tag=self.tag)
+            third = MockModel.objects.create(author='daniel3', tag=self.tag)
+            first.author = 'daniel4'
+            first.save()
+            third_pk = third.pk
+            third.delete()
+
+            self.assertFalse(self.update.called)
+            self.assertFalse(self.remove_many.called)
+
+        # One update & one removal, whatever the number of changes.
+        self.assertEqual(self.updated(), [[first.pk, second.pk]])
+        self.assertEqual(self.removed(), [['core.mockmodel.%s' % third_pk]])
+        self.assertEqual(self.update.call_args[0][1][0].author, 'daniel4')
+
+    def test_should_update(self):
+        with transaction.atomic():
+            MockModel.objects.create(author='daniel1', foo='skip', tag=self.tag)
+
+        self.assertFalse(self.update.called)
+
+    def test_rollback(self):
+        with transaction.atomic():
+            kept = MockModel.objects.create(author='daniel1', tag=self.tag)
+
+            try:
+                with transaction.atomic():
+                    MockModel.objects.create(author='daniel2', tag=self.tag)
+                    kept.author = 'daniel3'
+                    kept.save()
+                    raise ValueError
+            except ValueError:
+                pass
+
+        # What is sent is read back from the database, not the rolled back
+        # instances.
+        self.assertEqual(self.updated(), [[kept.pk]])
+        self.assertEqual(self.update.call_args[0][1][0].author, 'daniel1')
+
+        self.update.reset_mock()
+        self.remove_many.reset_mock()
+
+        try:
+            with transaction.atomic():
+                MockModel.objects.create(author='daniel4', tag=self.tag)
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertFalse(self.update.called)
+
+    def test_propagates_related_changes(self):
+        self.processor.teardown()
+        self.ui.build(indexes=[DependentMockSearchIndex()])
+        self.processor = BatchingSignalProcessor(connections, connection_router)
+        objs = [MockModel.objects.create(author='daniel%s' % i, tag=self.tag) for i in range(3)]
+        self.update.reset_mock()
+
+        with transaction.atomic():
+            self.tag.name = 'renamed'
+            self.tag.save()
+            objs[0].author = 'daniel4'
+            objs[0].save()
+
+        # The object saved directly & through its tag is only sent once.
+        self.assertEqual(self.updated(), [[obj.pk for obj in objs]])
+        self.assertEqual(self.update.call_args[0][1][0].author, 'daniel4')
+
+    def test_autocommit(self):
+        obj = MockModel.objects.create(author='daniel1', tag=self.tag)
+        self.assertEqual(self.updated(), [[obj.pk]])
+
+        obj_pk = obj.pk
+        obj.delete()
+        self.assertEqual(self.removed(), [['core.mockmodel.%s' % obj_pk]])
+
+
+class QueuedSignalProcessorTestCase(TransactionTestCase):
+    available_apps = ['test_searchstack.core']
+
+    def setUp(self):
+        super(QueuedSignalProcessorTestCase, self).setUp()
+        self.old_ui = connections['default'].get_unified_index()
+        self.ui = UnifiedIndex()
+        self.ui.build(indexes=[BatchingMockSearchIndex()])
+        connections['default']._index = self.ui
+
+        self.tag = MockTag.objects.create(name='primary')
+        self.update = patch.object(connections['default'].get_backend(), 'update').start()
+        self.queue = IndexQueue()
+        self.queue.clear()
+        self.processor = QueuedSignalProcessor(connections, connection_router)
+
+    def tearDown(self):
+        self.processor.teardown()
+        patch.stopall()
+        self.queue.clear()
+        self.queue.close()
+        self.processor.queue.close()
+        connections['default']._index = self.old_ui
+        super(QueuedSignalProcessorTestCase, self).tearDown()
+
+    def queued(self):
+        entries = self.queue.claim(100, 0)
+        return [(action, model, pk, using) for entry_id, action, model, pk, using, attempts in entries]
+
+    def test_enqueues_on_commit(self):
+        with transaction.atomic():
+            obj = MockModel.objects.create(author='daniel1', tag=self.tag)
+            MockModel.objects.create(author='daniel2', foo='skip', tag=self.tag)
+            self.assertEqual(self.queued(), [])
+
+        obj_pk = obj.pk
+        obj.delete()
+
+        self.assertEqual(self.queued(), [('update', 'core.mockmodel', '%s' % obj_pk, 'default'),
+                                         ('delete', 'core.mockmodel', '%s' % obj_pk, 'default')])
+        self.assertFalse(self.update.called)
+
+    def test_rollback(self):
+        try:
+            with transaction.atomic():
+                MockModel.objects.create(author='daniel1', tag=self.tag)
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertEqual(self.queued(), [])
+
+    def test_propagates_related_changes(self):
+        self.processor.teardown()
+        self.ui.build(indexes=[DependentMockSearchIndex()])
+        self.processor = QueuedSignalProcessor(connections, connection_router)
+        obj = MockModel.objects.create(author='daniel1', tag=self.tag)
+        self.queue.clear()
+
+        self.tag.name = 'renamed'
+        self.tag.save()
+        self.assertEqual(self.queued(), [('update', 'core.mockmodel', '%s' % obj.pk, 'default')])
+
+    def test_requires_absolute_state_file(self):
+        for path in (None, 'searchstack_state.sqlite3'):
+            with override_settings(SEARCHSTACK_STATE_FILE=path):
+                self.assertRaises(ImproperlyConfigured, QueuedSignalProcessor, connections, connection_router)
@@ -3,9 +3,11 @@ from __future__ import unicode_literals
 
 from django.test import TestCase
 from django.test.utils import override_settings
-from .core.models import MockModel
+from .core.models import MockModel, MockTag
 
 from searchstack.utils import _lookup_identifier_method, get_facet_field_name, get_identifier, Highlighter, log
+from searchstack.utils.relations import related_lookups, resolve_relations
+from searchstack.utils.state import remaining_ranges
 
 
 class GetIdentifierTestCase(TestCase):
@@ -187,3 +189,41 @@ class LoggingFacadeTestCase(TestCase):
         self.assertFalse(l.was_called, msg='sanity check')
         l.error()
         self.assertTrue(l.was_called)
+
+
+class RelatedLookupsTestCase(TestCase):
+    def test_resolve_relations(self):
+        self.assertEqual([name for name, field in resolve_relations(MockModel, ('tag', 'name'))], ['tag'])
+        self.assertEqual(resolve_relations(MockModel, ('author',)), [])
+        self.assertEqual(resolve_relations(MockModel, ('hello',)), [])
+
+        relations = resolve_relations(MockTag, ('mockmodel_set', 'tag', 'name'))
+        self.assertEqual([name for name, field in relations], ['mockmodel_set', 'tag'])
+        self.assertEqual(relations[0][1].related_model, MockModel)
+
+    def test_related_lookups(self):
+        self.assertEqual(related_lookups(MockModel, [('author',), ('tag', 'name'), ('tag', 'pk')]), (['tag'], []))
+        self.assertEqual(related_lookups(MockModel, [('tag',)]), (['tag'], []))
+        self.assertEqual(related_lookups(MockModel, [('tag', 'mockmodel_set', 'all')]),
+                         (['tag'], ['tag__mockmodel_set']))
+        self.assertEqual(related_lookups(MockTag, [('mockmodel_set', 'all'), ('mockmodel_set', 'tag', 'name')]),
+                         ([], ['mockmodel_set__tag']))
+
+
+class RemainingRangesTestCase(TestCase):
+    def test_nothing_completed(self):
+        self.assertEqual(remaining_ranges([], int), [(None, None)])
+
+    def test_contiguous(self):
+        completed = [(None, '10'), ('10', '20'), ('20', '35')]
+        self.assertEqual(remaining_ranges(completed, int), [(35, None)])
+
+    def test_gaps(self):
+        # As left behind by workers finishing out of order.
+        completed = [('10', '20'), ('30', '40'), ('20', '25')]
+        self.assertEqual(remaining_ranges(completed, int), [(None, 10), (25, 30), (40, None)])
+
+    def test_compares_pks(self):
+        # '9' sorts after '10' as text, but not as a pk.
+        completed = [(None, '9'), ('10', '100')]
+        self.assertEqual(remaining_ranges(completed, int), [(9, 10), (100, None)])
@@ -5,9 +5,10 @@ from threading import Thread
 
 from django import forms
 from django.core.urlresolvers import reverse
-from django.http import HttpRequest, QueryDict
+from django.http import Http404, HttpRequest, QueryDict
 from django.test import TestCase
 from django.utils.six.moves import queue
+from mock import patch
 from .core.models import AnotherMockModel, MockModel
 
 from searchstack import connections, indexes
@@ -96,6 +97,37 @@ class SearchViewTestCase(TestCase):
         response = self.client.get(reverse('searchstack_search'), {'q': 'haystack', 'page': 2})
         self.assertEqual(response.status_code, 404)
 
+    def test_single_search(self):
+        backend = connections['default'].get_backend()
+
+        with patch.object(backend, 'search', wraps=backend.search) as search:
+            response = self.client.get(reverse('searchstack_search'), {'q': 'haystack'})
+
+        # The page, the hit count & the facets come from the same request.
+        self.assertEqual(response.context[-1]['paginator'].count, 3)
+        self.assertEqual(search.call_count, 1)
+
+    def test_cursor_pagination(self):
+        request = HttpRequest()
+        request.GET = QueryDict('q=haystack')
+        backend = connections['default'].get_backend()
+
+        with patch.object(backend, 'search', wraps=backend.search) as search:
+            response = SearchView(cursor_pagination=True, results_per_page=2)(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(search.call_args[1]['sort_by'], ['django_ct', 'django_id'])
+
+        view = SearchView(cursor_pagination=True, results_per_page=2)
+        view(request)
+        paginator, page = view.build_page()
+        self.assertEqual(len(page.object_list), 2)
+        self.assertTrue(page.has_next())
+
+        request.GET = QueryDict('q=haystack&cursor=nope')
+        self.assertRaises(Http404, view, request)
+
     def test_thread_safety(self):
         exceptions = []
 